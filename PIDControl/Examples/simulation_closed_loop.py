@@ -0,0 +1,88 @@
+"""
+# Example: test the tuning of PID4Fiware offline, faster than real time.
+
+Many thermal zones are simulated with the vectorized model in `simulation_model.py` in closed loop
+with the control algorithm of PID4Fiware (one zone) or MultiPID4Fiware (one loop per zone). No
+FIWARE platform is needed, the controller parameters are read from the config files, e.g.
+
+    python simulation_closed_loop.py --zones 100 --days 14 --kp 2000 --ki 20
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("HISTORY_DEPTH", "0")
+from PID4FIWARE import PID4Fiware, MultiPID4Fiware
+from simulation_model import MultiZoneSimulationModel
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "config")
+
+
+def create_controller(n_zones: int, config_path: str, parameters: dict):
+    """
+    Create a PID4Fiware for one zone or a MultiPID4Fiware with one loop per zone. The config files of
+    the multi-loop controller are written to config_path.
+    """
+    if n_zones == 1:
+        controller = PID4Fiware(config_path=os.path.join(CONFIG_PATH, "pid"))
+    else:
+        with open(os.path.join(CONFIG_PATH, "multi_pid", "controller.json"), "r") as f:
+            controller_dict = json.load(f)
+        loops = [{"input": {"id": f"urn:ngsi-ld:TemperatureSensor:{i:03d}", "type": "TemperatureSensor",
+                            "attr": "temperature"},
+                  "command": {"id": f"urn:ngsi-ld:Heater:{i:03d}", "type": "Heater", "attr": "heaterPower"}}
+                 for i in range(n_zones)]
+        for name, content in (("loops.json", loops), ("controller.json", controller_dict)):
+            with open(os.path.join(config_path, name), "w") as f:
+                json.dump(content, f)
+        controller = MultiPID4Fiware(config_path=config_path)
+    for name, value in parameters.items():
+        if value is not None:
+            controller.parameter_values.set(controller.controller_entity.id, name, value)
+    return controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop simulation of thermal zones with PID4Fiware")
+    parser.add_argument("--zones", type=int, default=10, help="number of zones")
+    parser.add_argument("--days", type=float, default=14, help="simulated time in days")
+    parser.add_argument("--com-step", type=int, default=60, help="sampling time of the controller in second")
+    parser.add_argument("--dt", type=int, default=60, help="integration step of the model in second")
+    parser.add_argument("--kp", type=float, help="proportional gain, from controller.json if not given")
+    parser.add_argument("--ki", type=float, help="integral gain, from controller.json if not given")
+    parser.add_argument("--kd", type=float, help="derivative gain, from controller.json if not given")
+    parser.add_argument("--setpoint", type=float, help="setpoint in °C, from controller.json if not given")
+    args = parser.parse_args()
+
+    t_end = int(args.days * 24 * 60 * 60)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as config_path:
+        controller = create_controller(args.zones, config_path, {"kp": args.kp, "ki": args.ki, "kd": args.kd,
+                                                                 "setpoint": args.setpoint})
+    # zones with different insulation and start temperatures
+    model = MultiZoneSimulationModel(n_zones=args.zones, t_end=t_end, dt=args.dt,
+                                     temp_start=rng.uniform(10, 20, args.zones),
+                                     ua=rng.uniform(80, 160, args.zones))
+    start = time.perf_counter()
+    history = model.run_closed_loop(controller, com_step=args.com_step)
+    elapsed = time.perf_counter() - start
+
+    setpoint = np.asarray(controller.parameter("setpoint"), dtype=np.float64)
+    settled = history["time"] >= 24 * 60 * 60  # after the first day
+    error = history["t_zone"][settled] - setpoint
+    print(f"Simulated {args.zones} zones for {args.days} days in {elapsed:.2f} s "
+          f"({t_end * args.zones / elapsed:.3g} zone seconds per second)")
+    if settled.any():
+        print(f"After the first day: mean absolute error {np.mean(np.abs(error)):.3f} K, "
+              f"maximal error {np.max(np.abs(error)):.3f} K, "
+              f"mean heating power {np.mean(history['heater_power'][settled]):.0f} W")
+
+
+if __name__ == '__main__':
+    main()
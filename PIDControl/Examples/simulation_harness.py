@@ -0,0 +1,266 @@
+"""
+# Example: closed-loop simulation of PID4Fiware without the FIWARE platform.
+
+The simulated thermal zones are connected to the unchanged PID4Fiware code: the controllers read the
+zone temperatures from and send the heater commands to an in-memory fake of the Orion context broker
+(see controller4fiware/fake_orion.py), with the same requests as in operation. All controllers and
+the simulation model run on one virtual clock, so hold_sampling_time() advances the simulation
+instead of sleeping. Weeks of operation take seconds, which allows regression tests of the control
+quality and of the throughput, e.g. in CI:
+
+    python simulation_harness.py --zones 20 --days 14 --max-mae 0.2 --json results.json
+
+By default, one MultiPID4Fiware controls all zones, with --fleet one PID4Fiware per zone is used.
+The environment variables of the controllers apply, e.g. BATCH_MODE=true.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("HISTORY_DEPTH", "0")
+from controller4fiware.config import ConfigCache
+from controller4fiware.fake_orion import FakeOrion
+from controller4fiware.provisioning import EntityProvisioner
+from controller4fiware.scheduler import VirtualClock
+from PID4FIWARE import PID4Fiware, MultiPID4Fiware
+from simulation_model import MultiZoneSimulationModel
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "config")
+
+
+def zone_entity_ids(n_zones: int) -> List[Tuple[str, str]]:
+    """
+    The ids of the temperature sensor and the heater of each zone
+    """
+    return [(f"urn:ngsi-ld:TemperatureSensor:{i:03d}", f"urn:ngsi-ld:Heater:{i:03d}") for i in range(n_zones)]
+
+
+def write_configs(config_path: str, n_zones: int, fleet: bool = False, parameters: dict = None) -> list:
+    """
+    Write the config files for the zones, either of one MultiPID4Fiware with one loop per zone or of
+    a fleet of PID4Fiware with one controller per zone.
+
+    Args:
+        config_path: directory for the config files
+        n_zones: number of zones
+        fleet: whether to use one PID4Fiware per zone
+        parameters: controller parameters, which replace the ones in config/pid/controller.json
+
+    Returns:
+        the controller classes and their config paths
+    """
+    with open(os.path.join(CONFIG_PATH, "pid", "controller.json"), "r") as f:
+        controller_dict = json.load(f)
+    for name, value in (parameters or {}).items():
+        if value is not None:
+            controller_dict[name]["value"] = value
+    zones = zone_entity_ids(n_zones)
+    if fleet:
+        configs = [(PID4Fiware, os.path.join(config_path, f"zone{i:03d}")) for i in range(n_zones)]
+        files = [{"input.json": [{"id": sensor_id, "type": "TemperatureSensor",
+                                  "temperature": {"type": "Number", "value": None, "metadata": {}}}],
+                  "output.json": [],
+                  "command.json": [{"id": heater_id, "type": "Heater",
+                                    "heaterPower": {"type": "command", "value": "", "metadata": {}}}],
+                  "controller.json": dict(controller_dict, id=f"urn:ngsi-ld:PIDController:{i:03d}")}
+                 for i, (sensor_id, heater_id) in enumerate(zones)]
+    else:
+        configs = [(MultiPID4Fiware, os.path.join(config_path, "multi"))]
+        loops = [{"input": {"id": sensor_id, "type": "TemperatureSensor", "attr": "temperature"},
+                  "command": {"id": heater_id, "type": "Heater", "attr": "heaterPower"}}
+                 for sensor_id, heater_id in zones]
+        files = [{"loops.json": loops, "controller.json": controller_dict}]
+    for (_, path), content in zip(configs, files):
+        os.makedirs(path, exist_ok=True)
+        for name, data in content.items():
+            with open(os.path.join(path, name), "w") as f:
+                json.dump(data, f)
+    return configs
+
+
+class SimulationHarness:
+    """
+    Closed loop of a simulation model and controllers through an in-memory Orion. The zone
+    temperatures are written to the attribute "temperature" of the sensor entities, and the commands
+    "heaterPower" of the heater entities are applied to the model as heating power.
+
+    The controllers are created by the harness, since they must use its context broker. Their
+    schedulers and pid instances run on the virtual clock, which steps the model whenever the first
+    controller waits for its next cycle. All controllers use the communication step as sampling time.
+
+    Args:
+        model: a SimulationModel or a MultiZoneSimulationModel
+        configs: the controller classes and their config paths, e.g. from write_configs()
+        zones: the ids of the sensor and the heater of each zone, zone_entity_ids() if not given
+        com_step: communication step, i.e. the sampling time of the controllers, in seconds
+    """
+    def __init__(self, model, configs: list, zones: List[Tuple[str, str]] = None, com_step: int = 60):
+        self.model = model
+        self.n_zones = getattr(model, "n_zones", 1)
+        self.zones = zones if zones is not None else zone_entity_ids(self.n_zones)
+        assert len(self.zones) == self.n_zones, f"{len(self.zones)} zones for a model with {self.n_zones} zones"
+        self.com_step = com_step
+        self.clock = VirtualClock(start=model.t_sim)
+        self.clock.listeners.append(self._advance)
+
+        self.orion = FakeOrion()
+        os.environ["CB_URL"] = self.orion.url
+        self.orion.add_entities([entity for sensor_id, heater_id in self.zones for entity in (
+            {"id": sensor_id, "type": "TemperatureSensor",
+             "temperature": {"type": "Number", "value": None, "metadata": {}}},
+            {"id": heater_id, "type": "Heater",
+             "heaterPower": {"type": "command", "value": "", "metadata": {}}})])
+        self._publish()
+
+        self.controllers = [controller_class(config_path=path, session=self.orion.session())
+                            for controller_class, path in configs]
+        # all controller entities with one batch request, without caching the provisioning
+        EntityProvisioner(client=self.controllers[0].ORION_CB, cache=ConfigCache(directory="")).provision(
+            entities=[controller.controller_entity_with_values() for controller in self.controllers])
+        for controller in self.controllers:
+            controller.sampling_time = com_step
+            controller.scheduler.clock = self.clock.time
+            controller.scheduler.sleep = self.clock.sleep
+            controller.scheduler.start()
+            controller.pid.time_fn = self.clock.time
+            controller.pid.reset()
+
+    def _publish(self):
+        """
+        Write the zone temperatures to the sensor entities
+        """
+        for (sensor_id, _), t_zone in zip(self.zones, np.atleast_1d(self.model.t_zone).tolist()):
+            self.orion.set_value(sensor_id, "temperature", t_zone)
+
+    def _apply_commands(self):
+        """
+        Apply the heater commands as heating power, commands without value are 0 W
+        """
+        power = np.array([self.orion.get_value(heater_id, "heaterPower") or 0.0 for _, heater_id in self.zones],
+                         dtype=np.float64)
+        self.model.heater_power = power if self.n_zones > 1 else power[0]
+
+    def _advance(self, now: float):
+        self.model.do_step(int(round(now)))
+        self._publish()
+
+    def run(self, t_end: int = None) -> dict:
+        """
+        Run the closed loop until the end time
+
+        Args:
+            t_end: simulation end time in seconds, the end time of the model if not given
+
+        Returns:
+            the history as arrays: "time" and "t_amb" with one value per communication step,
+            "t_zone" and "heater_power" with one column per zone, and the throughput: "cycles",
+            "requests" to the context broker and "wall_time" in seconds
+        """
+        t_end = self.model.t_end if t_end is None else t_end
+        times = np.arange(self.clock.time(), t_end, self.com_step)
+        history = {"time": times,
+                   "t_amb": np.empty(len(times)),
+                   "t_zone": np.empty((len(times), self.n_zones)),
+                   "heater_power": np.empty((len(times), self.n_zones))}
+        self.orion.reset_requests()
+        start = time.perf_counter()
+        for i in range(len(times)):
+            for controller in self.controllers:
+                controller.control_step()
+            self._apply_commands()
+            history["t_amb"][i] = self.model.t_amb
+            history["t_zone"][i] = self.model.t_zone
+            history["heater_power"][i] = self.model.heater_power
+            # the first controller advances the clock, the others are due at the same time
+            for controller in self.controllers:
+                controller.hold_sampling_time()
+        history["wall_time"] = time.perf_counter() - start
+        history["cycles"] = len(times) * len(self.controllers)
+        history["requests"] = self.orion.reset_requests()
+        return history
+
+
+def control_quality(history: dict, setpoint, t_settle: float = 24 * 60 * 60) -> dict:
+    """
+    Control quality and energy of a closed-loop simulation
+
+    Args:
+        history: the history returned by SimulationHarness.run()
+        setpoint: the setpoint in °C, a scalar or one value per zone
+        t_settle: the errors before this time are ignored, e.g. the heating up
+
+    Returns:
+        mean absolute, root mean square and maximal control error in K after the settling time,
+        and the mean heating energy per zone in kWh
+    """
+    settled = history["time"] >= t_settle
+    error = history["t_zone"][settled] - np.asarray(setpoint, dtype=np.float64)
+    step = history["time"][1] - history["time"][0] if len(history["time"]) > 1 else 0
+    return {"mae": float(np.mean(np.abs(error))) if error.size else float("nan"),
+            "rmse": float(np.sqrt(np.mean(error ** 2))) if error.size else float("nan"),
+            "max_error": float(np.max(np.abs(error))) if error.size else float("nan"),
+            "energy_kwh": float(np.sum(history["heater_power"]) * step / 3.6e6 / history["t_zone"].shape[1])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Closed-loop simulation of PID4Fiware with an in-memory Orion")
+    parser.add_argument("--zones", type=int, default=10, help="number of zones")
+    parser.add_argument("--days", type=float, default=14, help="simulated time in days")
+    parser.add_argument("--com-step", type=int, default=60, help="sampling time of the controllers in second")
+    parser.add_argument("--dt", type=int, default=60, help="integration step of the model in second")
+    parser.add_argument("--fleet", action="store_true", help="one PID4Fiware per zone instead of one MultiPID4Fiware")
+    parser.add_argument("--kp", type=float, help="proportional gain, from config/pid if not given")
+    parser.add_argument("--ki", type=float, help="integral gain, from config/pid if not given")
+    parser.add_argument("--kd", type=float, help="derivative gain, from config/pid if not given")
+    parser.add_argument("--setpoint", type=float, help="setpoint in °C, from config/pid if not given")
+    parser.add_argument("--max-mae", type=float, help="fail if the mean absolute error exceeds this value in K")
+    parser.add_argument("--min-speedup", type=float,
+                        help="fail if the simulation is slower than this factor of real time")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    t_end = int(args.days * 24 * 60 * 60)
+    rng = np.random.default_rng(0)
+    # zones with different insulation and start temperatures
+    model = MultiZoneSimulationModel(n_zones=args.zones, t_end=t_end, dt=args.dt,
+                                     temp_start=rng.uniform(10, 20, args.zones),
+                                     ua=rng.uniform(80, 160, args.zones))
+    with tempfile.TemporaryDirectory() as config_path:
+        configs = write_configs(config_path, args.zones, fleet=args.fleet,
+                                parameters={"kp": args.kp, "ki": args.ki, "kd": args.kd, "setpoint": args.setpoint})
+        harness = SimulationHarness(model=model, configs=configs, com_step=args.com_step)
+        history = harness.run()
+
+    setpoint = [controller.parameter("setpoint") for controller in harness.controllers]
+    results = control_quality(history, setpoint=setpoint if args.fleet else setpoint[0])
+    results.update(cycles=history["cycles"], requests=history["requests"], wall_time=history["wall_time"],
+                   speedup=t_end / history["wall_time"])
+    print(f"Simulated {args.zones} zones with {len(harness.controllers)} controllers for {args.days} days "
+          f"in {results['wall_time']:.2f} s ({results['speedup']:.3g} times faster than real time)")
+    print(f"{results['cycles']} control cycles, {results['requests']} requests "
+          f"({results['cycles'] / results['wall_time']:.0f} cycles per second)")
+    print(f"After the first day: mean absolute error {results['mae']:.3f} K, "
+          f"maximal error {results['max_error']:.3f} K, heating energy {results['energy_kwh']:.1f} kWh per zone")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    failed = []
+    if args.max_mae is not None and not results["mae"] <= args.max_mae:
+        failed.append(f"Mean absolute error {results['mae']:.3f} K exceeds {args.max_mae} K")
+    if args.min_speedup is not None and results["speedup"] < args.min_speedup:
+        failed.append(f"Speedup {results['speedup']:.3g} is below {args.min_speedup}")
+    if failed:
+        print("\n".join(failed))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -100,3 +100,191 @@ class SimulationModel:
         """
         q_h = float(power)
         self.q_h = q_h
+
+
+class MultiZoneSimulationModel:
+    """
+    Vectorized version of SimulationModel, which simulates many thermal zones at once. The states of
+    all zones are NumPy arrays, and the linear model of zone and heater is discretized exactly
+    (zero-order hold of the heater power and of the mean ambient temperature of each integration step).
+    The discretization is stable for any integration step, so that steps of minutes instead of
+    seconds can be used, and the ambient temperature of the whole simulation is precomputed. Weeks of
+    simulated time therefore take seconds, also in closed loop with a controller, see run_closed_loop().
+
+    The parameters of the zones are scalars for all zones or arrays with one value per zone.
+
+    Args:
+        n_zones: number of zones
+        t_start: simulation start time in seconds
+        t_end: simulation end time in seconds, the ambient temperature is precomputed until then
+        dt: model integration step in seconds
+        temp_max: maximal ambient temperature in °C
+        temp_min: minimal ambient temperature in °C
+        temp_start: initial zone temperature in °C
+        ua: heat transfer coefficient of the zone envelope in W/K
+        c_p: heat capacity of the zone in J/K
+        heater_power: initial heating power in W
+    """
+
+    def __init__(self,
+                 n_zones: int = 1,
+                 t_start: int = 0,
+                 t_end: int = 24 * 60 * 60,
+                 dt: int = 60,
+                 temp_max: float = 10,
+                 temp_min: float = -5,
+                 temp_start=20,
+                 ua=120,
+                 c_p=612.5 * 100,
+                 heater_power=2000):
+        self.n_zones = n_zones
+        self.t_start = t_start
+        self.t_end = t_end
+        self.dt = dt
+        self.temp_max = temp_max
+        self.temp_min = temp_min
+        self.ua = np.broadcast_to(np.asarray(ua, dtype=np.float64), (n_zones,))
+        self.c_p = np.broadcast_to(np.asarray(c_p, dtype=np.float64), (n_zones,))
+        self.heat_transfer_heater = 100
+        self.c_p_heater = 0.2 * self.c_p  # heat capacity of the heater
+        self.q_h = np.zeros(n_zones)
+        self.heater_power = heater_power
+        self.t_sim = t_start
+        self.t_zone = np.full(n_zones, 0.0) + temp_start
+        self.t_heater = self.t_zone.copy()
+        # the continuous model x' = A x + B [q_h, t_amb] with the states x = [t_heater, t_zone]
+        h = self.heat_transfer_heater
+        self._a = np.zeros((n_zones, 2, 2))
+        self._a[:, 0, 0], self._a[:, 0, 1] = -h / self.c_p_heater, h / self.c_p_heater
+        self._a[:, 1, 0], self._a[:, 1, 1] = h / self.c_p, -(h + self.ua) / self.c_p
+        self._b = np.zeros((n_zones, 2, 2))
+        self._b[:, 0, 0] = 1 / self.c_p_heater
+        self._b[:, 1, 1] = self.ua / self.c_p
+        self._discretizations = {}
+        # mean ambient temperature of each integration step until the end of the simulation
+        grid = np.arange(t_start, t_end + dt, dt, dtype=np.float64)
+        self.ambient_profile = self.mean_ambient_temperature(grid[:-1], grid[1:])
+
+    def ambient_temperature(self, t):
+        """
+        The ambient temperature at the times t in °C, the same cosine as in SimulationModel
+        """
+        return -(self.temp_max - self.temp_min) / 2 * np.cos(2 * np.pi * np.asarray(t) / (24 * 60 * 60)) + \
+            self.temp_min + (self.temp_max - self.temp_min) / 2
+
+    def mean_ambient_temperature(self, t0, t1):
+        """
+        The mean ambient temperature between the times t0 and t1 in °C (analytic integral of the cosine)
+        """
+        t0, t1 = np.asarray(t0, dtype=np.float64), np.asarray(t1, dtype=np.float64)
+        omega = 2 * np.pi / (24 * 60 * 60)
+        mean_cos = (np.sin(omega * t1) - np.sin(omega * t0)) / (omega * (t1 - t0))
+        return -(self.temp_max - self.temp_min) / 2 * mean_cos + self.temp_min + (self.temp_max - self.temp_min) / 2
+
+    def _discretize(self, step: float):
+        """
+        The exact discretization x[k+1] = Ad x[k] + Bd u[k] of the model for an integration step,
+        calculated by the eigendecomposition of A of all zones and cached per step
+        """
+        if step not in self._discretizations:
+            eigenvalues, eigenvectors = np.linalg.eig(self._a * step)
+            a_d = np.real(eigenvectors @ (np.exp(eigenvalues)[:, :, None] * np.linalg.inv(eigenvectors)))
+            b_d = np.linalg.solve(self._a, (a_d - np.eye(2)) @ self._b)
+            self._discretizations[step] = a_d, b_d
+        return self._discretizations[step]
+
+    def do_step(self, t_sim: int):
+        """
+        Performs the simulation steps until `t_sim`
+
+        Args:
+            t_sim: simulation step end time in seconds
+
+        Returns:
+            t_sim: simulation step end time in seconds
+            t_amb: ambient temperature in °C
+            t_zone: zone temperatures in °C
+        """
+        while self.t_sim < t_sim:
+            step = min(self.dt, t_sim - self.t_sim)
+            k = (self.t_sim - self.t_start) // self.dt
+            if step == self.dt and (self.t_sim - self.t_start) % self.dt == 0 and k < len(self.ambient_profile):
+                t_amb = self.ambient_profile[k]
+            else:
+                t_amb = self.mean_ambient_temperature(self.t_sim, self.t_sim + step)
+            a_d, b_d = self._discretize(step)
+            t_heater = a_d[:, 0, 0] * self.t_heater + a_d[:, 0, 1] * self.t_zone + \
+                b_d[:, 0, 0] * self.q_h + b_d[:, 0, 1] * t_amb
+            self.t_zone = a_d[:, 1, 0] * self.t_heater + a_d[:, 1, 1] * self.t_zone + \
+                b_d[:, 1, 0] * self.q_h + b_d[:, 1, 1] * t_amb
+            self.t_heater = t_heater
+            self.t_sim += step
+        return self.t_sim, self.t_amb, self.t_zone
+
+    @property
+    def t_amb(self) -> float:
+        """
+        The ambient temperature at the current simulation time in °C
+        """
+        return float(self.ambient_temperature(self.t_sim))
+
+    @property
+    def heater_power(self) -> np.ndarray:
+        """
+        Returns the heating powers of all zones in [W]
+        """
+        return self.q_h
+
+    @heater_power.setter
+    def heater_power(self, power):
+        """
+        Sets the heating powers, a scalar for all zones or an array with one value per zone
+
+        Args:
+            power: heater power in [W]
+        """
+        self.q_h = np.broadcast_to(np.asarray(power, dtype=np.float64), (self.n_zones,)).copy()
+
+    def run_closed_loop(self, controller, com_step: int = 60, t_end: int = None) -> dict:
+        """
+        Simulate the zones in closed loop with a PID controller, without FIWARE in between. In each
+        communication step, the zone temperatures are passed to the controller as measurements, and the
+        output of its control_algorithm() is applied as heating power. The clock of the PID instance is
+        replaced by the simulation time, so that the controller runs as fast as the model.
+
+        Args:
+            controller: a PID4Fiware for one zone or a MultiPID4Fiware with one loop per zone. The
+                parameters are taken from its controller entity, e.g. from controller.json
+            com_step: communication step in seconds, i.e. the sampling time of the controller
+            t_end: simulation end time in seconds, self.t_end if not given
+
+        Returns:
+            the history as arrays: "time" and "t_amb" with one value per communication step,
+            "t_zone", "t_heater" and "heater_power" with one column per zone
+        """
+        t_end = self.t_end if t_end is None else t_end
+        vectorized = np.ndim(getattr(controller.pid, "setpoint", 0)) > 0
+        if (controller.pid.n if vectorized else 1) != self.n_zones:
+            raise ValueError(f"The controller has {controller.pid.n if vectorized else 1} loops "
+                             f"for {self.n_zones} zones")
+        controller.pid.time_fn = lambda: float(self.t_sim)
+        controller.pid.reset()
+
+        times = np.arange(self.t_sim, t_end, com_step)
+        history = {"time": times,
+                   "t_amb": np.empty(len(times)),
+                   "t_zone": np.empty((len(times), self.n_zones)),
+                   "t_heater": np.empty((len(times), self.n_zones)),
+                   "heater_power": np.empty((len(times), self.n_zones))}
+        for i, t in enumerate(times):
+            controller.match_variables()
+            controller.y_act = self.t_zone.copy() if vectorized else float(self.t_zone[0])
+            controller.update_pid()
+            controller.control_algorithm()
+            self.heater_power = np.nan_to_num(np.asarray(controller.u, dtype=np.float64))
+            history["t_amb"][i] = self.t_amb
+            history["t_zone"][i] = self.t_zone
+            history["t_heater"][i] = self.t_heater
+            history["heater_power"][i] = self.q_h
+            self.do_step(int(t + com_step))
+        return history
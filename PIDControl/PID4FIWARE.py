@@ -10,11 +10,29 @@ Updated on Tue Mar 15 15:47:00 2022
 
 PID controller with Fiware interface
 """
+import json
+import math
+import os
+import signal
+import sys
 import time
+from controller4fiware.config import ConfigCache, config_digest
+
+# Fast path of --check-config: a configuration, which has been validated before, is found in the
+# cache without loading FiLiP and the controller framework below
+if __name__ == '__main__' and sys.argv[1:2] == ["--check-config"]:
+    _config_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.getcwd(), "config")
+    _kind = "MultiPID4Fiware" if os.path.isfile(os.path.join(_config_path, "loops.json")) else "Controller4Fiware"
+    if ConfigCache().contains(config_digest(_config_path, kind=_kind)):
+        print(f"Configuration in {_config_path} is valid")
+        sys.exit(0)
+
 from controller4fiware.Controller import Controller4Fiware
+from controller4fiware.AsyncController import AsyncController4Fiware
+from controller4fiware.vector_pid import VectorPID
 import logging
+import numpy as np
 from simple_pid import PID
-import os
 import dotenv
 
 # Get log level from environment variable, default to INFO if not set
@@ -33,11 +51,11 @@ class PID4Fiware(Controller4Fiware):
         dotenv.load_dotenv()
         super().__init__(**kwargs)
         # Create simple pid instance
-        self.pid = PID(Kp=self.controller_entity.kp.value,
-                       Ki=self.controller_entity.ki.value,
-                       Kd=self.controller_entity.kd.value,
-                       setpoint=self.controller_entity.setpoint.value,
-                       output_limits=(self.controller_entity.limLower.value, self.controller_entity.limUpper.value)
+        self.pid = PID(Kp=self.parameter("kp"),
+                       Ki=self.parameter("ki"),
+                       Kd=self.parameter("kd"),
+                       setpoint=self.parameter("setpoint"),
+                       output_limits=(self.parameter("limLower"), self.parameter("limUpper"))
                        )
 
         # create the variables for the pid controller
@@ -46,24 +64,43 @@ class PID4Fiware(Controller4Fiware):
         self.limUpper = None  # upper limit of u
         self.y_act = None  # actual value of process variable y
         self.y_set = None  # setpoint
+        self.pid_params = None  # parameters currently applied to the pid instance
 
     def match_variables(self):
         """
         Match the setpoint and measurement from the controller entity and the sensor entity.
         """
-        self.y_act = self.input_entities[0].get_attributes()[0].value
-        self.y_set = self.controller_entity.setpoint.value
+        self.y_act = self.input_values.values[0]
+        self.y_set = self.parameter("setpoint")
+
+    def on_config_reload(self, changed: set):
+        """
+        Apply the parameters of a reloaded controller entity in the next cycle. The pid instance and
+        its internal state are kept.
+        """
+        if "controller_entity" in changed:
+            self.pid_params = None
+
+    def on_takeover(self):
+        """
+        Start the pid instance without the state of the time before the standby, e.g. the integral
+        """
+        self.pid.reset()
 
     def update_pid(self):
         """
-        Update the instance of simple_pid controller instance.
+        Update the instance of simple_pid controller instance, if the controller parameters have changed.
         """
-        pid_dict = self.controller_entity.model_dump()
+        pid_params = tuple(self.parameter(name) for name in ("kp", "ki", "kd", "limLower", "limUpper", "setpoint"))
+        if pid_params == self.pid_params:
+            return
+        kp, ki, kd, lim_lower, lim_upper, setpoint = pid_params
 
         # Update PID parameters
-        self.pid.tunings = (pid_dict['kp']['value'], pid_dict['ki']['value'], pid_dict['kd']['value'])
-        self.pid.output_limits = (pid_dict['limLower']['value'], pid_dict['limUpper']['value'])
-        self.pid.setpoint = pid_dict['setpoint']['value']
+        self.pid.tunings = (kp, ki, kd)
+        self.pid.output_limits = (lim_lower, lim_upper)
+        self.pid.setpoint = setpoint
+        self.pid_params = pid_params
 
     def control_algorithm(self):
         """
@@ -72,33 +109,225 @@ class PID4Fiware(Controller4Fiware):
         # Calculate the output and commands base on the input, controller parameters and external input
         self.u = self.pid(self.y_act)
 
-        # For multiple outputs system, the best practice is to update the value of outputs/commands with following code
-        for entity in self.command_entities:
-            for _comm in entity.get_attributes():
-                # logging.debug(f"calculate command {_comm.name} to id {entity.id} with type {entity.type}")
-                _comm.value = self.u
-                entity.update_attribute([_comm])
+        # All commands are set to the control variable
+        self.command_values.fill(self.u)
+
+    def control_step(self, read_values: bool = True):
+        """
+        Execute one control cycle of the PID controller without waiting for the sampling time.
+
+        Args:
+            read_values: whether to read the inputs and parameters from the Fiware platform. In event-driven
+                mode, they are already updated by the notifications.
+        """
+        # apply changes of the config files
+        self.reload_config()
+
+        # Update token if run in security mode
+        if self.security_mode:
+            self.update_token()
+
+        # only the leader executes the cycle
+        if not self.check_leadership():
+            return
+
+        if read_values:
+            # update the input
+            logging.debug("read input")
+            self.read_input_variable()
+
+            # update the controller parameters
+            logging.debug("read parameters")
+            self.read_controller_parameter()
+
+        # match variables
+        logging.debug("match")
+        self.match_variables()
+
+        # update controller
+        self.update_pid()
+
+        # execute only when the controller is activated
+        if self.active:
+            # calculate the output and commands
+            logging.debug("algorithm")
+            self.control_algorithm()
+
+            # send commands
+            logging.debug("send")
+            self.send_commands()
 
     def control_cycle(self):
         """
         The control cycle of PID controller. Beside the basic structure defined in Controller4Fiware,
-        match_variables() and update_pid() are also invoked.
+        match_variables() and update_pid() are also invoked. In event-driven mode, the cycle is triggered
+        by the notifications of the Orion context broker instead of the sampling time.
+        """
+        try:
+            if self.event_mode and self.lease is None:
+                # with leader election, only the leader subscribes, see check_leadership()
+                self.subscribe_notifications()
+            start_time = None
+            while True:
+                # in event-driven mode, the values are only polled initially, after standby or if no
+                # notification arrives within the maximum cycle interval
+                read_values = not self.event_mode or start_time is None or self.standby or \
+                    not self.wait_for_notification(last_cycle_time=start_time)
+                start_time = time.time()
+
+                self.control_step(read_values=read_values)
+
+                # wait until next cycle, also if the controller is deactivated or in standby
+                if not self.event_mode or self.standby:
+                    self.hold_sampling_time(start_time=start_time)
+        except Exception as ex:
+            logging.error(str(ex))
+            raise
+
+
+class MultiPID4Fiware(PID4Fiware):
+    """
+    Many PID loops in one controller, which are calculated by one vectorized PID engine. The loops are
+    defined in the config file loops.json, which lists the pairs of sensor and actuator, e.g.
+
+        [{"input": {"id": "urn:ngsi-ld:TemperatureSensor:001", "type": "TemperatureSensor", "attr": "temperature"},
+          "command": {"id": "urn:ngsi-ld:Heater:001", "type": "Heater", "attr": "heaterPower"}}]
+
+    The input and command entities are derived from the loops, so that input.json, output.json and
+    command.json are not required. The parameters in the controller entity are either scalars for all
+    loops or arrays with one value per loop.
+    """
+    def __init__(self, **kwargs):
+        dotenv.load_dotenv()
+        # skip the creation of the single simple_pid instance
+        super(PID4Fiware, self).__init__(**kwargs)
+        self.loops = self._loaded_loops
+        self.match_loops()
+        self.pid = VectorPID(n=len(self.loops))
+        self.loop_order = self.loops  # the loops in the order of the pid engine
+
+        self.u = None  # control variables u
+        self.y_act = None  # actual values of process variables y
+        self.y_set = None  # setpoints
+        self.pid_params = None  # parameters currently applied to the pid engine
+
+    @staticmethod
+    def loop_key(loop: dict) -> tuple:
+        return loop["input"]["id"], loop["input"]["attr"], loop["command"]["id"], loop["command"]["attr"]
+
+    def match_loops(self):
+        """
+        Assign the slots of the input and command values to the loops
+        """
+        self.loop_inputs = [self.input_values.slot(loop["input"]["id"], loop["input"]["attr"])
+                            for loop in self.loops]
+        self.loop_commands = [self.command_values.slot(loop["command"]["id"], loop["command"]["attr"])
+                              for loop in self.loops]
+
+    def load_validated_config(self, config_path, external_inputs=None):
+        # the loops are needed also if the validated entities are loaded from the cache, they are
+        # applied together with the entities, see on_config_reload()
+        with open(os.path.join(config_path, "loops.json"), "r") as f:
+            self._loaded_loops = json.load(f)
+        return super().load_validated_config(config_path, external_inputs=external_inputs)
+
+    def on_config_reload(self, changed: set):
+        """
+        Assign the entities to the reloaded loops. The states of the loops, which still exist, are kept,
+        and the parameters are applied again in the next cycle.
+        """
+        self.loops = self._loaded_loops
+        previous = {self.loop_key(loop): i for i, loop in enumerate(self.loop_order)}
+        self.pid = self.pid.select([previous.get(self.loop_key(loop), -1) for loop in self.loops])
+        self.loop_order = self.loops
+        self.match_loops()
+        self.u = None
+        self.pid_params = None
+
+    def load_config(self, config_path):
+        """
+        Load the loops from loops.json and the controller entity from controller.json
+        """
+        with open(os.path.join(config_path, "controller.json"), "r") as f:
+            controller_dict = json.load(f)
+        input_dict, command_dict = {}, {}
+        for loop in self._loaded_loops:
+            _input, _command = loop["input"], loop["command"]
+            input_dict.setdefault(_input["id"], {"id": _input["id"], "type": _input["type"]})[_input["attr"]] = \
+                {"type": "Number", "value": None, "metadata": {}}
+            # deadband, minResendInterval and heartbeatInterval of a command, see CommandFilter
+            metadata = {key: {"type": "Number", "value": _command[key]}
+                        for key in ("deadband", "minResendInterval", "heartbeatInterval") if key in _command}
+            command_dict.setdefault(_command["id"], {"id": _command["id"], "type": _command["type"]})[
+                _command["attr"]] = {"type": "command", "value": "", "metadata": metadata}
+        return list(input_dict.values()), [], list(command_dict.values()), controller_dict
+
+    def match_variables(self):
+        """
+        Collect the measurements of all loops, missing measurements are NaN
+        """
+        values = self.input_values.values
+        self.y_act = np.array([values[slot] for slot in self.loop_inputs], dtype=np.float64)
+        self.y_set = self.pid.setpoint
+
+    def update_pid(self):
+        """
+        Update the parameters of the pid engine, if the controller parameters have changed
+        """
+        pid_params = tuple(np.asarray(self.parameter(name), dtype=np.float64).tolist()
+                           for name in ("kp", "ki", "kd", "limLower", "limUpper", "setpoint"))
+        if pid_params == self.pid_params:
+            return
+        if any(isinstance(value, list) and len(value) != self.pid.n for value in pid_params):
+            # e.g. after loops have been added, until the parameters are updated
+            logging.error(f"The parameter arrays of {self.controller_entity.id} do not match the "
+                          f"{self.pid.n} loops, controller stop")
+            self.active = False
+            return
+        kp, ki, kd, lim_lower, lim_upper, setpoint = pid_params
+        self.pid.tunings = (kp, ki, kd)
+        self.pid.output_limits = (lim_lower, lim_upper)
+        self.pid.setpoint[:] = setpoint
+        self.pid_params = pid_params
+
+    def control_algorithm(self):
+        """
+        Calculate the outputs of all PID loops with one update of the pid engine
+        """
+        self.u = self.pid(self.y_act)
+        values = self.command_values.values
+        for slot, value in zip(self.loop_commands, self.u.tolist()):
+            values[slot] = None if math.isnan(value) else value
+
+
+class AsyncPID4Fiware(AsyncController4Fiware, PID4Fiware):
+    """
+    PID controller that interact with Fiware platform using asyncio. The inputs and parameters are read
+    concurrently in each control cycle. The event-driven mode is not supported.
+    """
+    async def control_cycle(self):
+        """
+        The asynchronous control cycle of PID controller.
         """
         try:
             while True:
                 start_time = time.time()
 
+                # apply changes of the config files
+                self.reload_config()
+
                 # Update token if run in security mode
                 if self.security_mode:
-                    self.update_token()
+                    await self.update_token_async()
 
-                # update the input
-                logging.debug("read input")
-                self.read_input_variable()
+                # only the leader executes the cycle
+                if not await self.run_in_executor(self.check_leadership):
+                    await self.hold_sampling_time(start_time=start_time)
+                    continue
 
-                # update the controller parameters
-                logging.debug("read parameters")
-                self.read_controller_parameter()
+                # update the input and the controller parameters
+                logging.debug("read input and parameters")
+                await self.read_variables()
 
                 # match variables
                 logging.debug("match")
@@ -115,20 +344,72 @@ class PID4Fiware(Controller4Fiware):
 
                     # send commands
                     logging.debug("send")
-                    self.send_commands()
+                    await self.run_in_executor(self.send_commands)
 
-                    # wait until next cycle
-                    self.hold_sampling_time(start_time=start_time)
+                # wait until next cycle, also if the controller is deactivated
+                await self.hold_sampling_time(start_time=start_time)
         except Exception as ex:
             logging.error(str(ex))
             raise
 
 
 if __name__ == '__main__':
-    path_config = os.path.join(os.getcwd(), "config")
-    logging.debug(f"Load config from: {path_config}")
-    pid_controller = PID4Fiware(config_path=path_config)
-    # for local test
-    # pid_controller = PID4Fiware(config_path="../config/pid")
-    pid_controller.create_controller_entity()
-    pid_controller.control_cycle()
+    manifest = os.getenv("CONTROLLER_MANIFEST")
+    if sys.argv[1:2] == ["--check-config"]:
+        # validate the configuration without connecting to the platform
+        path_config = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.getcwd(), "config")
+        controller_class = MultiPID4Fiware if os.path.isfile(os.path.join(path_config, "loops.json")) \
+            else PID4Fiware
+        try:
+            controller_class.check_config(path_config)
+        except Exception as ex:
+            print(f"Configuration in {path_config} is not valid: {ex}")
+            sys.exit(1)
+        print(f"Configuration in {path_config} is valid")
+    elif manifest and int(os.getenv("WORKER_PROCESSES", 1)) != 1:
+        # shard the controllers listed in the manifest across worker processes
+        from controller4fiware.coordinator import ControllerCoordinator
+        logging.debug(f"Load manifest from: {manifest}")
+        coordinator = ControllerCoordinator.from_manifest(
+            controller_class=PID4Fiware, manifest_path=manifest,
+            metrics_port=int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None)
+        signal.signal(signal.SIGTERM, lambda signum, frame: coordinator.stop())
+        coordinator.run()
+    elif manifest:
+        # run all controllers listed in the manifest in this process
+        from controller4fiware.host import ControllerHost
+        logging.debug(f"Load manifest from: {manifest}")
+        host = ControllerHost.from_manifest(controller_class=PID4Fiware, manifest_path=manifest)
+        host.create_controller_entities()
+        if os.getenv("METRICS_PORT"):
+            host.start_metrics_server(port=int(os.getenv("METRICS_PORT")))
+        host.run()
+    else:
+        path_config = os.path.join(os.getcwd(), "config")
+        logging.debug(f"Load config from: {path_config}")
+        # exit normally when the container is stopped, so that the lease is released
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        if os.getenv("ASYNC_MODE", 'False').lower() in ('true', '1', 'yes'):
+            pid_controller = AsyncPID4Fiware(config_path=path_config)
+            if os.getenv("METRICS_PORT"):
+                pid_controller.start_metrics_server(port=int(os.getenv("METRICS_PORT")))
+            pid_controller.create_controller_entity()
+            try:
+                pid_controller.run()
+            finally:
+                pid_controller.release_lease()
+        else:
+            # many pid loops in one controller if loops.json is given
+            controller_class = MultiPID4Fiware if os.path.isfile(os.path.join(path_config, "loops.json")) \
+                else PID4Fiware
+            pid_controller = controller_class(config_path=path_config)
+            # for local test
+            # pid_controller = PID4Fiware(config_path="../config/pid")
+            if os.getenv("METRICS_PORT"):
+                pid_controller.start_metrics_server(port=int(os.getenv("METRICS_PORT")))
+            pid_controller.create_controller_entity()
+            try:
+                pid_controller.control_cycle()
+            finally:
+                # hand over to a standby instance, also when the container is stopped
+                pid_controller.release_lease()
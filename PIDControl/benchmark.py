@@ -0,0 +1,159 @@
+"""
+Offline benchmark of the control cycle of PID4Fiware against an in-process fake Orion.
+
+The benchmark sweeps the number of input entities and attributes, the number of controllers,
+the sampling time and the request mode (single requests or batch operations). For each
+configuration, the controllers run in a ControllerHost for a fixed duration, and the achieved
+cycles per second, the latency percentiles of the cycle phases and the HTTP calls per cycle
+are reported, e.g.
+
+    python benchmark.py --entities 1,10,50 --attrs 1,5 --modes single,batch --latency 0.002
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import warnings
+
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+from controller4fiware.fake_orion import FakeOrion
+from controller4fiware.host import ControllerHost
+from PID4FIWARE import PID4Fiware
+
+PHASES = ("input", "parameter", "algorithm", "output", "command")
+
+
+def create_configs(root: str, n_controllers: int, n_entities: int, n_attrs: int):
+    """
+    Write the config files of the controllers and return their paths together with the entities,
+    which must exist in the context broker, including the controller entities. Each controller
+    reads its own sensor entities and commands its own heater.
+    """
+    paths, entities = [], []
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "config", "pid",
+                           "controller.json"), "r") as f:
+        controller = json.load(f)
+    for i in range(n_controllers):
+        inputs = [dict({"id": f"urn:ngsi-ld:TemperatureSensor:{i:03d}:{j:03d}", "type": "TemperatureSensor"},
+                       **{("temperature" if k == 0 else f"temperature{k}"):
+                          {"type": "Number", "value": 18.0 + k, "metadata": {}} for k in range(n_attrs)})
+                  for j in range(n_entities)]
+        commands = [{"id": f"urn:ngsi-ld:Heater:{i:03d}", "type": "Heater",
+                     "heaterPower": {"type": "command", "value": "", "metadata": {}}}]
+        config = {"input.json": inputs,
+                  "output.json": [],
+                  "command.json": commands,
+                  "controller.json": dict(controller, id=f"urn:ngsi-ld:PIDController:{i:03d}")}
+        path = os.path.join(root, f"pid_{i:03d}")
+        os.makedirs(path, exist_ok=True)
+        for name, content in config.items():
+            with open(os.path.join(path, name), "w") as f:
+                json.dump(content, f)
+        paths.append(path)
+        entities += inputs + commands + [config["controller.json"]]
+    return paths, entities
+
+
+def percentile(samples: list, q: float) -> float:
+    """
+    The q-th percentile (0-100) of sorted samples
+    """
+    return samples[min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))]
+
+
+def run_configuration(orion: FakeOrion, mode: str, n_entities: int, n_attrs: int, n_controllers: int,
+                      sampling_time: float, duration: float) -> dict:
+    """
+    Run one configuration and return its results
+    """
+    os.environ["BATCH_MODE"] = str(mode == "batch")
+    os.environ["CB_URL"] = orion.url
+    with tempfile.TemporaryDirectory() as root:
+        paths, entities = create_configs(root, n_controllers, n_entities, n_attrs)
+        orion.entities.clear()
+        orion.add_entities(entities)
+        host = ControllerHost(controller_class=PID4Fiware, config_paths=paths,
+                              sampling_times=[sampling_time] * n_controllers)
+    host.create_controller_entities()
+    for controller in host.controllers:
+        controller.metrics.sample_size = 100000
+    orion.reset_requests()
+    thread = threading.Thread(target=host.run, daemon=True)
+    start = time.perf_counter()
+    thread.start()
+    time.sleep(duration)
+    host.stop()
+    thread.join()
+    elapsed = time.perf_counter() - start
+    requests = orion.reset_requests()
+
+    cycles = sum(controller.metrics.phases["input"].count for controller in host.controllers)
+    result = {"mode": mode, "entities": n_entities, "attrs": n_attrs, "controllers": n_controllers,
+              "sampling_time": sampling_time,
+              "cycles_per_second": cycles / elapsed,
+              "target_cycles_per_second": n_controllers / sampling_time,
+              "calls_per_cycle": requests / cycles if cycles else None,
+              "overruns": sum(controller.metrics.counters["overruns"] for controller in host.controllers),
+              "inactive_cycles": sum(controller.metrics.counters["inactive_cycles"]
+                                     for controller in host.controllers),
+              "phases": {}}
+    for phase in PHASES:
+        samples = sorted(duration for controller in host.controllers
+                         for duration in controller.metrics.samples.get(phase, ()))
+        if samples:
+            result["phases"][phase] = {f"p{q}": percentile(samples, q) for q in (50, 90, 99)}
+    return result
+
+
+def print_result(result: dict):
+    phases = "  ".join(f"{phase} {values['p50'] * 1000:.1f}/{values['p99'] * 1000:.1f}"
+                       for phase, values in result["phases"].items())
+    calls = f"{result['calls_per_cycle']:.1f}" if result["calls_per_cycle"] is not None else "-"
+    print(f"{result['mode']:>6} {result['entities']:>4} {result['attrs']:>4} {result['controllers']:>4} "
+          f"{result['sampling_time']:>6} {result['cycles_per_second']:>8.1f} "
+          f"{result['target_cycles_per_second']:>8.1f} {calls:>6} {result['overruns']:>5}  {phases}")
+
+
+def main():
+    def numbers(cast):
+        return lambda value: [cast(item) for item in value.split(",")]
+
+    parser = argparse.ArgumentParser(description="Benchmark the control cycle of PID4Fiware against a fake Orion")
+    parser.add_argument("--entities", type=numbers(int), default=[1, 10], help="numbers of input entities")
+    parser.add_argument("--attrs", type=numbers(int), default=[1], help="numbers of attributes per input entity")
+    parser.add_argument("--controllers", type=numbers(int), default=[1], help="numbers of controllers")
+    parser.add_argument("--sampling-times", type=numbers(float), default=[0.1], help="sampling times in second")
+    parser.add_argument("--modes", type=lambda value: value.split(","), default=["single", "batch"],
+                        help="request modes: single and/or batch")
+    parser.add_argument("--latency", type=float, default=0.001, help="latency of the fake Orion in second")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random latency on top of the latency in second")
+    parser.add_argument("--duration", type=float, default=5, help="duration of each configuration in second")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger("filip").setLevel(logging.CRITICAL)
+    warnings.simplefilter("ignore")  # overrun warnings are counted instead
+    orion = FakeOrion(latency=args.latency, jitter=args.jitter).start()
+    print(f"{'mode':>6} {'ent':>4} {'attr':>4} {'ctrl':>4} {'T':>6} {'cyc/s':>8} {'target':>8} "
+          f"{'calls':>6} {'ovr':>5}  phase p50/p99 [ms]")
+    results = []
+    try:
+        for mode, n_entities, n_attrs, n_controllers, sampling_time in itertools.product(
+                args.modes, args.entities, args.attrs, args.controllers, args.sampling_times):
+            result = run_configuration(orion, mode, n_entities, n_attrs, n_controllers, sampling_time,
+                                       args.duration)
+            print_result(result)
+            results.append(result)
+    finally:
+        orion.stop()
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
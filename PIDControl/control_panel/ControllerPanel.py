@@ -8,6 +8,7 @@ Web based GUI of controller tuning panel.
 """
 import os
 import requests
+from requests.adapters import HTTPAdapter
 from filip.clients.ngsi_v2 import ContextBrokerClient
 from filip.models.base import FiwareHeader
 import PySimpleGUIWeb as sg
@@ -36,8 +37,15 @@ class ControllerPanel:
         # Create the fiware header
         fiware_header = FiwareHeader(service=self.service, service_path=self.service_path)
 
-        # Create orion context broker client
-        self.ORION_CB = ContextBrokerClient(url=self.cb_url, fiware_header=fiware_header)
+        # Create orion context broker client, which keeps the connection alive and does not wait
+        # forever for a stalled context broker
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=int(os.getenv("HTTP_POOL_SIZE", 2)))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        self.ORION_CB = ContextBrokerClient(url=self.cb_url, fiware_header=fiware_header, session=session,
+                                            timeout=(float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05)),
+                                                     float(os.getenv("HTTP_READ_TIMEOUT", 10))))
 
         # initial pid controller list
         self.controller_list = []
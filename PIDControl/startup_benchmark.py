@@ -0,0 +1,85 @@
+"""
+Benchmark of the startup time of PID4Fiware.
+
+Each measurement runs in a fresh interpreter, like a restarting container, and is repeated with an
+empty and with a filled config cache (see controller4fiware/config.py):
+
+    check     python PID4FIWARE.py --check-config <config>
+    startup   import PID4FIWARE and create the controller, without connecting to the platform
+
+The median times are reported. With --max-startup, the benchmark fails if the startup with a
+filled cache is slower, so that it can guard the startup time, e.g.
+
+    python startup_benchmark.py --config ../config/pid --runs 5 --max-startup 2.0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP = """
+import os, sys
+sys.path.insert(0, {here!r})
+from PID4FIWARE import PID4Fiware, MultiPID4Fiware
+path = {config!r}
+controller_class = MultiPID4Fiware if os.path.isfile(os.path.join(path, "loops.json")) else PID4Fiware
+controller_class(config_path=path)
+"""
+
+
+def measure(args: list, env: dict) -> float:
+    """
+    Run a command in a fresh interpreter and return its duration in second
+    """
+    start = time.perf_counter()
+    subprocess.run([sys.executable] + args, env=env, cwd=HERE, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of PID4Fiware")
+    parser.add_argument("--config", default=os.path.join(HERE, "..", "config", "pid"),
+                        help="path of the configuration files")
+    parser.add_argument("--runs", type=int, default=5, help="repetitions of each measurement")
+    parser.add_argument("--max-startup", type=float,
+                        help="fail if the median startup time with a filled cache exceeds this time in second")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+    config = os.path.abspath(args.config)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, CONFIG_CACHE=cache, LOG_LEVEL="ERROR",
+                   PYTHONPATH=os.pathsep.join(filter(None, [os.path.join(HERE, ".."),
+                                                            os.getenv("PYTHONPATH")])))
+        commands = {"check": ["PID4FIWARE.py", "--check-config", config],
+                    "startup": ["-c", STARTUP.format(here=HERE, config=config)]}
+        for name, command in commands.items():
+            for cached in (False, True):
+                durations = []
+                for _ in range(args.runs):
+                    if not cached:
+                        # the last uncached run fills the cache for the cached runs
+                        for file in os.listdir(cache):
+                            os.remove(os.path.join(cache, file))
+                    durations.append(measure(command, env))
+                key = f"{name}_{'cached' if cached else 'uncached'}"
+                results[key] = statistics.median(durations)
+                print(f"{key:>18} {results[key]:8.3f} s")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=4)
+    if args.max_startup is not None and results["startup_cached"] > args.max_startup:
+        print(f"Startup time {results['startup_cached']:.3f} s exceeds {args.max_startup} s")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+The asyncio variant of the controller framework for FIWARE.
+"""
+import asyncio
+import logging
+import time
+import warnings
+from abc import ABC, abstractmethod
+from functools import partial
+from controller4fiware.Controller import Controller4Fiware
+
+
+class AsyncController4Fiware(Controller4Fiware, ABC):
+    """
+    AsyncController4Fiware is the asyncio variant of Controller4Fiware. The inputs and the controller
+    parameters are read concurrently, and the outputs and the commands are sent concurrently, so that
+    the latency of a control cycle is roughly one round-trip instead of the sum of all of them.
+    Waiting for the next cycle does not block the event loop.
+
+    The blocking requests of the FiLiP clients are executed in the default executor of the event loop.
+    The abstract methods are the same as in Controller4Fiware, but control_cycle() must be a coroutine.
+    An existing controller can be converted by inheriting from this class first, e.g.
+
+        class AsyncPID4Fiware(AsyncController4Fiware, PID4Fiware):
+            async def control_cycle(self):
+                ...
+    """
+    async def run_in_executor(self, func, *args, **kwargs):
+        """
+        Execute a blocking function in the default executor of the event loop.
+
+        Args:
+            func: the blocking function, e.g. self.read_input_variable
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, partial(func, *args, **kwargs))
+
+    async def update_token_async(self):
+        """
+        Update the token without blocking the event loop
+        """
+        await self.run_in_executor(self.update_token)
+
+    async def read_variables(self):
+        """
+        Read the input variables, the external inputs and the controller parameters concurrently. The
+        reads may deactivate the controller in any order, so the controller is only activated once all
+        of them have succeeded.
+        """
+        results = await asyncio.gather(self.run_in_executor(self.read_input_variable),
+                                       self.run_in_executor(self.read_external_input),
+                                       self.run_in_executor(self.read_controller_parameter))
+        self.active = all(result is True for result in results)
+
+    async def send_variables(self):
+        """
+        Send the output variables and the commands concurrently
+        """
+        await asyncio.gather(self.run_in_executor(self.send_output_variable),
+                             self.run_in_executor(self.send_commands))
+
+    async def hold_sampling_time(self, start_time: float = None):
+        """
+        Wait in each control cycle until the sampling time (or cycle time) is up without blocking
+        the event loop. If the algorithm takes more time than the sampling time, a warning will be given.
+
+        Args:
+            start_time: start time (time.time()) of the first cycle, only used to align the first deadline
+
+        """
+        if self.standby:
+            # only poll the lease in standby, restart the schedule after the takeover
+            await asyncio.sleep(self.lease.poll_interval)
+            self.scheduler.start()
+            return
+        if not self.active:
+            # back off exponentially while the controller is inactive, restart the schedule afterwards
+            self.metrics.inc("inactive_cycles")
+            await asyncio.sleep(self.inactive_backoff.next_delay())
+            self.scheduler.start()
+            return
+        self.inactive_backoff.reset()
+        if self.scheduler.deadline is None and start_time is not None:
+            self.scheduler.start(self.scheduler.clock() - (time.time() - start_time))
+        self.scheduler.period = self.sampling_time
+        overruns = self.scheduler.overruns
+        sleep_start = time.perf_counter()
+        await asyncio.sleep(self.scheduler.next_delay())
+        self.scheduler.mark_wakeup()
+        self.metrics.observe("sleep", time.perf_counter() - sleep_start)
+        if self.scheduler.overruns > overruns:
+            self.metrics.inc("overruns")
+            warnings.warn("The processing time is longer than the sampling time. The sampling time must be increased!")
+
+    def run(self):
+        """
+        Run the control cycle in a new event loop
+        """
+        asyncio.run(self.control_cycle())
+
+    @abstractmethod
+    async def control_cycle(self):
+        """
+        This abstract method must be implemented in subclass.
+        This abstract method already defines a basic structure of the control cycle, in which the
+        I/O operations are executed concurrently.
+        """
+        try:
+            while True:
+                start_time = time.time()
+
+                # Update token if run in security mode
+                if self.security_mode:
+                    await self.update_token_async()
+
+                # only the leader executes the cycle
+                if not await self.run_in_executor(self.check_leadership):
+                    await self.hold_sampling_time(start_time=start_time)
+                    continue
+
+                # update the input and the controller parameters
+                await self.read_variables()
+
+                # execute only when the controller is activated
+                if self.active:
+                    # calculate the output and commands
+                    self.control_algorithm()
+
+                    # send output and commands
+                    await self.send_variables()
+
+                # wait until next cycle, also if the controller is deactivated
+                await self.hold_sampling_time(start_time=start_time)
+        except Exception as ex:
+            logging.error(msg=str(ex))
+            raise
@@ -2,16 +2,36 @@
 The framework for controller that interact with FIWARE.
 @author: jdu
 """
+import functools
 import json
 import os.path
+import queue
+import socket
 import warnings
 from abc import ABC, abstractmethod
 import requests
 from filip.clients.ngsi_v2 import ContextBrokerClient, QuantumLeapClient
 from filip.models.base import FiwareHeader
-from filip.models.ngsi_v2.context import NamedCommand, ContextEntity
+from filip.models.ngsi_v2.base import EntityPattern, Http, AttrsFormat
+from filip.models.ngsi_v2.context import NamedCommand, ContextEntity, Query, ActionType
+from filip.models.ngsi_v2.subscriptions import Subscription, Subject, Condition, Notification, Message
+from typing import Dict, List, Tuple
+from urllib.parse import quote
 import time
-from controller4fiware.keycloak_token_handler import KeycloakPython
+from controller4fiware.keycloak_token_handler import KeycloakPython, TokenManager
+from controller4fiware.notification import NotificationReceiver
+from controller4fiware.scheduler import CycleScheduler
+from controller4fiware.resilience import RetryPolicy, Backoff, is_transient, resilient, shared_circuit_breaker
+from controller4fiware.metrics import ControllerMetrics, MetricsServer, timed
+from controller4fiware.connection_pool import create_session
+from controller4fiware.timeseries import QuantumLeapInput, create_external_input
+from controller4fiware.history import VariableHistory
+from controller4fiware.command_filter import CommandFilter
+from controller4fiware.config import ConfigCache, config_digest
+from controller4fiware.config_watcher import ConfigWatcher
+from controller4fiware.provisioning import EntityProvisioner
+from controller4fiware.lease import ControllerLease, OrionLeaseStore, FileLeaseStore
+from controller4fiware.value_table import ValueTable
 import os
 import logging
 
@@ -23,6 +43,14 @@ logging.basicConfig(level=log_level,
                     format='%(asctime)s %(name)s %(levelname)s: %(message)s')
 
 
+def transport_endpoint(controller: "Controller4Fiware") -> str:
+    """
+    The endpoint of the inputs and commands of a controller, i.e. the MQTT broker if they are exchanged
+    directly with the devices, so that an outage of Orion does not stop the MQTT transport, see resilient
+    """
+    return "orion" if controller.transport is None else "mqtt"
+
+
 class Controller4Fiware(ABC):
     """
     Controller4Fiware is an abstract class. It contains several abstract methods, which
@@ -37,42 +65,81 @@ class Controller4Fiware(ABC):
       2. If the number of variables must change, a new controller type should be implemented
       3. The declaration of variables happens in configure files
     """
-    def __init__(self, config_path=None):
+    def __init__(self, config_path=None, session: requests.Session = None, kcp: KeycloakPython = None,
+                 token_manager: TokenManager = None):
         """
         Args:
             config_path: the root path of the configuration files
+            session: the session used for the requests to the context broker, a new session with
+                the shared connection pools is created if not given
+            kcp: the Keycloak client used in security mode
+            token_manager: the token manager used in security mode, by default the manager of the
+                process is shared by all controllers with the same Keycloak client
         """
-        input_path = os.path.join(config_path, "input.json")
-        with open(input_path, "r") as f:
-            input_list = json.load(f)
-        output_path = os.path.join(config_path, "output.json")
-        with open(output_path, "r") as f:
-            output_list = json.load(f)
-        command_path = os.path.join(config_path, "command.json")
-        with open(command_path, "r") as f:
-            command_list = json.load(f)
-        controller_path = os.path.join(config_path, "controller.json")
-        with open(controller_path, "r") as f:
-            controller_dict = json.load(f)
+        config, external_inputs, self._config_digest = self.load_validated_config(config_path)
+        self.input_entities, self.output_entities, self.command_entities, self.controller_entity = config
+        # Values of the variables and parameters, which are read and written in the control cycle
+        # instead of the entities, see ValueTable
+        self.input_values, self.output_values, self.command_values, self.parameter_values = \
+            (ValueTable(entities) for entities in (self.input_entities, self.output_entities,
+                                                   self.command_entities, [self.controller_entity]))
+        self._clear_entity_values(self.input_entities + self.output_entities + self.command_entities +
+                                  [self.controller_entity])
+        self._entities_checked = False
 
-        # Config file of the controller must contain the initial value of parameters
-        self.controller_entity = ContextEntity.model_validate(controller_dict)
+        # Duration of the phases of the control cycle and counters, see start_metrics_server()
+        self.metrics = ControllerMetrics(controller_id=self.controller_entity.id)
+        self.metrics_server = None
+        # Local history of the inputs, outputs and commands, the latest HISTORY_DEPTH values are kept
+        history_depth = int(os.getenv("HISTORY_DEPTH", 100))
+        self.history = VariableHistory(entities=self.input_entities + self.output_entities + self.command_entities,
+                                       depth=history_depth) if history_depth > 0 else None
+        self._instrument_control_algorithm()
+        # Deadband, minimum resend interval and heartbeat of the commands, only commands that have
+        # changed meaningfully or whose heartbeat is due are sent
+        self.command_filter = CommandFilter(command_entities=self.command_entities)
+        self._pending_commands = []
 
-        self.input_entities = [ContextEntity.model_validate(entity)
-                               for entity in input_list]
-        self.output_entities = [ContextEntity.model_validate(entity)
-                                for entity in output_list]
-        self.command_entities = [ContextEntity.model_validate(entity)
-                                 for entity in command_list]
+        # External inputs from QuantumLeap, e.g. temperature forecast, defined in the optional
+        # config file external_input.json and cached locally
+        self.external_inputs: Dict[str, QuantumLeapInput] = external_inputs
 
-        # TODO define external inputs if any, e.g. temperature forecast
-        # self.temp_forecast = None
+        # Hot reload of the config files at the cycle boundaries, see reload_config()
+        self.config_path = config_path
+        self.config_watcher = ConfigWatcher(config_path=config_path,
+                                            interval=float(os.getenv("CONFIG_RELOAD_INTERVAL", 5))) \
+            if os.getenv("CONFIG_RELOAD", 'False').lower() in ('true', '1', 'yes') else None
+        self._reload_pending = False  # a reload has failed for a transient reason, see reload_config()
 
         self.active = True  # the controller will be deactivated if set to False
 
         # Read from ENV
         self.sampling_time = float(os.getenv("SAMPLING_TIME", 0.5))
         assert self.sampling_time >= 0.1, "Controller sampling time must be larger than 0.1 sec"
+        # Fixed-rate scheduler of the control cycles
+        self.scheduler = CycleScheduler(period=self.sampling_time,
+                                        overrun_policy=os.getenv("OVERRUN_POLICY", CycleScheduler.SKIP))
+        # Retry transient errors, stop requesting failing endpoints, and back off while inactive
+        self.retry_policy = RetryPolicy(retries=int(os.getenv("RETRY_TOTAL", 2)),
+                                        backoff_factor=float(os.getenv("RETRY_BACKOFF", 0.1)))
+        self.inactive_backoff = Backoff(initial=self.sampling_time, maximum=float(os.getenv("BACKOFF_MAX", 60)))
+        # Use batch operations (/v2/op/query) instead of single attribute requests
+        self.batch_mode = os.getenv("BATCH_MODE", 'False').lower() in ('true', '1', 'yes')
+
+        # Read the controller parameters at most once per refresh time, 0 means in every cycle
+        self.parameter_refresh_time = float(os.getenv("PARAMETER_REFRESH_TIME", 0))
+        self._parameter_read_time = None
+        self._parameter_modified = None
+
+        # settings for event-driven mode, in which the control cycle is triggered by notifications
+        self.event_mode = os.getenv("EVENT_MODE", 'False').lower() in ('true', '1', 'yes')
+        self.notification_port = int(os.getenv("NOTIFICATION_PORT", 8081))
+        self.notification_url = os.getenv("NOTIFICATION_URL",
+                                          f"http://{socket.gethostname()}:{self.notification_port}/notify")
+        self.min_cycle_interval = float(os.getenv("MIN_CYCLE_INTERVAL", 0))
+        self.max_cycle_interval = float(os.getenv("MAX_CYCLE_INTERVAL", 0))  # 0 means no limit
+        self.notification_receiver = None
+        self.subscription_id = None
 
         self.fiware_params = {
             "ql_url": os.getenv("QL_URL", "http://localhost:8668"),
@@ -81,60 +148,429 @@ class Controller4Fiware(ABC):
             "service_path": os.getenv("FIWARE_SERVICE_PATH", "/")
         }
 
+        # The circuit breakers are shared per endpoint by all controllers of the process
+        self.circuit_breakers = {"orion": shared_circuit_breaker(self.fiware_params["cb_url"]),
+                                 "quantumleap": shared_circuit_breaker(self.fiware_params["ql_url"])}
+
         # Create the fiware header
         fiware_header = FiwareHeader(service=self.fiware_params['service'],
                                      service_path=self.fiware_params['service_path'])
 
         # Create orion context broker client
-        s = requests.Session()
+        s = session if session is not None else create_session()
+        s.hooks["response"].append(self.metrics.count_response)
         self.ORION_CB = ContextBrokerClient(url=self.fiware_params['cb_url'], fiware_header=fiware_header,
                                             session=s)
-        self.QL_CB = QuantumLeapClient(url=self.fiware_params['ql_url'], fiware_header=fiware_header)
+        self.QL_CB = QuantumLeapClient(url=self.fiware_params['ql_url'], fiware_header=fiware_header,
+                                       session=create_session())
 
         # settings for security mode
         self.security_mode = os.getenv("SECURITY_MODE", 'False').lower() in ('true', '1', 'yes')
         self.token = (None, None)
-        # Get token from keycloak in security mode
+        # Get token from keycloak in security mode, the token is refreshed in the background
         if self.security_mode:
-            self.kcp = KeycloakPython()
-            # Get initial token
-            self.token = self.kcp.get_access_token()
+            self.token_manager = token_manager if token_manager is not None else TokenManager.shared(kcp=kcp)
+            self.token_manager.start()
+            self.kcp = self.token_manager.kcp
+            self.token = self.token_manager.token
+
+        # Leader election of instances with the same controller entity, only the leader executes the
+        # control cycle, the others are in standby and only poll the lease
+        self.lease = self.create_lease() \
+            if os.getenv("LEADER_ELECTION", 'False').lower() in ('true', '1', 'yes') else None
+        self.standby = False
+
+        # Transport of inputs and commands: orion (default), mqtt or hybrid
+        self.transport_mode = os.getenv("TRANSPORT", "orion").lower()
+        self.transport = None
+        if self.transport_mode != "orion":
+            self.transport = self.create_transport(config_path=config_path)
+            self.circuit_breakers["mqtt"] = shared_circuit_breaker(self.transport.mqtt_url.geturl())
+
+    def create_transport(self, config_path):
+        """
+        Create and connect the MQTT transport, which exchanges inputs and commands directly with the
+        devices. The device model is read from the files devices.json and fiware_groups.json in the
+        config path, unless DEVICES_PATH or GROUPS_PATH is given.
+
+        Args:
+            config_path: the root path of the configuration files
+        """
+        from filip.models.ngsi_v2.iot import Device, ServiceGroup
+        from controller4fiware.transport import MqttTransport, HybridTransport, MQTT, HYBRID
+        devices_path = os.getenv("DEVICES_PATH", os.path.join(config_path, "devices.json"))
+        with open(devices_path, "r") as f:
+            devices = [Device.model_validate(device) for device in json.load(f)]
+        groups_path = os.getenv("GROUPS_PATH", os.path.join(config_path, "fiware_groups.json"))
+        with open(groups_path, "r") as f:
+            service_groups = [ServiceGroup.model_validate(group) for group in json.load(f)]
+        kwargs = dict(devices=devices,
+                      service_groups=service_groups,
+                      mqtt_url=os.getenv("MQTT_BROKER_URL", "mqtt://localhost:1883"),
+                      username=os.getenv("MQTT_USER"),
+                      password=os.getenv("MQTT_PW"))
+        if self.transport_mode == MQTT:
+            transport = MqttTransport(**kwargs)
+        elif self.transport_mode == HYBRID:
+            # the commands are committed to the command filter once they have been sent
+            transport = HybridTransport(send=self.update_entities, on_sent=self._commit_sent_commands, **kwargs)
+        else:
+            raise ValueError(f"Unknown transport {self.transport_mode}")
+        transport.connect()
+        return transport
+
+    def load_config(self, config_path):
+        """
+        Load the configuration files input.json, output.json, command.json and controller.json.
+        Subclasses can override this method to derive the entities from other configuration files.
 
+        Args:
+            config_path: the root path of the configuration files
+
+        Returns:
+            the input entities, output entities, command entities and the controller entity as dicts
+        """
+        input_path = os.path.join(config_path, "input.json")
+        with open(input_path, "r") as f:
+            input_list = json.load(f)
+        output_path = os.path.join(config_path, "output.json")
+        with open(output_path, "r") as f:
+            output_list = json.load(f)
+        command_path = os.path.join(config_path, "command.json")
+        with open(command_path, "r") as f:
+            command_list = json.load(f)
+        controller_path = os.path.join(config_path, "controller.json")
+        with open(controller_path, "r") as f:
+            controller_dict = json.load(f)
+        return input_list, output_list, command_list, controller_dict
+
+    @classmethod
+    def config_kind(cls) -> str:
+        """
+        The kind of configuration, i.e. the name of the class which implements load_config()
+        """
+        return cls.load_config.__qualname__.split(".")[0]
+
+    def load_validated_config(self, config_path, external_inputs: Dict[str, QuantumLeapInput] = None):
+        """
+        Load the configuration with load_config() and validate the entities, the policies of the
+        commands and the external inputs. The validated entities are cached (see ConfigCache) once the
+        whole configuration is valid, so that the validation is skipped if the config files have not
+        changed since the last start.
+
+        Args:
+            config_path: the root path of the configuration files
+            external_inputs: the current external inputs, see load_external_inputs()
+
+        Returns:
+            the input entities, output entities and command entities as lists of ContextEntity and
+            the controller entity, the external inputs by name and the digest of the config files
+        """
+        cache = ConfigCache()
+        digest = config_digest(config_path, kind=self.config_kind())
+        config = cache.load(digest)
+        if config is not None:
+            logging.debug(f"Load validated config from cache: {cache.path(digest)}")
+            return config, self.load_external_inputs(config_path, current=external_inputs), digest
+        input_list, output_list, command_list, controller_dict = self.load_config(config_path)
+        config = ([ContextEntity.model_validate(entity) for entity in input_list],
+                  [ContextEntity.model_validate(entity) for entity in output_list],
+                  [ContextEntity.model_validate(entity) for entity in command_list],
+                  # Config file of the controller must contain the initial value of parameters
+                  ContextEntity.model_validate(controller_dict))
+        CommandFilter(command_entities=config[2])
+        external_inputs = self.load_external_inputs(config_path, current=external_inputs)
+        # the files may have been changed while they were loaded
+        if config_digest(config_path, kind=self.config_kind()) == digest:
+            cache.store(digest, config)
+        return config, external_inputs, digest
+
+    @staticmethod
+    def load_external_inputs(config_path, current: Dict[str, QuantumLeapInput] = None) -> \
+            Dict[str, QuantumLeapInput]:
+        """
+        Create the external inputs defined in the optional config file external_input.json
+
+        Args:
+            config_path: the root path of the configuration files
+            current: the current external inputs, which are kept with their cached data if their
+                configuration has not changed
+
+        Returns:
+            the external inputs by name
+        """
+        current = current or {}
+        external_inputs = {}
+        external_input_path = os.path.join(config_path, "external_input.json")
+        if os.path.isfile(external_input_path):
+            with open(external_input_path, "r") as f:
+                for config in json.load(f):
+                    external_input = current.get(config["name"])
+                    if external_input is None or external_input.config != config:
+                        external_input = create_external_input(config)
+                    external_inputs[config["name"]] = external_input
+        return external_inputs
+
+    @staticmethod
+    def _schema(entities: List[ContextEntity]):
+        """
+        The structure of the entities without the values, which change at runtime
+        """
+        return [(entity.id, entity.type,
+                 [(_attr.name, _attr.type, sorted((name, meta.model_dump()) for name, meta in
+                                                  (_attr.metadata or {}).items()))
+                  for _attr in entity.get_attributes()])
+                for entity in entities]
+
+    def reload_config(self) -> bool:
+        """
+        Apply the changes of the config files (hot reload), if CONFIG_RELOAD is set. This method is
+        called at the cycle boundaries. Only the changed entities are replaced, and the current values of
+        the variables, which still exist, are kept, as well as the history, the states of the command
+        filter and of the external inputs, and the internal state of the control algorithm, see
+        on_config_reload(). The changes are applied only once every step has succeeded, otherwise the
+        error is logged and the current configuration is kept, e.g. if the configuration is not valid.
+
+        Returns:
+            True if the configuration has been reloaded
+        """
+        if self.config_watcher is None or not (self.config_watcher.changed() or self._reload_pending):
+            return False
+        self._reload_pending = False
+        if config_digest(self.config_path, kind=self.config_kind()) == self._config_digest:
+            return False
+        try:
+            config, external_inputs, digest = self.load_validated_config(self.config_path,
+                                                                         external_inputs=self.external_inputs)
+        except Exception as ex:
+            logging.error(f"Config in {self.config_path} is not valid, the current config is kept: {ex}")
+            return False
+
+        # the new state is prepared first and only applied once every step has succeeded
+        state = {}
+        for name, entities in zip(("input", "output", "command"), config[:3]):
+            if self._schema(entities) != self._schema(getattr(self, f"{name}_entities")):
+                values = ValueTable(entities)
+                values.copy_from(getattr(self, f"{name}_values"))
+                self._clear_entity_values(entities)
+                state[f"{name}_entities"], state[f"{name}_values"] = entities, values
+        controller_entity = config[3]
+        if self._schema([controller_entity]) != self._schema([self.controller_entity]):
+            values = ValueTable([controller_entity])
+            values.copy_from(self.parameter_values)
+            self._clear_entity_values([controller_entity])
+            try:
+                EntityProvisioner(client=self.ORION_CB).provision(
+                    entities=[self._entity_with_values(controller_entity, values)])
+            except Exception as ex:
+                logging.error(f"Controller entity {controller_entity.id} could not be created, the current "
+                              f"config is kept: {ex}")
+                # repeat the reload in the next cycle, if the context broker is temporarily not available
+                self._reload_pending = isinstance(ex, requests.exceptions.RequestException) and is_transient(ex)
+                return False
+            state["controller_entity"], state["parameter_values"] = controller_entity, values
+        if external_inputs.keys() != self.external_inputs.keys() or \
+                any(external_inputs[name] is not self.external_inputs[name] for name in external_inputs):
+            state["external_inputs"] = external_inputs
+
+        changed = {name for name in state if not name.endswith("_values")}
+        for name, value in state.items():
+            setattr(self, name, value)
+        self._config_digest = digest
+        if "controller_entity" in changed:
+            self.metrics.controller_id = self.controller_entity.id
+            self._parameter_modified = self._parameter_read_time = None  # read all parameters in the next cycle
+        if changed & {"input_entities", "output_entities", "command_entities"} and self.history is not None:
+            self.history.track(entities=self.input_entities + self.output_entities + self.command_entities)
+        if "command_entities" in changed:
+            command_filter = CommandFilter(command_entities=self.command_entities)
+            command_filter.last_sent = {key: value for key, value in self.command_filter.last_sent.items()
+                                        if key in command_filter.policies}
+            self.command_filter = command_filter
+        if changed & {"input_entities", "controller_entity"} and self.subscription_id is not None:
+            self.ORION_CB.delete_subscription(subscription_id=self.subscription_id)
+            self.subscribe_notifications()
+        self.on_config_reload(changed)
+        logging.info(f"Config reloaded from {self.config_path}, changed: {sorted(changed) or 'none'}")
+        return True
+
+    def on_config_reload(self, changed: set):
+        """
+        Hook for subclasses, which is invoked after a reload of the configuration, e.g. to update the
+        derived variables of the control algorithm while keeping its internal state.
+
+        Args:
+            changed: the names of the replaced attributes, e.g. "input_entities" or "controller_entity"
+        """
+        pass
+
+    @classmethod
+    def check_config(cls, config_path):
+        """
+        Validate the configuration without connecting to the platform. The validated configuration
+        is cached, so that the next start of the controller skips the validation.
+
+        Args:
+            config_path: the root path of the configuration files
+
+        Raises:
+            Exception if the configuration is not valid
+        """
+        # the controller is not initialized, only the config loading is used
+        controller = cls.__new__(cls)
+        controller.load_validated_config(config_path)
+
+    def _instrument_control_algorithm(self):
+        """
+        Time the control algorithm of the subclass as a phase of the cycle, and record the inputs it has
+        used as well as the outputs and commands it has calculated in the history
+        """
+        algorithm = timed("algorithm")(type(self).control_algorithm)
+
+        @functools.wraps(algorithm)
+        def control_algorithm(*args, **kwargs):
+            now = time.time()
+            if self.history is not None:
+                self.history.record([self.input_values], now)
+            result = algorithm(self, *args, **kwargs)
+            if not self._entities_checked:
+                self._check_entity_values()
+                self._entities_checked = True
+            if self.history is not None:
+                self.history.record([self.output_values, self.command_values], now)
+            return result
+        self.control_algorithm = control_algorithm
+
+    @staticmethod
+    def _clear_entity_values(entities: List[ContextEntity]):
+        """
+        Clear the values of the entities of the configuration, after they have been compiled to the value
+        tables. A control algorithm, which still reads the entities, e.g.
+        self.input_entities[0].get_attributes()[0].value, gets None instead of a stale value.
+        """
+        for entity in entities:
+            attrs = entity.get_attributes()
+            for _attr in attrs:
+                _attr.value = None
+            entity.update_attribute(attrs)
+
+    def _check_entity_values(self):
+        """
+        Check after the first control algorithm, that it has not written the outputs or commands to the
+        entities, e.g. with entity.update_attribute(), since only the value tables are sent
+
+        Raises:
+            RuntimeError if a value has been written to an output or command entity
+        """
+        written = [f"{entity.id}/{_attr.name}" for entity in self.output_entities + self.command_entities
+                   for _attr in entity.get_attributes() if _attr.value is not None]
+        if written:
+            raise RuntimeError(f"The control algorithm has written the values of {', '.join(written)} to "
+                               f"the entities, which are not sent. Write them to self.output_values and "
+                               f"self.command_values instead, see ValueTable")
+
+    def start_metrics_server(self, port: int = 9100):
+        """
+        Expose the metrics of the controller in the Prometheus text format under /metrics
+
+        Args:
+            port: the port of the metrics endpoint
+        """
+        self.metrics_server = MetricsServer(metrics=[self.metrics], port=port)
+        self.metrics_server.start()
+
+    @timed("token")
     def update_token(self):
         """
-        Update the token if necessary. Write the latest token into the
-        header of CB client.
+        Write the latest token into the headers of the CB and QL clients. The token is refreshed ahead of
+        its expiry by the token manager in the background, so that no request to Keycloak is made in the cycle.
         """
-        token = self.kcp.check_update_token_validity(input_token=self.token, min_valid_time=60)
+        token = self.token_manager.token
         if all(token):  # if a valid token is returned
             self.token = token
-        # Update the header with token
-        self.ORION_CB.headers.update(
-            {"Authorization": f"Bearer {self.token[0]}"})
+        # Update the headers with token
+        for client in (self.ORION_CB, self.QL_CB):
+            client.headers.update(
+                {"Authorization": f"Bearer {self.token[0]}"})
 
+    @timed("parameter")
+    @resilient("orion")
     def read_controller_parameter(self):
         """
-        Read the controller parameters from Fiware platform
+        Read the controller parameters from Fiware platform. All parameters are read with one request
+        together with the modification time of the controller entity, and the cached parameters are
+        only updated if the entity has been modified since the last read. If a refresh time is set,
+        the parameters are read at most once per refresh time.
+
+        Returns:
+            True if the parameters are up to date, False if the controller entity has been created again,
+            None if the request has failed (see resilient)
+        """
+        now = time.time()
+        if self._parameter_read_time is not None and \
+                now - self._parameter_read_time < self.parameter_refresh_time:
+            return True
+        table = self.parameter_values
+        try:
+            values = self.ORION_CB.get_entity(entity_id=self.controller_entity.id,
+                                              entity_type=self.controller_entity.type,
+                                              attrs=[name for _, name in table.keys] + ["dateModified"],
+                                              response_format=AttrsFormat.KEY_VALUES).model_dump()
+        except requests.exceptions.HTTPError as err:
+            if "NOT FOUND" not in err.args[0].upper():
+                raise
+            # the controller entity has been deleted, e.g. by a data wipe of Orion, so it is created again
+            # with the initial parameters, which are read in the next cycle
+            logging.error(f"Controller entity {self.controller_entity.id} not found, create it again")
+            EntityProvisioner(client=self.ORION_CB).invalidate(entities=[self.controller_entity])
+            self.create_controller_entity()
+            self._parameter_modified = None
+            self.active = False
+            return False
+        # the read time and the modification time are only kept after a successful read, so that a
+        # failed read is retried and not skipped until the next refresh
+        self._parameter_read_time = now
+        date_modified = values.get("dateModified")
+        if date_modified is not None and date_modified == self._parameter_modified:
+            return True
+        for slot, (_, name) in enumerate(table.keys):
+            if name not in values:
+                raise KeyError(f"Parameter {name} not in controller entity {self.controller_entity.id}")
+            table.values[slot] = values[name]
+        self._parameter_modified = date_modified
+        return True
+
+    def parameter(self, name: str):
+        """
+        The current value of a controller parameter
         """
-        for _param in self.controller_entity.get_attributes():
-            # logging.debug(f"read {_param.name} from {self.controller_entity.id} with type {self.controller_entity.type}")
-            _param.value = self.ORION_CB.get_attribute_value(entity_id=self.controller_entity.id,
-                                                             entity_type=self.controller_entity.type,
-                                                             attr_name=_param.name)
-            self.controller_entity.update_attribute(attrs=[_param])
+        return self.parameter_values.get(self.controller_entity.id, name)
 
+    @timed("input")
+    @resilient(transport_endpoint)
     def read_input_variable(self):
         """
         Read input variables from Fiware platform
+
+        Returns:
+            True if all inputs have been read, False if an input is missing and None if the request has
+            failed (see resilient)
         """
         try:
-            for entity in self.input_entities:
-                for _input in entity.get_attributes():
-                    # logging.debug(f"read {_input.name} from id {entity.id} and type {entity.type}")
-                    _input.value = self.ORION_CB.get_attribute_value(entity_id=entity.id,
-                                                                     entity_type=entity.type,
-                                                                     attr_name=_input.name)
-                    entity.update_attribute(attrs=[_input])
+            if self.transport is not None:
+                missing = self.transport.read_inputs(table=self.input_values)
+                if missing:
+                    raise requests.exceptions.HTTPError(f"Not Found: no measurement received for {missing}")
+            elif self.batch_mode:
+                self.query_entities(table=self.input_values)
+            else:
+                table = self.input_values
+                for entity_id, entity_type, slots in table.entities:
+                    for slot in slots:
+                        # logging.debug(f"read {table.keys[slot][1]} from id {entity_id} and type {entity_type}")
+                        table.values[slot] = self.ORION_CB.get_attribute_value(entity_id=entity_id,
+                                                                               entity_type=entity_type,
+                                                                               attr_name=table.keys[slot][1])
         except requests.exceptions.HTTPError as err:
             msg = err.args[0]
             if "NOT FOUND" not in msg.upper():
@@ -142,10 +578,129 @@ class Controller4Fiware(ABC):
             self.active = False
             logging.error(msg)
             logging.error("Input entities/attributes not fond, controller stop")
+            return False
         else:
             # if no error
             self.active = True
+            return True
+
+    @timed("external")
+    @resilient("quantumleap")
+    def read_external_input(self):
+        """
+        Fetch the new data of the external inputs from QuantumLeap. Only the samples after the latest
+        cached sample are requested. The data are available in control_algorithm() as numpy arrays,
+        e.g. self.external_inputs["temperatureForecast"].values
+
+        Returns:
+            True if the external inputs are up to date, None if the request has failed (see resilient)
+        """
+        now = time.time()
+        for external_input in self.external_inputs.values():
+            external_input.update(self.QL_CB, now=now)
+        return True
+
+    def query_entities(self, table: ValueTable):
+        """
+        Read the attributes of several entities with a single batch query (POST /v2/op/query)
+        and update their values in the table. Only the attributes in the table are requested, and
+        the results are requested as key values, so that they are not validated attribute by attribute.
+
+        Args:
+            table: the values of the entities, which will be updated
+
+        Raises:
+            requests.exceptions.HTTPError: "Not Found" if an entity or attribute is missing
+        """
+        if not table.entities:
+            return
+        attrs = sorted({name for _, name in table.keys})
+        query = Query(entities=[EntityPattern(id=entity_id, type=entity_type)
+                                for entity_id, entity_type, _ in table.entities],
+                      attrs=attrs)
+        results = {(result.id, result.type): result.model_dump()
+                   for result in self.ORION_CB.query(query=query, response_format=AttrsFormat.KEY_VALUES)}
+        for entity_id, entity_type, slots in table.entities:
+            result = results.get((entity_id, entity_type))
+            if result is None:
+                raise requests.exceptions.HTTPError(f"Not Found: entity {entity_id} with type {entity_type}")
+            for slot in slots:
+                attr_name = table.keys[slot][1]
+                if attr_name not in result:
+                    raise requests.exceptions.HTTPError(f"Not Found: attribute {attr_name} "
+                                                        f"of entity {entity_id}")
+                table.values[slot] = result[attr_name]
+
+    def update_entities(self, entities: List[ContextEntity]):
+        """
+        Write the attributes of several entities with a single batch update (POST /v2/op/update,
+        actionType "update"). Missing entities are reported one by one.
+
+        Args:
+            entities: the entities with the attributes to be updated
+
+        Raises:
+            requests.exceptions.HTTPError: "Not Found" if at least one entity is missing
+        """
+        if not entities:
+            return
+        try:
+            self.ORION_CB.update(entities=entities, action_type=ActionType.UPDATE)
+        except requests.exceptions.HTTPError as err:
+            # a partial update (422) is also caused by missing entities
+            if "NOT FOUND" not in err.args[0].upper() and \
+                    (err.response is None or err.response.status_code != 422):
+                raise
+            missing = [entity for entity in entities
+                       if not self.ORION_CB.does_entity_exist(entity_id=entity.id, entity_type=entity.type)]
+            for entity in missing:
+                logging.error(f"Entity {entity.id} with type {entity.type} not found")
+            raise requests.exceptions.HTTPError(f"Not Found: batch update failed for "
+                                                f"{[entity.id for entity in missing]}", response=err.response)
 
+    def _batch_outputs(self) -> List[ContextEntity]:
+        """
+        Collect the output variables as entities for a batch update
+        """
+        return self.output_values.to_entities()
+
+    def _batch_commands(self) -> List[ContextEntity]:
+        """
+        Collect the commands, which are due according to the command filter, as entities for a
+        batch update. Commands without a value (None), e.g. of a loop without a measurement, are not
+        sent. Suppressed commands are counted, the due commands are committed to the filter by
+        _commit_commands() after they have been sent.
+        """
+        now = self.scheduler.clock()
+        table = self.command_values
+        self._pending_commands = []
+        due = []
+        for slot, (entity_id, attr_name) in enumerate(table.keys):
+            value = table.values[slot]
+            if value is None:
+                continue
+            if self.command_filter.is_due(entity_id, attr_name, value, now):
+                due.append(slot)
+                self._pending_commands.append((entity_id, attr_name, value))
+            else:
+                self.metrics.inc("suppressed_commands")
+        return table.to_entities(slots=due, attr_type="command")
+
+    def _commit_commands(self):
+        """
+        Remember the commands of the last _batch_commands() as sent
+        """
+        self.command_filter.commit(self._pending_commands, now=self.scheduler.clock())
+        self._pending_commands = []
+
+    def _commit_sent_commands(self, sent: List[Tuple[str, str, object]]):
+        """
+        Remember the commands, which have been sent in the background by the transport, as sent
+        """
+        self.command_filter.commit(sent, now=self.scheduler.clock())
+
+    @timed("output")
+    @resilient("orion")
     def send_output_variable(self):
         """
         Send output variables to Fiware platform
@@ -154,13 +709,18 @@ class Controller4Fiware(ABC):
         which will not be forwarded to devices
         """
         try:
-            for entity in self.output_entities:
-                for _output in entity.get_attributes():
-                    # logging.debug(f"update output {_output.name} of id {entity.id} with type {entity.type}")
-                    self.ORION_CB.update_attribute_value(entity_id=entity.id,
-                                                         attr_name=_output.name,
-                                                         value=_output.value,
-                                                         entity_type=entity.type)
+            if self.batch_mode:
+                self.update_entities(entities=self._batch_outputs())
+            else:
+                table = self.output_values
+                for entity_id, entity_type, slots in table.entities:
+                    for slot in slots:
+                        # logging.debug(f"update output {table.keys[slot][1]} of id {entity_id} "
+                        #               f"with type {entity_type}")
+                        self.ORION_CB.update_attribute_value(entity_id=entity_id,
+                                                             attr_name=table.keys[slot][1],
+                                                             value=table.values[slot],
+                                                             entity_type=entity_type)
         except requests.exceptions.HTTPError as err:
             msg = err.args[0]
             if "NOT FOUND" not in msg.upper():
@@ -169,18 +729,32 @@ class Controller4Fiware(ABC):
             logging.error(msg)
             logging.error("Output entities/attributes not fond, controller stop")
 
+    @timed("command")
+    @resilient(transport_endpoint)
     def send_commands(self):
         """
         Send commands to Fiware platform. The commands will be forwarded to the corresponding actuators.
         """
         try:
-            for entity in self.command_entities:
-                for _comm in entity.get_attributes():
-                    # logging.debug(f"send command {_comm.name} to id {entity.id} with type {entity.type}")
-                    _comm = NamedCommand(**_comm.model_dump())
-                    self.ORION_CB.post_command(entity_id=entity.id,
-                                               entity_type=entity.type,
-                                               command=_comm)
+            entities = self._batch_commands()
+            if not entities:
+                return
+            if self.transport is not None:
+                if not self.transport.send_commands(entities=entities):
+                    # the commands are sent later and committed by the transport, see HybridTransport
+                    self._pending_commands = []
+                    return
+            elif self.batch_mode:
+                self.update_entities(entities=entities)
+            else:
+                for entity in entities:
+                    for _comm in entity.get_attributes():
+                        # logging.debug(f"send command {_comm.name} to id {entity.id} with type {entity.type}")
+                        _comm = NamedCommand(**_comm.model_dump())
+                        self.ORION_CB.post_command(entity_id=entity.id,
+                                                   entity_type=entity.type,
+                                                   command=_comm)
+            self._commit_commands()
         except requests.exceptions.HTTPError as err:
             msg = err.args[0]
             if "NOT FOUND" not in msg.upper():
@@ -189,50 +763,241 @@ class Controller4Fiware(ABC):
             logging.error(msg)
             logging.error("Commands  cannot be sent, controller stop")
 
-    def create_controller_entity(self):
+    def send_outputs_and_commands(self):
         """
-        Create the controller entity while starting. The controller parameters and their initial values are
-        defined in the config/controller.json. The entity id and entity type of the controller are defined
-        in environment variables.
+        Send output variables and commands to Fiware platform. In batch mode, both are sent
+        with one batch update, otherwise send_output_variable() and send_commands() are invoked.
         """
-        try:
-            controller_entity_exist = self.ORION_CB.get_entity(entity_id=self.controller_entity.id,
-                                                               entity_type=self.controller_entity.type)
-            logging.warning("Controller entity_id is already assigned")
-            # check the structure, extra attributes are allowed
-            keys = controller_entity_exist.model_dump().keys()
-            for key in self.controller_entity.model_dump().keys():
-                if key not in keys:
-                    msg = f'The existing entity has a different structure. ' \
-                          f'Please delete it or change the id'
-                    logging.error(msg)
-                    raise NameError(msg)
-            else:
-                logging.info("The existing entity contains all expected "
-                             "attributes")
+        if self.batch_mode and self.transport is None:
+            self._send_outputs_and_commands_batch()
+        else:
+            self.send_output_variable()
+            self.send_commands()
 
+    @timed("output")
+    @resilient("orion")
+    def _send_outputs_and_commands_batch(self):
+        """
+        Send output variables and commands with one batch update
+        """
+        try:
+            self.update_entities(entities=self._batch_outputs() + self._batch_commands())
+            self._commit_commands()
         except requests.exceptions.HTTPError as err:
             msg = err.args[0]
             if "NOT FOUND" not in msg.upper():
-                raise  # throw other errors except "entity not found"
-            logging.info("Create new PID entity")
-            self.ORION_CB.post_entity(entity=self.controller_entity, update=True)
+                raise
+            self.active = False
+            logging.error(msg)
+            logging.error("Outputs/commands cannot be sent, controller stop")
 
-    def hold_sampling_time(self, start_time: float):
+    def create_lease(self) -> ControllerLease:
+        """
+        Create the lease of the controller entity. It is stored in the controller entity in Orion, or in
+        a file in LEASE_DIR if given.
         """
-        Wait in each control cycle until the sampling time (or cycle time) is up. If the algorithm takes
-        more time than the sampling time, a warning will be given.
+        lease_dir = os.getenv("LEASE_DIR")
+        if lease_dir:
+            file_name = f"{quote(self.controller_entity.id, safe='')}.lease"
+            store = FileLeaseStore(path=os.path.join(lease_dir, file_name))
+        else:
+            store = OrionLeaseStore(client=self.ORION_CB, entity=self.controller_entity)
+        return ControllerLease(store=store,
+                               duration=float(os.getenv("LEASE_DURATION", 15)),
+                               renew_interval=float(os.getenv("LEASE_RENEW_INTERVAL", 5)),
+                               poll_interval=float(os.getenv("STANDBY_POLL_INTERVAL", 5)))
+
+    def check_leadership(self) -> bool:
+        """
+        Check whether this instance holds the lease and may execute the control cycle. The lease is
+        renewed or polled, if due, see ControllerLease. Without leader election, the instance is
+        always the leader. In event-driven mode, only the leader subscribes the notifications, since a
+        standby instance would never apply them.
+
+        Returns:
+            False if the controller is in standby
+        """
+        if self.lease is None:
+            return True
+        leader = self.lease.is_leader()
+        if leader and self.standby:
+            # the parameters may have been changed in standby
+            self._parameter_read_time = self._parameter_modified = None
+            self.on_takeover()
+        self.standby = not leader
+        if self.standby:
+            self.metrics.inc("standby_cycles")
+        if self.event_mode:
+            try:
+                if leader and self.subscription_id is None:
+                    self.subscribe_notifications()
+                elif not leader and self.subscription_id is not None:
+                    self.unsubscribe_notifications()
+            except requests.exceptions.RequestException as err:
+                # repeated in the next cycle, the leader polls the values meanwhile
+                logging.error(f"Subscription of {self.controller_entity.id} could not be updated: {err}")
+        return leader
+
+    def on_takeover(self):
+        """
+        Hook called when this instance becomes the leader after standby, e.g. to reset the state of the
+        control algorithm. Does nothing by default.
+        """
+
+    def release_lease(self):
+        """
+        Release the lease at shutdown, so that a standby instance takes over without waiting for
+        the expiration
+        """
+        if self.lease is not None:
+            self.lease.release()
+
+    def create_controller_entity(self):
+        """
+        Create the controller entity while starting, and again if it has been deleted while running. The
+        controller parameters and their initial values are defined in the config/controller.json, a
+        deleted entity is created with the current values of the parameters. An existing entity is kept,
+        if it contains all parameters with the expected attribute types. The result is cached, so that a
+        restart with unchanged configuration does not request the context broker, see EntityProvisioner.
+        """
+        EntityProvisioner(client=self.ORION_CB).provision(entities=[self.controller_entity_with_values()])
+
+    def controller_entity_with_values(self) -> ContextEntity:
+        """
+        The controller entity with the current values of the parameters, i.e. the initial values before
+        the parameters have been read. The values of self.controller_entity are cleared, see ValueTable.
+        """
+        return self._entity_with_values(self.controller_entity, self.parameter_values)
+
+    @staticmethod
+    def _entity_with_values(entity: ContextEntity, table: ValueTable) -> ContextEntity:
+        """
+        A copy of the entity with the values of its attributes in the table
+        """
+        entity = entity.model_copy(deep=True)
+        attrs = entity.get_attributes()
+        for _attr in attrs:
+            _attr.value = table.get(entity.id, _attr.name)
+        entity.update_attribute(attrs)
+        return entity
+
+    def subscribe_notifications(self):
+        """
+        Start the notification receiver and register a subscription in the Orion context broker,
+        which notifies the controller whenever an input variable or a controller parameter changes.
+        """
+        if self.notification_receiver is None:
+            self.notification_receiver = NotificationReceiver(port=self.notification_port)
+            self.notification_receiver.start()
+        entities = self.input_entities + [self.controller_entity]
+        attrs = sorted({_attr.name for entity in entities for _attr in entity.get_attributes()})
+        subscription = Subscription(
+            description=f"Notify controller {self.controller_entity.id}",
+            subject=Subject(entities=[EntityPattern(id=entity.id, type=entity.type) for entity in entities],
+                            condition=Condition(attrs=attrs)),
+            notification=Notification(http=Http(url=self.notification_url), attrs=attrs),
+            throttling=0)
+        self.subscription_id = self.ORION_CB.post_subscription(subscription=subscription, update=True)
+        logging.info(f"Subscription {self.subscription_id} created for {self.notification_url}")
+
+    def unsubscribe_notifications(self):
+        """
+        Delete the subscription and stop the notification receiver
+        """
+        if self.subscription_id is not None:
+            self.ORION_CB.delete_subscription(subscription_id=self.subscription_id)
+            self.subscription_id = None
+        if self.notification_receiver is not None:
+            self.notification_receiver.stop()
+            self.notification_receiver = None
+
+    def apply_notification(self, message: Message) -> bool:
+        """
+        Update the values of the input variables and the controller parameters with the data of a notification.
 
         Args:
-            start_time:
+            message: the received notification message
 
+        Returns:
+            True if at least one input variable or controller parameter was updated
         """
-        if (time.time()-start_time) > self.sampling_time:
-            warnings.warn("The processing time is longer than the sampling time. The sampling time must be increased!")
-        while (time.time()-start_time) < self.sampling_time:
-            time.sleep(0.01)
-        else:
+        updated = False
+        entities = {(entity_id, entity_type): (table, slots)
+                    for table in (self.input_values, self.parameter_values)
+                    for entity_id, entity_type, slots in table.entities}
+        for data in message.data:
+            if (data.id, data.type) not in entities:
+                continue
+            table, slots = entities[(data.id, data.type)]
+            for slot in slots:
+                try:
+                    table.values[slot] = data.get_attribute(table.keys[slot][1]).value
+                except KeyError:
+                    continue
+                updated = True
+        return updated
+
+    def wait_for_notification(self, last_cycle_time: float) -> bool:
+        """
+        Wait in event-driven mode until a relevant notification arrives. All notifications that
+        have arrived in the meantime are applied. The minimum cycle interval is held before
+        returning, and the waiting is aborted once the maximum cycle interval is up.
+
+        Args:
+            last_cycle_time: start time of the last control cycle
+
+        Returns:
+            True if notifications were applied, False if the maximum cycle interval is up
+        """
+        updated = False
+        while not updated:
+            timeout = None
+            if self.max_cycle_interval > 0:
+                timeout = max(0.0, self.max_cycle_interval - (time.time() - last_cycle_time))
+            try:
+                message = self.notification_receiver.messages.get(timeout=timeout)
+            except queue.Empty:
+                return False
+            updated = self.apply_notification(message)
+        remaining = self.min_cycle_interval - (time.time() - last_cycle_time)
+        if remaining > 0:
+            time.sleep(remaining)
+        # apply the notifications arrived in the meantime
+        while not self.notification_receiver.messages.empty():
+            self.apply_notification(self.notification_receiver.messages.get_nowait())
+        return True
+
+    @timed("sleep")
+    def hold_sampling_time(self, start_time: float = None):
+        """
+        Wait in each control cycle until the sampling time (or cycle time) is up. The control cycles follow
+        fixed-rate deadlines on a monotonic clock, see CycleScheduler. If the algorithm takes more time than
+        the sampling time, a warning will be given. While the controller is inactive, the waiting time
+        increases exponentially up to BACKOFF_MAX. In standby, the controller waits for the poll interval
+        of the lease.
+
+        Args:
+            start_time: start time (time.time()) of the first cycle, only used to align the first deadline
+
+        """
+        if self.standby:
+            # only poll the lease in standby, restart the schedule after the takeover
+            self.scheduler.sleep(self.lease.poll_interval)
+            self.scheduler.start()
             return
+        if not self.active:
+            # back off exponentially while the controller is inactive, restart the schedule afterwards
+            self.metrics.inc("inactive_cycles")
+            self.scheduler.sleep(self.inactive_backoff.next_delay())
+            self.scheduler.start()
+            return
+        self.inactive_backoff.reset()
+        if self.scheduler.deadline is None and start_time is not None:
+            self.scheduler.start(self.scheduler.clock() - (time.time() - start_time))
+        self.scheduler.period = self.sampling_time
+        if self.scheduler.wait():
+            self.metrics.inc("overruns")
+            warnings.warn("The processing time is longer than the sampling time. The sampling time must be increased!")
 
     @abstractmethod
     def control_algorithm(self):
@@ -243,20 +1008,23 @@ class Controller4Fiware(ABC):
         # calculate the output and commands base on the input, controller parameters and external input
         ...
 
-        # For MIMO system, the best practice is to update the value of outputs/commands with following code
-        for entity in self.command_entities:
-            for _comm in entity.get_attributes():
-                logging.debug(f"calculate command {_comm.name} to "
-                              f"id {entity.id} with type {entity.type}")
-                _comm.value = ...  # TODO
-                entity.update_attribute([_comm])
-
-        for entity in self.output_entities:
-            for _output in entity.get_attributes():
-                logging.debug(f"calculate output {_output.name} to "
-                              f"id {entity.id} with type {entity.type}")
-                _output.value = ...  # TODO
-                entity.update_attribute([_output])
+        # For MIMO system, the best practice is to update the values of outputs/commands by slot with
+        # following code, the inputs are read the same way, e.g. self.input_values.values[slot]
+        for slot, (entity_id, attr_name) in enumerate(self.command_values.keys):
+            logging.debug(f"calculate command {attr_name} to id {entity_id}")
+            self.command_values.values[slot] = ...  # TODO
+
+        for slot, (entity_id, attr_name) in enumerate(self.output_values.keys):
+            logging.debug(f"calculate output {attr_name} to id {entity_id}")
+            self.output_values.values[slot] = ...  # TODO
+
+    def control_step(self):
+        """
+        Execute a single control cycle without waiting for the sampling time. This method must be
+        implemented in subclass if the controller should run in a ControllerHost, which schedules
+        the control cycles of many controllers in one process.
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} does not support single control steps")
 
     @abstractmethod
     def control_cycle(self):
@@ -270,15 +1038,23 @@ class Controller4Fiware(ABC):
             while True:
                 start_time = time.time()
 
+                # apply changes of the config files
+                self.reload_config()
+
                 # Update token if run in security mode
                 if self.security_mode:
                     self.update_token()
 
+                # only the leader executes the cycle
+                if not self.check_leadership():
+                    self.hold_sampling_time(start_time=start_time)
+                    continue
+
                 # update the input
                 self.read_input_variable()
 
                 # get external input
-                ...  # TODO
+                self.read_external_input()
 
                 # update the controller parameters
                 self.read_controller_parameter()
@@ -288,14 +1064,11 @@ class Controller4Fiware(ABC):
                     # calculate the output and commands
                     self.control_algorithm()
 
-                    # send output
-                    self.send_output_variable()
-
-                    # send commands
-                    self.send_commands()
+                    # send output and commands
+                    self.send_outputs_and_commands()
 
-                    # wait until next cycle
-                    self.hold_sampling_time(start_time=start_time)
+                # wait until next cycle, also if the controller is deactivated
+                self.hold_sampling_time(start_time=start_time)
         except Exception as ex:
             logging.error(msg=str(ex))
             raise
@@ -1 +1,18 @@
-from .Controller import Controller4Fiware
+import importlib
+
+# The controllers are imported lazily, so that light modules like controller4fiware.config can be
+# used without loading FiLiP
+_exports = {"Controller4Fiware": ".Controller",
+            "AsyncController4Fiware": ".AsyncController",
+            "ControllerHost": ".host",
+            "ControllerCoordinator": ".coordinator"}
+
+
+def __getattr__(name):
+    if name in _exports:
+        return getattr(importlib.import_module(_exports[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_exports))
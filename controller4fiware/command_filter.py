@@ -0,0 +1,90 @@
+"""
+Deadband, minimum resend interval and heartbeat for the commands of a controller.
+"""
+import os
+from typing import Dict, List, Tuple
+from filip.models.ngsi_v2.context import ContextEntity
+
+
+class CommandPolicy:
+    """
+    Rules that decide whether a command is sent. A command is sent if it has never been sent, if
+    its heartbeat interval is up, or if it has changed by more than the deadband and the minimum
+    resend interval is up. Without deadband and minimum resend interval, every command is sent.
+
+    Args:
+        deadband: minimal change of a numeric command, None sends every command
+        min_interval: minimal time between two transmissions in seconds
+        heartbeat: the command is sent again after this time in seconds, even if it has not
+            changed, 0 means never
+    """
+    def __init__(self, deadband: float = None, min_interval: float = 0, heartbeat: float = 0):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+
+    @property
+    def enabled(self) -> bool:
+        return self.deadband is not None or self.min_interval > 0
+
+    def changed(self, value, last_value) -> bool:
+        """
+        Check whether the value differs from the last sent value by more than the deadband
+        """
+        deadband = self.deadband or 0
+        if isinstance(value, (int, float)) and isinstance(last_value, (int, float)) \
+                and not isinstance(value, bool) and not isinstance(last_value, bool):
+            return abs(value - last_value) > deadband
+        return value != last_value
+
+
+class CommandFilter:
+    """
+    Filter of the commands of a controller. The policy of each command is given by the metadata
+    deadband, minResendInterval and heartbeatInterval of the command in command.json, and by the
+    environment variables COMMAND_DEADBAND, COMMAND_MIN_INTERVAL and COMMAND_HEARTBEAT otherwise.
+
+    Args:
+        command_entities: the command entities of the controller
+    """
+    def __init__(self, command_entities: List[ContextEntity]):
+        deadband = os.getenv("COMMAND_DEADBAND")
+        default = dict(deadband=float(deadband) if deadband not in (None, "") else None,
+                       min_interval=float(os.getenv("COMMAND_MIN_INTERVAL", 0)),
+                       heartbeat=float(os.getenv("COMMAND_HEARTBEAT", 0)))
+        self.policies: Dict[Tuple[str, str], CommandPolicy] = {}
+        for entity in command_entities:
+            for _comm in entity.get_attributes():
+                metadata = {name: meta.value for name, meta in (_comm.metadata or {}).items()}
+                self.policies[(entity.id, _comm.name)] = CommandPolicy(
+                    deadband=metadata.get("deadband", default["deadband"]),
+                    min_interval=float(metadata.get("minResendInterval", default["min_interval"])),
+                    heartbeat=float(metadata.get("heartbeatInterval", default["heartbeat"])))
+        # the last sent value and time of each command
+        self.last_sent: Dict[Tuple[str, str], Tuple[object, float]] = {}
+
+    def is_due(self, entity_id: str, attr_name: str, value, now: float) -> bool:
+        """
+        Check whether a command must be sent
+        """
+        policy = self.policies.get((entity_id, attr_name))
+        last = self.last_sent.get((entity_id, attr_name))
+        if policy is None or not policy.enabled or last is None:
+            return True
+        last_value, last_time = last
+        if policy.heartbeat > 0 and now - last_time >= policy.heartbeat:
+            return True
+        if now - last_time < policy.min_interval:
+            return False
+        return policy.changed(value, last_value)
+
+    def commit(self, sent: List[Tuple[str, str, object]], now: float):
+        """
+        Remember the commands, which have been sent successfully
+
+        Args:
+            sent: the sent commands as (entity id, attribute name, value)
+            now: the time of the transmission
+        """
+        for entity_id, attr_name, value in sent:
+            self.last_sent[(entity_id, attr_name)] = (value, now)
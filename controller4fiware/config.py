@@ -0,0 +1,116 @@
+"""
+Cache of the validated configuration of the controllers.
+
+Validating the config files with the FiLiP models requires to import FiLiP, which dominates the
+startup time of a controller. The validated entities are therefore cached in a serialized form,
+keyed by a digest of the config files, so that a controller restarting with an unchanged
+configuration skips the validation, and a configuration check does not need FiLiP at all.
+This module must stay free of heavy imports.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sys
+from importlib.metadata import version, PackageNotFoundError
+from typing import Optional
+
+# All config files, which define the entities of a controller
+CONFIG_FILES = ("input.json", "output.json", "command.json", "controller.json", "loops.json",
+                "external_input.json")
+
+
+def _filip_version() -> str:
+    try:
+        return version("filip")
+    except PackageNotFoundError:
+        return ""
+
+
+def config_digest(config_path: str, kind: str) -> str:
+    """
+    Digest of the config files in a directory. It also covers the kind of configuration (the
+    class, which loads it), the FiLiP version and the Python version, since they determine the
+    validated entities and their serialization.
+
+    Args:
+        config_path: the root path of the configuration files
+        kind: the kind of configuration, e.g. the name of the class which implements load_config()
+
+    Returns:
+        the hex digest
+    """
+    digest = hashlib.sha256(f"{kind}|{_filip_version()}|{sys.version_info[:2]}".encode())
+    for name in CONFIG_FILES:
+        path = os.path.join(config_path, name)
+        if os.path.isfile(path):
+            with open(path, "rb") as f:
+                digest.update(name.encode() + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+class ConfigCache:
+    """
+    Directory with the validated configurations, one pickle file per digest. The directory is only
+    accessible by the user, since the files are unpickled. The cache is located by the environment
+    variable CONFIG_CACHE, ~/.cache/controller4fiware by default, and an empty value disables it.
+
+    Args:
+        directory: the cache directory, CONFIG_CACHE if not given
+    """
+    def __init__(self, directory: str = None):
+        if directory is None:
+            directory = os.getenv("CONFIG_CACHE",
+                                  os.path.join(os.path.expanduser("~"), ".cache", "controller4fiware"))
+        self.directory = directory
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, f"config-{digest}.pickle")
+
+    def contains(self, digest: str) -> bool:
+        return self.enabled and os.path.isfile(self.path(digest))
+
+    def load(self, digest: str) -> Optional[object]:
+        """
+        Load a validated configuration
+
+        Returns:
+            the configuration, None if it is not cached or cannot be loaded
+        """
+        if not self.contains(digest):
+            return None
+        try:
+            with open(self.path(digest), "rb") as f:
+                return pickle.load(f)
+        except Exception as ex:
+            logging.warning(f"Cached configuration cannot be loaded: {ex}")
+            return None
+
+    def store(self, digest: str, config: object):
+        """
+        Store a validated configuration. The file is replaced atomically, so that controllers
+        starting at the same time never read a partial file.
+        """
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            path = self.path(digest)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as ex:
+            logging.warning(f"Configuration cannot be cached: {ex}")
+
+    def remove(self, digest: str):
+        if not self.enabled:
+            return
+        try:
+            os.remove(self.path(digest))
+        except FileNotFoundError:
+            pass
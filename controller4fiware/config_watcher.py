@@ -0,0 +1,122 @@
+"""
+Watcher of the config directory of a controller, which detects changes of the config files for
+the hot reload of the configuration.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import time
+from typing import Dict, Tuple
+from controller4fiware.config import CONFIG_FILES
+
+# inotify events, which indicate a change of a file in the watched directory
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class ConfigWatcher:
+    """
+    Detects changes in a config directory. On Linux, the directory is watched with inotify, which
+    also covers files replaced by editors or by the symlink swap of Kubernetes config maps. Elsewhere,
+    or if inotify is not available, the modification times of the config files are polled.
+
+    changed() never blocks, so that it can be called at each cycle boundary. A detected change is only
+    a hint, the caller compares the digest of the config files before reloading.
+
+    Args:
+        config_path: the config directory
+        interval: minimal time between two polls of the modification times in seconds
+        use_inotify: whether to use inotify if available
+    """
+    def __init__(self, config_path: str, interval: float = 5, use_inotify: bool = True):
+        self.config_path = config_path
+        self.interval = interval
+        self._fd = self._init_inotify() if use_inotify else None
+        self._poll_time = time.monotonic()
+        self._signature = self._stat_signature()
+
+    def _init_inotify(self):
+        """
+        Start watching the config directory with inotify
+
+        Returns:
+            the inotify file descriptor, None if inotify is not available
+        """
+        library = ctypes.util.find_library("c")
+        if not library:
+            return None
+        try:
+            libc = ctypes.CDLL(library, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+            if libc.inotify_add_watch(fd, os.fsencode(self.config_path), WATCH_MASK) < 0:
+                error = ctypes.get_errno()
+                os.close(fd)
+                raise OSError(error, "inotify_add_watch failed")
+        except (AttributeError, OSError) as ex:
+            logging.info(f"inotify is not available, the config files are polled: {ex}")
+            return None
+        logging.debug(f"Watch config directory {self.config_path} with inotify")
+        return fd
+
+    def _stat_signature(self) -> Dict[str, Tuple[int, int, int]]:
+        signature = {}
+        for name in CONFIG_FILES:
+            try:
+                stat = os.stat(os.path.join(self.config_path, name))
+            except FileNotFoundError:
+                continue
+            signature[name] = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        return signature
+
+    def _read_events(self) -> bool:
+        changed = False
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                return changed
+            except OSError as ex:
+                if ex.errno == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = struct.unpack_from("iIII", data, offset)
+                offset += struct.calcsize("iIII") + length
+                changed |= bool(mask & WATCH_MASK)
+
+    def changed(self) -> bool:
+        """
+        Check whether the config files may have changed since the last call
+        """
+        if self._fd is not None:
+            return self._read_events()
+        now = time.monotonic()
+        if now - self._poll_time < self.interval:
+            return False
+        self._poll_time = now
+        signature = self._stat_signature()
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
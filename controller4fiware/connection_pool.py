@@ -0,0 +1,82 @@
+"""
+Shared and tuned HTTP connection pools for the clients of Orion, QuantumLeap and Keycloak.
+"""
+import os
+import threading
+from typing import Tuple
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that applies a default timeout to every request without an explicit timeout,
+    so that a stalled endpoint cannot block a control cycle forever. The adapter can be mounted
+    on several sessions, and closing a session does not close its connection pools.
+
+    Args:
+        timeout: the default (connect timeout, read timeout) in seconds
+        **kwargs: arguments of HTTPAdapter, e.g. pool_connections and pool_maxsize
+    """
+    def __init__(self, timeout: Tuple[float, float] = (3.05, 10), **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+    def close(self):
+        # FiLiP closes the session after each paginated query (e.g. a batch query), which would
+        # drop the kept-alive connections of all sessions sharing this adapter
+        pass
+
+
+def create_adapter(pool_maxsize: int = None) -> TimeoutHTTPAdapter:
+    """
+    Create an adapter with the pool settings of the environment variables HTTP_POOL_CONNECTIONS,
+    HTTP_POOL_SIZE, HTTP_POOL_BLOCK, HTTP_CONNECT_TIMEOUT and HTTP_READ_TIMEOUT.
+
+    Args:
+        pool_maxsize: maximal number of connections kept alive per host, overrides HTTP_POOL_SIZE
+    """
+    return TimeoutHTTPAdapter(
+        timeout=(float(os.getenv("HTTP_CONNECT_TIMEOUT", 3.05)), float(os.getenv("HTTP_READ_TIMEOUT", 10))),
+        pool_connections=int(os.getenv("HTTP_POOL_CONNECTIONS", 4)),
+        pool_maxsize=pool_maxsize or int(os.getenv("HTTP_POOL_SIZE", 10)),
+        pool_block=os.getenv("HTTP_POOL_BLOCK", 'False').lower() in ('true', '1', 'yes'))
+
+
+_shared_adapter = None
+_shared_adapter_lock = threading.Lock()
+
+
+def shared_adapter() -> TimeoutHTTPAdapter:
+    """
+    The adapter of the process, whose connection pools are shared by all sessions created with
+    create_session()
+    """
+    global _shared_adapter
+    with _shared_adapter_lock:
+        if _shared_adapter is None:
+            _shared_adapter = create_adapter()
+        return _shared_adapter
+
+
+def create_session(adapter: HTTPAdapter = None) -> requests.Session:
+    """
+    Create a session that uses the given or the shared connection pools. Every client needs its own
+    session, because the FiLiP clients write their fiware headers into the session. If HTTP_KEEP_ALIVE
+    is disabled, the connections are closed after each request.
+
+    Args:
+        adapter: the adapter with the connection pools, shared_adapter() if not given
+    """
+    adapter = adapter if adapter is not None else shared_adapter()
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if os.getenv("HTTP_KEEP_ALIVE", 'True').lower() not in ('true', '1', 'yes'):
+        session.headers["Connection"] = "close"
+    return session
@@ -0,0 +1,241 @@
+"""
+Coordinator that shards the controllers of a manifest across worker processes.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Type
+from controller4fiware.Controller import Controller4Fiware
+from controller4fiware.host import ControllerHost, read_manifest
+from controller4fiware.resilience import Backoff
+
+
+def available_cpus() -> List[int]:
+    """
+    The CPUs this process may run on, e.g. limited by the cpuset of a container
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def assign_shards(keys: List[str], shards: int) -> List[List[int]]:
+    """
+    Assign keys to shards with rendezvous hashing: each key goes to the shard with the highest hash of
+    key and shard. The assignment only depends on the key and the number of shards, so it is the same
+    after every restart, and changing the number of shards only moves the keys of the added or removed
+    shards.
+
+    Args:
+        keys: the keys, e.g. the config paths of the controllers
+        shards: the number of shards
+
+    Returns:
+        the indices of the keys in each shard
+    """
+    assignment = [[] for _ in range(shards)]
+    for i, key in enumerate(keys):
+        shard = max(range(shards), key=lambda s: hashlib.sha256(f"{key}|{s}".encode()).digest())
+        assignment[shard].append(i)
+    return assignment
+
+
+def _run_worker(controller_class: Type[Controller4Fiware], entries: List[dict], heartbeat, stop,
+                heartbeat_interval: float, metrics_port: int = None, cpu: int = None):
+    """
+    Main function of a worker process, which runs its controllers in a ControllerHost and reports its
+    liveness until the coordinator stops it. The process exits with code 1 if the host fails.
+    """
+    if cpu is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, {cpu})
+    def beat():
+        heartbeat.value = time.time()
+
+    # the heartbeat is written by the host whenever it makes progress, so that it stops if the
+    # scheduler or the worker threads are stuck
+    host = ControllerHost(controller_class=controller_class,
+                          config_paths=[entry["config_path"] for entry in entries],
+                          sampling_times=[entry.get("sampling_time") for entry in entries],
+                          heartbeat=beat, heartbeat_interval=heartbeat_interval)
+    host.create_controller_entities()
+    if metrics_port is not None:
+        host.start_metrics_server(port=metrics_port)
+    thread = threading.Thread(target=host.run, daemon=True)
+    thread.start()
+    while thread.is_alive() and not stop.is_set():
+        stop.wait(heartbeat_interval)
+    host.stop()
+    thread.join()
+    if not stop.is_set():
+        logging.error("Controller host stopped unexpectedly")
+        sys.exit(1)
+
+
+class WorkerState:
+    """
+    State of one worker process in the coordinator
+
+    Args:
+        index: the index of the worker, which determines its shard
+        entries: the manifest entries of its controllers
+        cpu: the CPU the worker is pinned to, None for no pinning
+        backoff: the delays between restarts after failures
+    """
+    def __init__(self, index: int, entries: List[dict], cpu: int = None, backoff: Backoff = None):
+        self.index = index
+        self.entries = entries
+        self.cpu = cpu
+        self.backoff = backoff
+        self.process = None
+        self.heartbeat = None
+        self.started = None  # start time of the current process
+        self.restart_at = 0.0  # earliest time of the next start
+        self.restarts = 0
+
+
+class ControllerCoordinator:
+    """
+    ControllerCoordinator runs the controllers of a manifest in a pool of worker processes, so that
+    they are not limited by the GIL of one process. Each worker runs its shard of the controllers in a
+    ControllerHost. The controllers are assigned to the workers by rendezvous hashing of their config
+    paths (see assign_shards()), so a worker restarted after a failure takes over exactly its previous
+    controllers, and the other workers are not affected.
+
+    The workers report their liveness with a heartbeat. A worker which exits or whose heartbeat is
+    older than the liveness timeout is terminated and restarted, with exponentially increasing delays
+    while it keeps failing before its first heartbeat. Optionally, each worker is pinned to one CPU,
+    so that the CPU time per controller is predictable.
+
+    Args:
+        controller_class: the controller class, e.g. PID4Fiware
+        entries: the manifest entries, see read_manifest()
+        processes: number of worker processes, WORKER_PROCESSES or the number of available CPUs if
+            not given, but at most the number of controllers
+        heartbeat_interval: interval of the heartbeats in seconds
+        liveness_timeout: maximal age of the heartbeat of a running worker in seconds, which also
+            bounds its startup
+        pin_cpus: whether to pin each worker to one CPU, WORKER_PIN_CPU if not given
+        metrics_port: first port of the metrics endpoints, worker i serves its metrics on
+            metrics_port + i. No metrics endpoints if not given.
+    """
+    def __init__(self,
+                 controller_class: Type[Controller4Fiware],
+                 entries: List[dict],
+                 processes: int = None,
+                 heartbeat_interval: float = None,
+                 liveness_timeout: float = None,
+                 pin_cpus: bool = None,
+                 metrics_port: int = None):
+        self.controller_class = controller_class
+        self.entries = entries
+        cpus = available_cpus()
+        processes = processes or int(os.getenv("WORKER_PROCESSES", 0)) or len(cpus)
+        self.processes = max(1, min(processes, len(entries)))
+        self.heartbeat_interval = heartbeat_interval or float(os.getenv("WORKER_HEARTBEAT_INTERVAL", 1))
+        self.liveness_timeout = liveness_timeout or float(os.getenv("WORKER_LIVENESS_TIMEOUT", 30))
+        if pin_cpus is None:
+            pin_cpus = os.getenv("WORKER_PIN_CPU", 'False').lower() in ('true', '1', 'yes')
+        self.metrics_port = metrics_port
+
+        # spawn instead of fork, since the coordinator may already run threads
+        self._context = multiprocessing.get_context("spawn")
+        self._stop = self._context.Event()
+        shards = assign_shards([entry["config_path"] for entry in entries], self.processes)
+        self.workers = [WorkerState(index=i, entries=[entries[j] for j in shard],
+                                    cpu=cpus[i % len(cpus)] if pin_cpus else None,
+                                    backoff=Backoff(initial=1, maximum=float(os.getenv("BACKOFF_MAX", 60))))
+                        for i, shard in enumerate(shards)]
+
+    @classmethod
+    def from_manifest(cls, controller_class: Type[Controller4Fiware], manifest_path: str, **kwargs):
+        """
+        Create the coordinator from a manifest file, see read_manifest()
+
+        Args:
+            controller_class: the controller class, e.g. PID4Fiware
+            manifest_path: path of the manifest file
+        """
+        return cls(controller_class=controller_class, entries=read_manifest(manifest_path), **kwargs)
+
+    def _start_worker(self, worker: WorkerState):
+        worker.heartbeat = self._context.Value("d", 0.0, lock=False)
+        worker.process = self._context.Process(
+            target=_run_worker,
+            name=f"controller-worker-{worker.index}",
+            args=(self.controller_class, worker.entries, worker.heartbeat, self._stop, self.heartbeat_interval,
+                  None if self.metrics_port is None else self.metrics_port + worker.index, worker.cpu),
+            daemon=True)
+        worker.started = time.time()
+        worker.process.start()
+        logging.info(f"Started worker {worker.index} (pid {worker.process.pid}) "
+                     f"with {len(worker.entries)} controllers")
+
+    def _restart_worker(self, worker: WorkerState, reason: str):
+        logging.error(f"Worker {worker.index} (pid {worker.process.pid}) {reason}, restart it")
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.process.kill()
+                worker.process.join()
+        worker.process = None
+        worker.restarts += 1
+        worker.restart_at = time.time() + worker.backoff.next_delay()
+
+    def check_workers(self):
+        """
+        Restart the workers which have exited or whose heartbeat is too old, and start the workers
+        whose restart delay has passed
+        """
+        now = time.time()
+        for worker in self.workers:
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self._start_worker(worker)
+                continue
+            last_beat = worker.heartbeat.value
+            if not worker.process.is_alive():
+                self._restart_worker(worker, f"exited with code {worker.process.exitcode}")
+            elif now - (last_beat or worker.started) > self.liveness_timeout:
+                self._restart_worker(worker, f"sent no heartbeat for {now - (last_beat or worker.started):.1f} s")
+            elif last_beat >= worker.started:
+                # the worker is up, the next failure is restarted without delay
+                worker.backoff.reset()
+
+    def status(self) -> List[Dict]:
+        """
+        The state of each worker, e.g. for logging
+        """
+        now = time.time()
+        return [{"worker": worker.index,
+                 "pid": worker.process.pid if worker.process is not None else None,
+                 "alive": worker.process is not None and worker.process.is_alive(),
+                 "controllers": len(worker.entries),
+                 "restarts": worker.restarts,
+                 "heartbeat_age": now - worker.heartbeat.value
+                 if worker.heartbeat is not None and worker.heartbeat.value else None}
+                for worker in self.workers]
+
+    def run(self):
+        """
+        Start the workers and supervise them until stop() is called
+        """
+        logging.info(f"Run {len(self.entries)} controllers in {self.processes} worker processes")
+        while not self._stop.is_set():
+            self.check_workers()
+            self._stop.wait(self.heartbeat_interval)
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(timeout=self.liveness_timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+    def stop(self):
+        """
+        Stop the coordinator and all workers, the running control steps are completed
+        """
+        self._stop.set()
@@ -0,0 +1,377 @@
+"""
+In-process fake of the Orion context broker for benchmarks and offline tests of the controllers.
+"""
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+class FakeOrion:
+    """
+    Small local HTTP server that implements the NGSI-v2 endpoints used by Controller4Fiware:
+    attribute values, entities, batch query/update and subscriptions. The entities are kept in
+    memory in normalized format, and a fixed latency (plus random jitter) can be injected into
+    every request to emulate a remote context broker. Fiware service headers are ignored.
+
+    Like Orion, the fake sends a notification to the HTTP url of each matching subscription, whenever
+    the value of an attribute in the condition of the subscription changes, e.g. to test the
+    event-driven mode offline. The notifications are sent in order by a background thread. Throttling,
+    expiration and the initial notification of a new subscription are not supported.
+
+    Instead of over HTTP, the fake can also be used in memory with session(), e.g. for simulations
+    with a virtual clock.
+
+    Args:
+        latency: latency in seconds added to every request
+        jitter: maximal random latency in seconds added on top of the latency
+        host: the interface the server binds to
+        port: the port the server listens on, 0 selects a free port
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.entities: Dict[str, dict] = {}
+        self.subscriptions: Dict[str, dict] = {}
+        self.requests = 0  # number of handled requests
+        self.fail_status = None  # if set, every request is answered with this status code, e.g. 503
+        self._lock = threading.Lock()
+        self._changes: List[Tuple[dict, set]] = []  # updated entities and attributes of the current request
+        self._notifications = queue.Queue()
+        self._notifier = None
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        logging.debug(f"Fake Orion listens on {self.url}")
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_entities(self, entities: List[dict]):
+        """
+        Add or replace entities given in normalized format, e.g. the content of input.json
+        """
+        with self._lock:
+            for entity in entities:
+                self.entities[entity["id"]] = json.loads(json.dumps(entity))
+
+    def reset_requests(self):
+        """
+        Reset the request counter and return its last value
+        """
+        with self._lock:
+            count, self.requests = self.requests, 0
+        return count
+
+    def set_value(self, entity_id: str, attr_name: str, value):
+        """
+        Set the value of an attribute directly, e.g. a measurement of a simulated sensor
+        """
+        with self._lock:
+            self._update(self.entities[entity_id], {attr_name: {"value": value}}, replace=False)
+        self._notify()
+
+    def get_value(self, entity_id: str, attr_name: str):
+        """
+        Get the value of an attribute directly, e.g. a command for a simulated actuator
+        """
+        with self._lock:
+            return self.entities[entity_id][attr_name].get("value")
+
+    def session(self) -> requests.Session:
+        """
+        Create a session, which passes the requests to this fake directly in memory instead of
+        over HTTP, see InMemoryAdapter. The server does not need to be started for it.
+        """
+        session = requests.Session()
+        # no proxies and netrc from the environment, looking them up costs more than a request
+        session.trust_env = False
+        session.mount(self.url, InMemoryAdapter(self))
+        return session
+
+    def handle(self, method: str, url: str, body=None) -> Tuple[int, bytes, Dict[str, str]]:
+        """
+        Handle a request without latency
+
+        Args:
+            method: the HTTP method
+            url: the path and query of the request
+            body: the decoded JSON body
+
+        Returns:
+            status code, body and headers of the response
+        """
+        with self._lock:
+            self.requests += 1
+        if self.fail_status:
+            return self._response(self.fail_status, {"error": "ServiceUnavailable"})
+        url = urlparse(url)
+        path = url.path.rstrip("/")
+        params = parse_qs(url.query)
+        with self._lock:
+            response = self._route(method, path, params, body)
+        self._notify()
+        return response
+
+    def _update(self, entity: dict, attrs: dict, replace: bool = True):
+        """
+        Update the attributes of an entity and remember the changed attributes for the notifications
+
+        Args:
+            entity: the stored entity
+            attrs: the new attributes in normalized format
+            replace: whether the attributes are replaced, otherwise only their keys are updated
+        """
+        changed = {name for name, attr in attrs.items() if name not in ("id", "type") and
+                   (name not in entity or entity[name].get("value") != attr.get("value"))}
+        for name, attr in attrs.items():
+            if replace or name in ("id", "type") or name not in entity:
+                entity[name] = attr
+            else:
+                entity[name].update(attr)
+        if changed:
+            self._changes.append((entity, changed))
+
+    def _notify(self):
+        """
+        Queue the notifications of the subscriptions, whose condition matches the changes of the last
+        request, and start the notifier thread if needed
+        """
+        with self._lock:
+            changes, self._changes = self._changes, []
+            for subscription_id, subscription in self.subscriptions.items():
+                subject = subscription.get("subject", {})
+                condition = set(subject.get("condition", {}).get("attrs") or [])
+                notification = subscription.get("notification", {})
+                url = notification.get("http", {}).get("url")
+                data = [self._select(entity, notification.get("attrs")) for entity, changed in changes
+                        if (not condition or condition & changed) and
+                        any(self._matches(pattern, entity) for pattern in subject.get("entities", []))]
+                if not data or not url:
+                    continue
+                if notification.get("attrsFormat") == "keyValues":
+                    data = [self._key_values(entity) for entity in data]
+                # copy the entities, which may change before the notification is sent
+                self._notifications.put((url, json.dumps({"subscriptionId": subscription_id, "data": data})))
+                if self._notifier is None:
+                    self._notifier = threading.Thread(target=self._send_notifications, daemon=True)
+                    self._notifier.start()
+
+    @staticmethod
+    def _matches(pattern: dict, entity: dict) -> bool:
+        if pattern.get("type") and pattern["type"] != entity.get("type"):
+            return False
+        if "idPattern" in pattern:
+            return re.fullmatch(pattern["idPattern"], entity["id"]) is not None
+        return pattern.get("id") == entity["id"]
+
+    def _send_notifications(self):
+        session = requests.Session()
+        session.trust_env = False
+        while True:
+            url, data = self._notifications.get()
+            try:
+                session.post(url, data=data, headers={"Content-Type": "application/json"}, timeout=5)
+            except requests.exceptions.RequestException as err:
+                logging.warning(f"Notification to {url} failed: {err}")
+
+    @staticmethod
+    def _response(status: int, body=None, headers: dict = None, empty: bool = None):
+        data = b"" if empty or (empty is None and body is None) else json.dumps(body).encode("utf-8")
+        headers = dict(headers or {})
+        if data:
+            headers["Content-Type"] = "application/json"
+        return status, data, headers
+
+    def _not_found(self, description="The requested entity has not been found"):
+        return self._response(404, {"error": "NotFound", "description": description})
+
+    def _route(self, method: str, path: str, params: dict, body):
+        match = re.fullmatch(r"/v2/entities/([^/]+)/attrs/([^/]+)/value", path)
+        if match:
+            entity = self.entities.get(match[1])
+            if entity is None or match[2] not in entity:
+                return self._not_found()
+            if method == "GET":
+                return self._response(200, entity[match[2]].get("value"), empty=False)
+            self._update(entity, {match[2]: {"value": body}}, replace=False)
+            return self._response(204)
+        match = re.fullmatch(r"/v2/entities/([^/]+)/attrs", path)
+        if match and method in ("PATCH", "POST"):
+            entity = self.entities.get(match[1])
+            if entity is None:
+                return self._not_found()
+            if method == "PATCH" and any(name not in entity for name in body):
+                return self._response(422, {"error": "Unprocessable", "description": "Attribute not found"})
+            self._update(entity, body)
+            return self._response(204)
+        match = re.fullmatch(r"/v2/entities/([^/]+)", path)
+        if match and method == "GET":
+            entity = self.entities.get(match[1])
+            if entity is None:
+                return self._not_found()
+            return self._response(200, self._render(entity, params))
+        if match and method == "DELETE":
+            if self.entities.pop(match[1], None) is None:
+                return self._not_found()
+            return self._response(204)
+        if path == "/v2/entities" and method == "POST":
+            if body["id"] in self.entities and "upsert" not in params.get("options", [""])[0]:
+                return self._response(422, {"error": "Unprocessable", "description": "Already Exists"})
+            self._update(self.entities.setdefault(body["id"], {}), body)
+            return self._response(201, headers={"Location": f"/v2/entities/{body['id']}?type={body['type']}"})
+        if path == "/v2/op/query" and method == "POST":
+            attrs = body.get("attrs")
+            results = [self._select(self.entities[pattern["id"]], attrs)
+                       for pattern in body.get("entities", []) if pattern.get("id") in self.entities]
+            if "keyValues" in params.get("options", [""])[0]:
+                results = [self._key_values(result) for result in results]
+            return self._response(200, results, headers={"Fiware-Total-Count": str(len(results))})
+        if path == "/v2/op/update" and method == "POST":
+            if body.get("actionType") in ("append", "APPEND"):
+                for entity in body["entities"]:
+                    self._update(self.entities.setdefault(entity["id"], {}), entity)
+                return self._response(204)
+            missing = [entity["id"] for entity in body["entities"] if entity["id"] not in self.entities]
+            for entity in body["entities"]:
+                if entity["id"] in self.entities:
+                    self._update(self.entities[entity["id"]], entity)
+            if missing:
+                return self._not_found(f"Entities {missing} do not exist")
+            return self._response(204)
+        if path == "/v2/subscriptions" and method == "POST":
+            subscription_id = str(len(self.subscriptions) + 1)
+            self.subscriptions[subscription_id] = body
+            return self._response(201, headers={"Location": f"/v2/subscriptions/{subscription_id}"})
+        if path == "/v2/subscriptions" and method == "GET":
+            subscriptions = [dict(subscription, id=key) for key, subscription in self.subscriptions.items()]
+            return self._response(200, subscriptions,
+                                  headers={"Fiware-Total-Count": str(len(subscriptions))})
+        match = re.fullmatch(r"/v2/subscriptions/([^/]+)", path)
+        if match and method == "DELETE":
+            if self.subscriptions.pop(match[1], None) is None:
+                return self._not_found()
+            return self._response(204)
+        return self._response(400, {"error": "BadRequest", "description": f"{method} {path} not supported"})
+
+    @staticmethod
+    def _select(entity: dict, attrs: List[str] = None) -> dict:
+        return {key: value for key, value in entity.items()
+                if key in ("id", "type") or not attrs or key in attrs}
+
+    def _render(self, entity: dict, params: dict) -> dict:
+        attrs = params["attrs"][0].split(",") if "attrs" in params else None
+        result = self._select(entity, attrs)
+        if "keyValues" in params.get("options", [""])[0]:
+            result = self._key_values(result)
+        return result
+
+    @staticmethod
+    def _key_values(entity: dict) -> dict:
+        return {key: value if key in ("id", "type") else value.get("value") for key, value in entity.items()}
+
+    def _handler(self):
+        orion = self
+
+        class OrionHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True  # headers and body are written separately
+
+            def log_message(self, format, *args):
+                pass
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                if not length:
+                    return None
+                return _decode(self.rfile.read(length))
+
+            def _handle(self, method: str):
+                body = self._body()
+                delay = orion.latency + random.uniform(0, orion.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                status, data, headers = orion.handle(method, self.path, body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PUT(self):
+                self._handle("PUT")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return OrionHandler
+
+
+def _decode(data: bytes):
+    try:
+        return json.loads(data)
+    except ValueError:
+        return data.decode("utf-8")
+
+
+class InMemoryAdapter(BaseAdapter):
+    """
+    Transport adapter of requests, which passes the requests to a FakeOrion in memory. Everything
+    above the transport, e.g. FiLiP and the hooks of the session, runs as with a real context
+    broker, but without sockets, threads and latency.
+
+    Args:
+        orion: the fake context broker
+    """
+    def __init__(self, orion: FakeOrion):
+        super().__init__()
+        self.orion = orion
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        body = request.body
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        status, data, headers = self.orion.handle(request.method, request.path_url,
+                                                  _decode(body) if body else None)
+        response = requests.Response()
+        response.status_code = status
+        response.reason = HTTPStatus(status).phrase
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = data
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,75 @@
+"""
+Local history of the variables of a controller.
+"""
+import math
+from typing import Dict, List, Tuple
+import numpy as np
+from filip.models.ngsi_v2.context import ContextEntity
+from controller4fiware.ring_buffer import RingBuffer
+from controller4fiware.value_table import ValueTable
+
+
+def to_float(value) -> float:
+    """
+    Convert a value to float, values that are not numeric (e.g. empty commands or arrays) are NaN
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class VariableHistory:
+    """
+    History of the latest values of the variables (attributes) of several entities. Each variable has
+    a preallocated ring buffer, so that recording a cycle is cheap and the history can be read as
+    numpy views without any I/O, e.g.
+
+        controller.history.values("urn:ngsi-ld:TemperatureSensor:001", "temperature")
+
+    Args:
+        entities: the entities, whose attributes are recorded
+        depth: number of values kept per variable
+    """
+    def __init__(self, entities: List[ContextEntity], depth: int):
+        self.depth = depth
+        self.buffers: Dict[Tuple[str, str], RingBuffer] = {
+            (entity.id, _attr.name): RingBuffer(capacity=depth)
+            for entity in entities for _attr in entity.get_attributes()}
+
+    def track(self, entities: List[ContextEntity]):
+        """
+        Record the attributes of the given entities from now on, e.g. after a reload of the
+        configuration. The history of the variables, which are still recorded, is kept.
+        """
+        buffers = {}
+        for entity in entities:
+            for _attr in entity.get_attributes():
+                key = (entity.id, _attr.name)
+                buffers[key] = self.buffers[key] if key in self.buffers else RingBuffer(capacity=self.depth)
+        self.buffers = buffers
+
+    def record(self, tables: List[ValueTable], time: float):
+        """
+        Append the current values of the attributes in the value tables
+        """
+        for table in tables:
+            for key, value in zip(table.keys, table.values):
+                buffer = self.buffers.get(key)
+                if buffer is not None:
+                    buffer.append(time, to_float(value))
+
+    def buffer(self, entity_id: str, attr_name: str) -> RingBuffer:
+        return self.buffers[(entity_id, attr_name)]
+
+    def values(self, entity_id: str, attr_name: str) -> np.ndarray:
+        """
+        The recorded values of a variable in chronological order (view)
+        """
+        return self.buffers[(entity_id, attr_name)].values
+
+    def times(self, entity_id: str, attr_name: str) -> np.ndarray:
+        """
+        The time stamps (seconds since epoch) of the recorded values (view)
+        """
+        return self.buffers[(entity_id, attr_name)].times
@@ -0,0 +1,202 @@
+"""
+Host process that runs many controllers in one process on a shared scheduler.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Type, Union
+import requests
+from controller4fiware.Controller import Controller4Fiware
+from controller4fiware.connection_pool import create_adapter, create_session
+from controller4fiware.keycloak_token_handler import TokenManager
+from controller4fiware.metrics import MetricsServer
+from controller4fiware.provisioning import EntityProvisioner
+
+
+def read_manifest(manifest_path: str) -> List[dict]:
+    """
+    Read a manifest file, which lists the controllers to run, e.g.
+
+        [{"config_path": "pid_001", "sampling_time": 1}, "pid_002"]
+
+    Relative config paths are resolved against the directory of the manifest.
+
+    Args:
+        manifest_path: path of the manifest file
+
+    Returns:
+        the entries with the keys "config_path" and optionally "sampling_time"
+    """
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+    root = os.path.dirname(os.path.abspath(manifest_path))
+    entries = [dict(entry) if isinstance(entry, dict) else {"config_path": entry} for entry in manifest]
+    for entry in entries:
+        entry["config_path"] = os.path.join(root, entry["config_path"])
+    return entries
+
+
+class ControllerHost:
+    """
+    ControllerHost runs the control cycles of many controllers in one process. The controllers share
+    the HTTP connection pool and, in security mode, the Keycloak token. A single scheduler thread
+    dispatches the control steps to a small pool of worker threads, so that the number of threads and
+    connections does not grow with the number of controllers.
+
+    The controllers must implement Controller4Fiware.control_step(). The event-driven mode is not
+    supported in the host.
+
+    Args:
+        controller_class: the controller class, e.g. PID4Fiware
+        config_paths: the config directories, one for each controller
+        sampling_times: optional sampling times in seconds, one for each controller. The environment
+            variable SAMPLING_TIME is used if not given.
+        max_workers: number of worker threads that execute the control steps
+        pool_maxsize: maximal number of connections kept alive per host
+        heartbeat: optional function that is called whenever the host makes progress, i.e. a control
+            step is dispatched or completed, or the idle scheduler waits for the next deadline
+        heartbeat_interval: maximal interval of the heartbeats of the idle scheduler in seconds
+    """
+    def __init__(self,
+                 controller_class: Type[Controller4Fiware],
+                 config_paths: List[str],
+                 sampling_times: List[Union[float, None]] = None,
+                 max_workers: int = None,
+                 pool_maxsize: int = None,
+                 heartbeat: Callable[[], None] = None,
+                 heartbeat_interval: float = 1):
+        self.max_workers = max_workers or int(os.getenv("HOST_WORKERS", min(32, len(config_paths))))
+        pool_maxsize = pool_maxsize or int(os.getenv("HTTP_POOL_SIZE", self.max_workers))
+        # all sessions share the connection pools of one adapter, but keep their own fiware headers
+        self.adapter = create_adapter(pool_maxsize=pool_maxsize)
+        security_mode = os.getenv("SECURITY_MODE", 'False').lower() in ('true', '1', 'yes')
+        self.token_manager = TokenManager.shared() if security_mode else None
+
+        self.controllers = []
+        sampling_times = sampling_times or [None] * len(config_paths)
+        for config_path, sampling_time in zip(config_paths, sampling_times):
+            controller = controller_class(config_path=config_path, session=self.create_session(),
+                                          token_manager=self.token_manager)
+            if sampling_time is not None:
+                assert sampling_time >= 0.1, "Controller sampling time must be larger than 0.1 sec"
+                controller.sampling_time = float(sampling_time)
+            self.controllers.append(controller)
+        self.metrics_server = None
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_manifest(cls, controller_class: Type[Controller4Fiware], manifest_path: str, **kwargs):
+        """
+        Create the host from a manifest file, which lists the controllers to run, see read_manifest()
+
+        Args:
+            controller_class: the controller class, e.g. PID4Fiware
+            manifest_path: path of the manifest file
+        """
+        entries = read_manifest(manifest_path)
+        return cls(controller_class=controller_class,
+                   config_paths=[entry["config_path"] for entry in entries],
+                   sampling_times=[entry.get("sampling_time") for entry in entries],
+                   **kwargs)
+
+    def create_session(self) -> requests.Session:
+        """
+        Create a session that uses the shared connection pools
+        """
+        return create_session(adapter=self.adapter)
+
+    def start_metrics_server(self, port: int = 9100):
+        """
+        Expose the metrics of all controllers in the Prometheus text format under /metrics
+
+        Args:
+            port: the port of the metrics endpoint
+        """
+        self.metrics_server = MetricsServer(metrics=[controller.metrics for controller in self.controllers],
+                                            port=port)
+        self.metrics_server.start()
+
+    def create_controller_entities(self):
+        """
+        Create the controller entities of all controllers. The controllers of the same context broker and
+        FIWARE service share one batch query and one batch upsert, see EntityProvisioner.
+        """
+        groups = {}
+        for controller in self.controllers:
+            key = (controller.fiware_params["cb_url"], controller.fiware_params["service"],
+                   controller.fiware_params["service_path"])
+            groups.setdefault(key, []).append(controller)
+        for controllers in groups.values():
+            EntityProvisioner(client=controllers[0].ORION_CB).provision(
+                entities=[controller.controller_entity_with_values() for controller in controllers])
+
+    def run(self):
+        """
+        Run the control cycles of all controllers until stop() is called. Each controller is executed
+        once per sampling time. If the previous step of a controller is still running, its next step
+        is skipped. The heartbeat is called whenever a step is dispatched or completed, and while the
+        scheduler waits for the next deadline without any running step, so that it stops if the scheduler
+        or all worker threads are stuck.
+        """
+        start = time.monotonic()
+        # stagger the first cycles to spread the load over the sampling time
+        schedule = [(start + i * controller.sampling_time / len(self.controllers), i)
+                    for i, controller in enumerate(self.controllers)]
+        heapq.heapify(schedule)
+        running = [None] * len(self.controllers)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while not self._stop.is_set():
+                deadline, i = schedule[0]
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self._stop.wait(timeout=min(timeout, self.heartbeat_interval))
+                    if all(future is None or future.done() for future in running):
+                        self._beat()
+                    continue
+                controller = self.controllers[i]
+                if running[i] is not None and not running[i].done():
+                    logging.warning(f"Control step of {controller.controller_entity.id} "
+                                    f"is longer than the sampling time and skipped")
+                    controller.metrics.inc("overruns")
+                else:
+                    running[i] = executor.submit(self._step, controller)
+                    running[i].add_done_callback(lambda _: self._beat())
+                    self._beat()
+                if not controller.active:
+                    # back off while the controller is inactive
+                    next_deadline = time.monotonic() + controller.inactive_backoff.next_delay()
+                else:
+                    controller.inactive_backoff.reset()
+                    next_deadline = deadline + controller.sampling_time
+                if next_deadline < time.monotonic():
+                    next_deadline = time.monotonic() + controller.sampling_time
+                heapq.heapreplace(schedule, (next_deadline, i))
+        # hand over to standby instances, see Controller4Fiware.check_leadership()
+        for controller in self.controllers:
+            controller.release_lease()
+
+    def stop(self):
+        """
+        Stop the scheduler, the running control steps are completed
+        """
+        self._stop.set()
+
+    def _beat(self):
+        if self.heartbeat is not None:
+            self.heartbeat()
+
+    @staticmethod
+    def _step(controller: Controller4Fiware):
+        """
+        Execute one control step. Errors are logged, so that one failing controller does not stop the others.
+        """
+        try:
+            controller.control_step()
+        except Exception as ex:
+            logging.error(f"Control step of {controller.controller_entity.id} failed: {ex}")
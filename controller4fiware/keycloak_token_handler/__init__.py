@@ -1,2 +1,3 @@
 from .keycloak_python import KeycloakPython
 from .keycloak_python import KeycloakPythonException
+from .token_manager import TokenManager
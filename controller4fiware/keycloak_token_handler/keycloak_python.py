@@ -1,19 +1,22 @@
 import requests
 import os
 from dotenv import load_dotenv
+from controller4fiware.connection_pool import create_session
 from datetime import datetime,timedelta,timezone
 
 class KeycloakPython:
-    def __init__(self, keycloak_host=None, client_id=None, client_secret=None):
+    def __init__(self, keycloak_host=None, client_id=None, client_secret=None, session=None):
         """
         - Initialze the Keycloak Host , Client ID and Client secret.
         - If no parameters are passed .env file is used
         - Priority : function parameters > Class Instatiation > .env file
+        - The token requests reuse the connections of the session
         """
         load_dotenv()
         self.keycloak_host = os.getenv('KEYCLOAK_HOST') if keycloak_host == None else keycloak_host
         self.client_id = os.getenv('CLIENT_ID') if client_id == None else client_id
         self.client_secret = os.getenv('CLIENT_SECRET') if client_secret ==None else client_secret
+        self.session = session if session is not None else create_session()
         self.access_token = None
         self.expires_in = None
 
@@ -32,7 +35,7 @@ class KeycloakPython:
         try:
             if self.keycloak_host and self.client_id and self.client_secret:
                 headers = {"content-type": "application/x-www-form-urlencoded"}
-                access_data = requests.post(self.keycloak_host, data=self.data, headers=headers, verify=False)
+                access_data = self.session.post(self.keycloak_host, data=self.data, headers=headers, verify=False)
                 if access_data.ok:
                     current_time = datetime.now(timezone.utc)
                     self.expires_in = current_time + timedelta(seconds=int(access_data.json()['expires_in']))
@@ -0,0 +1,270 @@
+"""
+Background refresh of the Keycloak token, shared by all controllers of a process and optionally
+by several processes through a token cache.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from .keycloak_python import KeycloakPython, KeycloakPythonException
+
+Token = Tuple[Optional[str], Optional[datetime]]
+
+
+def _dump_token(token: Token) -> str:
+    return json.dumps({"access_token": token[0], "expires_in": token[1].isoformat()})
+
+
+def _load_token(data: str) -> Token:
+    token = json.loads(data)
+    return token["access_token"], datetime.fromisoformat(token["expires_in"])
+
+
+class FileTokenCache:
+    """
+    Token cache in a file, e.g. on a volume shared by several containers. The file is locked
+    while a process refreshes the token, so that only one process requests Keycloak.
+
+    Args:
+        path: path of the cache file
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock_file = None
+
+    def load(self) -> Token:
+        try:
+            with open(self.path, "r") as f:
+                return _load_token(f.read())
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def store(self, token: Token):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(_dump_token(token))
+        os.replace(tmp_path, self.path)
+
+    def acquire(self):
+        import fcntl
+        self._lock_file = open(f"{self.path}.lock", "w")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+
+    def release(self):
+        import fcntl
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._lock_file.close()
+        self._lock_file = None
+
+
+class UnixSocketTokenCache:
+    """
+    Token cache served on a Unix socket. The first process that stores a token serves it to the
+    other processes, which read the token from the socket. If the serving process stops, the next
+    process that stores a token takes over the socket.
+
+    Args:
+        path: path of the Unix socket
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.token: Token = (None, None)
+        self.server = None
+
+    def load(self) -> Token:
+        if self.server is not None:
+            return self.token
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.settimeout(1)
+                client.connect(self.path)
+                data = b"".join(iter(lambda: client.recv(4096), b""))
+            return _load_token(data.decode("utf-8"))
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def store(self, token: Token):
+        self.token = token
+        if self.server is None:
+            self._serve()
+
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+    def _serve(self):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            server.bind(self.path)
+        except OSError:
+            # the socket exists, take it over if nobody is listening
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(self.path)
+                server.close()
+                return
+            except OSError:
+                os.unlink(self.path)
+                server.bind(self.path)
+        server.listen()
+        self.server = server
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        logging.info(f"Token is served on {self.path}")
+
+    def _accept_loop(self):
+        while True:
+            connection, _ = self.server.accept()
+            with connection:
+                try:
+                    connection.sendall(_dump_token(self.token).encode("utf-8"))
+                except OSError:
+                    pass
+
+
+def create_token_cache(location: str = None):
+    """
+    Create the token cache given by a location, e.g. TOKEN_CACHE=/tokens/token.json for a file or
+    TOKEN_CACHE=unix:/tokens/token.sock for a Unix socket. No cache is used if not given.
+    """
+    if not location:
+        return None
+    if location.startswith("unix:"):
+        return UnixSocketTokenCache(path=location[len("unix:"):])
+    return FileTokenCache(path=location)
+
+
+class TokenManager:
+    """
+    TokenManager keeps a valid Keycloak token for all controllers of a process. The token is
+    refreshed by a background thread ahead of its expiry, so that the control cycles only read the
+    current token and never wait for Keycloak. The Keycloak client reuses one pooled session.
+
+    Before requesting Keycloak, the token cache (if any) is checked, so that several processes
+    share one token as well.
+
+    Args:
+        kcp: the Keycloak client, created from the environment variables if not given
+        min_valid_time: the token is refreshed when it is valid for less than this time in seconds
+        cache: optional token cache shared by several processes, see create_token_cache()
+        retry_interval: waiting time in seconds before a failed refresh is repeated
+    """
+    _shared: Dict[tuple, "TokenManager"] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 kcp: KeycloakPython = None,
+                 min_valid_time: float = 60,
+                 cache=None,
+                 retry_interval: float = 5):
+        self.kcp = kcp if kcp is not None else KeycloakPython()
+        self.min_valid_time = min_valid_time
+        self.cache = cache
+        self.retry_interval = retry_interval
+        self._token: Token = (None, None)
+        self._lifetime = None
+        self._lock = threading.Lock()  # guards the current token, never held during requests
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def shared(cls, kcp: KeycloakPython = None) -> "TokenManager":
+        """
+        Return the started token manager of the process for the client of kcp. The settings are
+        read from the environment variables TOKEN_MIN_VALID_TIME and TOKEN_CACHE.
+
+        Args:
+            kcp: the Keycloak client, created from the environment variables if not given
+        """
+        kcp = kcp if kcp is not None else KeycloakPython()
+        key = (kcp.keycloak_host, kcp.client_id)
+        with cls._shared_lock:
+            if key not in cls._shared:
+                manager = cls(kcp=kcp,
+                              min_valid_time=float(os.getenv("TOKEN_MIN_VALID_TIME", 60)),
+                              cache=create_token_cache(os.getenv("TOKEN_CACHE")))
+                manager.start()
+                cls._shared[key] = manager
+            return cls._shared[key]
+
+    @property
+    def token(self) -> Token:
+        """
+        The current token (access token, expiry time). The token is only fetched synchronously if
+        it has already expired, e.g. because Keycloak was not reachable for a long time.
+        """
+        with self._lock:
+            token = self._token
+        if not all(token) or token[1] <= datetime.now(timezone.utc):
+            token = self.refresh()
+        return token
+
+    def start(self):
+        """
+        Fetch the first token and start the background refresh
+        """
+        if self._thread is not None:
+            return
+        self.refresh()
+        self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _is_fresh(self, token: Token) -> bool:
+        return all(token) and token[1] - datetime.now(timezone.utc) > timedelta(seconds=self._margin())
+
+    def _margin(self) -> float:
+        # refresh short-living tokens in the middle of their lifetime at the latest
+        if self._lifetime:
+            return min(self.min_valid_time, self._lifetime / 2)
+        return self.min_valid_time
+
+    def refresh(self) -> Token:
+        """
+        Get a fresh token from the cache or, if there is none, from Keycloak
+        """
+        with self._refresh_lock:
+            with self._lock:
+                if self._is_fresh(self._token):
+                    return self._token
+            if self.cache is not None:
+                self.cache.acquire()
+            try:
+                token = self.cache.load() if self.cache is not None else (None, None)
+                if not self._is_fresh(token):
+                    token = self.kcp.get_access_token()
+                    if not all(token):
+                        raise KeycloakPythonException("No token received, check KEYCLOAK_HOST, "
+                                                      "CLIENT_ID and CLIENT_SECRET")
+                    if self.cache is not None:
+                        self.cache.store(token)
+                    logging.debug("Token refreshed")
+            finally:
+                if self.cache is not None:
+                    self.cache.release()
+            with self._lock:
+                self._lifetime = (token[1] - datetime.now(timezone.utc)).total_seconds()
+                self._token = token
+                # keep the client consistent for code that reads the token from it
+                self.kcp.access_token, self.kcp.expires_in = token
+            return token
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            with self._lock:
+                expires = self._token[1]
+            delay = (expires - datetime.now(timezone.utc)).total_seconds() - self._margin()
+            if self._stop.wait(timeout=max(0.0, delay)):
+                break
+            try:
+                self.refresh()
+            except Exception as err:
+                logging.error(f"Token refresh failed, retry in {self.retry_interval} s: {err}")
+                self._stop.wait(timeout=self.retry_interval)
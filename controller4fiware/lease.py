@@ -0,0 +1,198 @@
+"""
+Lease of a controller entity for the leader election of redundant controller instances.
+"""
+import json
+import logging
+import os
+import socket
+import time
+from typing import Callable, Optional, Tuple
+import requests
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.base import AttrsFormat
+from filip.models.ngsi_v2.context import ContextEntity, NamedContextAttribute
+
+LEASE_HOLDER = "leaseHolder"
+LEASE_EXPIRES = "leaseExpires"
+
+
+def default_holder() -> str:
+    """
+    Identity of this controller instance, LEASE_HOLDER or host name and process id
+    """
+    return os.getenv("LEASE_HOLDER") or f"{socket.gethostname()}:{os.getpid()}"
+
+
+class OrionLeaseStore:
+    """
+    Stores the lease in the attributes leaseHolder and leaseExpires of the controller entity. NGSI-v2
+    has no conditional updates, so an acquisition is written and read back after a settle time, and
+    only the instance whose write has survived holds the lease.
+
+    Args:
+        client: the client of the context broker
+        entity: the controller entity
+        settle_time: time in seconds between writing and reading back an acquisition
+    """
+    def __init__(self, client: ContextBrokerClient, entity: ContextEntity, settle_time: float = 0.5):
+        self.client = client
+        self.entity_id = entity.id
+        self.entity_type = entity.type
+        self.settle_time = settle_time
+
+    def read(self) -> Tuple[Optional[str], float]:
+        """
+        Read the lease
+
+        Returns:
+            the holder (None if the lease has never been acquired) and the expiration time
+        """
+        values = self.client.get_entity(entity_id=self.entity_id, entity_type=self.entity_type,
+                                        attrs=[LEASE_HOLDER, LEASE_EXPIRES],
+                                        response_format=AttrsFormat.KEY_VALUES).model_dump()
+        return values.get(LEASE_HOLDER) or None, float(values.get(LEASE_EXPIRES) or 0)
+
+    def write(self, holder: str, expires: float):
+        self.client.update_or_append_entity_attributes(
+            entity_id=self.entity_id, entity_type=self.entity_type,
+            attrs=[NamedContextAttribute(name=LEASE_HOLDER, type="Text", value=holder),
+                   NamedContextAttribute(name=LEASE_EXPIRES, type="Number", value=expires)])
+
+    def acquire(self, holder: str, expires: float, now: float) -> bool:
+        """
+        Acquire or renew the lease, if it is free, expired or already held by the holder
+
+        Returns:
+            whether the holder holds the lease
+        """
+        current, current_expires = self.read()
+        if current not in (None, holder) and current_expires > now:
+            return False
+        self.write(holder, expires)
+        if current == holder:
+            return True
+        # another instance may have acquired the expired lease at the same time, the last write wins
+        time.sleep(self.settle_time)
+        return self.read()[0] == holder
+
+
+class FileLeaseStore:
+    """
+    Stores the lease in a local file, e.g. on a volume shared by the containers on one host. The file
+    is locked during an acquisition, so that it is atomic. Only available on POSIX systems.
+
+    Args:
+        path: path of the lease file
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def _locked(self, func: Callable):
+        import fcntl
+        with open(self.path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                lease = json.loads(content) if content else {}
+                return func(f, lease.get("holder"), float(lease.get("expires", 0)))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _write(f, holder: str, expires: float):
+        f.seek(0)
+        f.truncate()
+        json.dump({"holder": holder, "expires": expires}, f)
+        f.flush()
+
+    def read(self) -> Tuple[Optional[str], float]:
+        return self._locked(lambda f, holder, expires: (holder, expires))
+
+    def write(self, holder: str, expires: float):
+        self._locked(lambda f, *_: self._write(f, holder, expires))
+
+    def acquire(self, holder: str, expires: float, now: float) -> bool:
+        def acquire(f, current, current_expires):
+            if current not in (None, holder) and current_expires > now:
+                return False
+            self._write(f, holder, expires)
+            return True
+        return self._locked(acquire)
+
+
+class ControllerLease:
+    """
+    Leader election of controller instances with the same controller entity, e.g. during rolling
+    deployments. Only the instance which holds the lease is the leader and executes the control
+    cycle. The leader renews the lease every renew interval, i.e. it writes a new expiration time as
+    heartbeat. The other instances are in standby, and only poll the lease every poll interval. When
+    the lease is released or expires, e.g. because the leader has stopped, a standby instance takes
+    it over.
+
+    A leader which cannot renew its lease steps down when the lease expires, so that at most one
+    instance sends commands once the lease has expired. The expiration times are compared with the
+    clock of each instance, which must therefore be synchronized.
+
+    Args:
+        store: the storage of the lease, see OrionLeaseStore and FileLeaseStore
+        holder: the identity of this instance, default_holder() if not given
+        duration: time in seconds after which a lease expires without renewal
+        renew_interval: time in seconds between two renewals by the leader
+        poll_interval: time in seconds between two polls of the lease in standby
+        clock: clock returning the wall time in seconds
+    """
+    def __init__(self, store, holder: str = None, duration: float = 15, renew_interval: float = 5,
+                 poll_interval: float = 5, clock: Callable[[], float] = time.time):
+        assert renew_interval < duration, "The lease must be renewed before it expires"
+        self.store = store
+        self.holder = holder or default_holder()
+        self.duration = duration
+        self.renew_interval = renew_interval
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.leader = False
+        self.expires = 0.0  # expiration time of the lease held by this instance
+        self._checked = None  # time of the last renewal or poll
+
+    def is_leader(self) -> bool:
+        """
+        Renew the lease as leader or poll it in standby, if due, and return whether this instance
+        holds the lease
+        """
+        now = self.clock()
+        interval = self.renew_interval if self.leader else self.poll_interval
+        if self._checked is not None and now - self._checked < interval:
+            return self.leader and now < self.expires
+        self._checked = now
+        expires = now + self.duration
+        try:
+            acquired = self.store.acquire(holder=self.holder, expires=expires, now=now)
+        except requests.exceptions.RequestException as err:
+            logging.warning(f"Lease cannot be {'renewed' if self.leader else 'polled'}: {err}")
+            if self.leader and now >= self.expires:
+                logging.error(f"Lease of {self.holder} has expired, switch to standby")
+                self.leader = False
+            return self.leader
+        if acquired:
+            if not self.leader:
+                logging.info(f"{self.holder} acquired the lease and is the leader")
+            self.leader, self.expires = True, expires
+        elif self.leader:
+            logging.error(f"{self.holder} lost the lease to another instance, switch to standby")
+            self.leader = False
+        return self.leader
+
+    def release(self):
+        """
+        Release the lease, so that a standby instance takes over at its next poll
+        """
+        if not self.leader:
+            return
+        self.leader = False
+        try:
+            if self.store.read()[0] == self.holder:
+                self.store.write("", 0)
+            logging.info(f"{self.holder} released the lease")
+        except requests.exceptions.RequestException as err:
+            logging.warning(f"Lease cannot be released: {err}")
@@ -0,0 +1,194 @@
+"""
+Timing instrumentation of the control cycle and a Prometheus-style metrics endpoint.
+"""
+import bisect
+import collections
+import functools
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASES = ("token", "input", "external", "parameter", "algorithm", "output", "command", "sleep")
+
+
+class Histogram:
+    """
+    Histogram with fixed buckets in the style of Prometheus
+
+    Args:
+        buckets: the upper bounds of the buckets
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative_counts(self) -> List[int]:
+        """
+        The number of observations less or equal to each bucket bound, including +Inf
+        """
+        counts, total = [], 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+
+class ControllerMetrics:
+    """
+    Metrics of one controller: the duration of each phase of the control cycle and counters
+    of HTTP requests, errors, overruns and inactive cycles.
+
+    Args:
+        controller_id: id of the controller entity, used as label
+        sample_size: number of the latest durations kept per phase for exact percentiles,
+            e.g. in benchmarks. No durations are kept if 0.
+    """
+    def __init__(self, controller_id: str, sample_size: int = 0):
+        self.controller_id = controller_id
+        self.sample_size = sample_size
+        self.samples: Dict[str, collections.deque] = {}
+        self.phases: Dict[str, Histogram] = {phase: Histogram() for phase in PHASES}
+        self.counters: Dict[str, int] = {"http_requests": 0, "http_errors": 0,
+                                         "overruns": 0, "inactive_cycles": 0,
+                                         "suppressed_commands": 0, "standby_cycles": 0}
+        self._lock = threading.Lock()
+
+    def observe(self, phase: str, duration: float):
+        """
+        Record the duration of a phase in seconds
+        """
+        with self._lock:
+            self.phases.setdefault(phase, Histogram()).observe(duration)
+            if self.sample_size:
+                if phase not in self.samples or self.samples[phase].maxlen != self.sample_size:
+                    self.samples[phase] = collections.deque(self.samples.get(phase, ()), maxlen=self.sample_size)
+                self.samples[phase].append(duration)
+
+    def inc(self, counter: str, value: int = 1):
+        """
+        Increase a counter
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def count_response(self, response, *args, **kwargs):
+        """
+        Response hook of requests.Session that counts the HTTP requests and error responses
+        """
+        self.inc("http_requests")
+        if response.status_code >= 400:
+            self.inc("http_errors")
+
+    def histogram_lines(self) -> List[str]:
+        """
+        The samples of the phase durations in the Prometheus text format
+        """
+        label = f'controller="{self.controller_id}"'
+        lines = []
+        with self._lock:
+            for phase, histogram in self.phases.items():
+                bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.cumulative_counts()):
+                    lines.append(f'controller_phase_seconds_bucket{{{label},phase="{phase}",le="{bound}"}} {count}')
+                lines.append(f'controller_phase_seconds_sum{{{label},phase="{phase}"}} {histogram.sum}')
+                lines.append(f'controller_phase_seconds_count{{{label},phase="{phase}"}} {histogram.count}')
+        return lines
+
+    def counter_line(self, counter: str) -> str:
+        """
+        The sample of a counter in the Prometheus text format
+        """
+        with self._lock:
+            value = self.counters.get(counter, 0)
+        return f'controller_{counter}_total{{controller="{self.controller_id}"}} {value}'
+
+
+def timed(phase: str):
+    """
+    Decorator for the methods of Controller4Fiware that records the duration of the method
+    as the given phase in the metrics of the controller.
+
+    Args:
+        phase: name of the phase, e.g. "input"
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.metrics.observe(phase, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class MetricsServer:
+    """
+    Lightweight HTTP server in a background thread that exposes the metrics of one or several
+    controllers under /metrics.
+
+    Args:
+        metrics: the metrics of the controllers
+        port: the port the server listens on
+        host: the interface the server binds to
+    """
+    def __init__(self, metrics: List[ControllerMetrics], port: int = 9100, host: str = "0.0.0.0"):
+        self.metrics = metrics
+        server = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.export().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def export(self) -> str:
+        """
+        Export the metrics of all controllers in the Prometheus text format
+        """
+        lines = ["# TYPE controller_phase_seconds histogram"]
+        for metrics in self.metrics:
+            lines += metrics.histogram_lines()
+        counters = sorted({counter for metrics in self.metrics for counter in metrics.counters})
+        for counter in counters:
+            lines.append(f"# TYPE controller_{counter}_total counter")
+            lines += [metrics.counter_line(counter) for metrics in self.metrics]
+        return "\n".join(lines) + "\n"
+
+    def start(self):
+        self.thread.start()
+        logging.info(f"Metrics are exposed on port {self.port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,66 @@
+"""
+Receiver of NGSI-v2 notifications for the event-driven control mode.
+"""
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from filip.models.ngsi_v2.subscriptions import Message
+
+
+class NotificationReceiver:
+    """
+    A small embedded HTTP server that receives the notifications sent by the Orion context broker.
+    The server runs in a background thread and puts every received notification message into a queue,
+    so that the control cycle can consume the notifications in its own thread.
+
+    Args:
+        host: the interface the server binds to
+        port: the port the server listens on, 0 for an arbitrary free port
+    """
+    def __init__(self, host: str = "0.0.0.0", port: int = 8081):
+        self.messages = queue.Queue()
+        messages = self.messages
+
+        class NotificationHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    message = Message.model_validate(json.loads(self.rfile.read(length)))
+                except ValueError as err:
+                    logging.warning(f"Invalid notification received: {err}")
+                    self.send_response(400)
+                else:
+                    messages.put(message)
+                    self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        self.server = ThreadingHTTPServer((host, port), NotificationHandler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        """
+        The port the server actually listens on
+        """
+        return self.server.server_address[1]
+
+    def start(self):
+        """
+        Start serving in the background thread
+        """
+        self.thread.start()
+        logging.info(f"Notification receiver listens on port {self.port}")
+
+    def stop(self):
+        """
+        Shut down the server and close the socket
+        """
+        self.server.shutdown()
+        self.server.server_close()
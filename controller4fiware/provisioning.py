@@ -0,0 +1,115 @@
+"""
+Provisioning of the controller entities in the context broker at startup.
+"""
+import hashlib
+import json
+import logging
+from typing import List
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.base import EntityPattern
+from filip.models.ngsi_v2.context import ContextEntity, Query, ActionType
+from controller4fiware.config import ConfigCache
+
+
+def schema_mismatches(expected: ContextEntity, existing: ContextEntity) -> List[str]:
+    """
+    Compare the attribute schema of an existing entity with the expected one. Every expected
+    attribute must exist with the same attribute type, extra attributes are allowed.
+
+    Returns:
+        the differences, empty if the schema matches
+    """
+    existing_types = {_attr.name: _attr.type for _attr in existing.get_attributes()}
+    mismatches = []
+    for _attr in expected.get_attributes():
+        if _attr.name not in existing_types:
+            mismatches.append(f"attribute {_attr.name} is missing")
+        elif existing_types[_attr.name] != _attr.type:
+            mismatches.append(f"attribute {_attr.name} has type {existing_types[_attr.name]} "
+                              f"instead of {_attr.type}")
+    return mismatches
+
+
+class EntityProvisioner:
+    """
+    Creates missing entities with one batch query and one batch upsert, independent of the number of
+    entities. Existing entities are kept with their current values, but their attribute schema is
+    checked. Provisioning is idempotent, and its result is cached per entity (see ConfigCache), so
+    that a restart with unchanged entities and platform skips it entirely.
+
+    Args:
+        client: the client of the context broker
+        cache: the cache of the provisioning results, ConfigCache() if not given
+    """
+    def __init__(self, client: ContextBrokerClient, cache: ConfigCache = None):
+        self.client = client
+        self.cache = cache if cache is not None else ConfigCache()
+
+    def digest(self, entity: ContextEntity) -> str:
+        """
+        Digest of the schema of an entity and the context broker, under which its provisioning is
+        cached. The values are not covered, since they change at runtime and existing entities keep
+        their values anyway.
+        """
+        header = self.client.headers
+        content = json.dumps({"url": self.client.base_url,
+                              "service": header.get("fiware-service"),
+                              "service_path": header.get("fiware-servicepath"),
+                              "id": entity.id,
+                              "type": entity.type,
+                              "attrs": {_attr.name: _attr.type for _attr in entity.get_attributes()}},
+                             sort_keys=True)
+        return hashlib.sha256(f"provisioning|{content}".encode()).hexdigest()
+
+    def provision(self, entities: List[ContextEntity]) -> List[ContextEntity]:
+        """
+        Create the missing entities and check the schema of the existing ones
+
+        Args:
+            entities: the entities with their initial values
+
+        Returns:
+            the created entities, empty if the provisioning was cached or all entities existed
+
+        Raises:
+            NameError: if an existing entity has a different attribute schema
+        """
+        digests = {entity.id: self.digest(entity) for entity in entities}
+        entities = [entity for entity in entities if not self.cache.contains(digests[entity.id])]
+        if not entities:
+            logging.debug("Entities are already provisioned")
+            return []
+        query = Query(entities=[EntityPattern(id=entity.id, type=entity.type) for entity in entities])
+        existing = {(entity.id, entity.type): entity for entity in self.client.query(query=query)}
+
+        missing = []
+        for entity in entities:
+            existing_entity = existing.get((entity.id, entity.type))
+            if existing_entity is None:
+                missing.append(entity)
+                continue
+            logging.warning(f"Controller entity_id {entity.id} is already assigned")
+            mismatches = schema_mismatches(expected=entity, existing=existing_entity)
+            if mismatches:
+                msg = f'The existing entity {entity.id} has a different structure ({", ".join(mismatches)}). ' \
+                      f'Please delete it or change the id'
+                logging.error(msg)
+                raise NameError(msg)
+            logging.info(f"The existing entity {entity.id} contains all expected attributes")
+
+        if missing:
+            logging.info(f"Create new entities {[entity.id for entity in missing]}")
+            # append creates the entities, and an entity created concurrently by another instance
+            # does not let the request fail
+            self.client.update(entities=missing, action_type=ActionType.APPEND)
+        for entity in entities:
+            self.cache.store(digests[entity.id], entity.id)
+        return missing
+
+    def invalidate(self, entities: List[ContextEntity]):
+        """
+        Forget the provisioning of the entities, e.g. after they have been deleted in the context
+        broker, so that they are created again at the next start
+        """
+        for entity in entities:
+            self.cache.remove(self.digest(entity))
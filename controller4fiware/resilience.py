@@ -0,0 +1,202 @@
+"""
+Retry, circuit breaker and back-off for the I/O of the controllers.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Union
+import requests
+
+
+def is_transient(err: Exception) -> bool:
+    """
+    Check whether an error of a request is transient, i.e. a connection error, a timeout or a server
+    error (5xx), so that the request may succeed if it is repeated.
+
+    Args:
+        err: the raised error
+    """
+    if isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return isinstance(err, requests.exceptions.HTTPError) and err.response is not None \
+        and err.response.status_code >= 500
+
+
+class RetryPolicy:
+    """
+    Repeat a function call on transient errors with exponentially increasing waiting time.
+
+    Args:
+        retries: maximal number of retries
+        backoff_factor: waiting time before the first retry in seconds, doubled for every further retry
+    """
+    def __init__(self, retries: int = 2, backoff_factor: float = 0.1):
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+    def call(self, func, *args, abort: Callable[[], bool] = None, **kwargs):
+        """
+        Call the function and retry it on transient errors. Other errors are raised immediately.
+
+        Args:
+            func: the function
+            abort: function that returns True if the retries should be given up, e.g. because the
+                circuit of the endpoint has been opened in the meantime
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except requests.exceptions.RequestException as err:
+                if attempt == self.retries or not is_transient(err) or (abort is not None and abort()):
+                    raise
+                delay = self.backoff_factor * 2 ** attempt
+                logging.warning(f"Request failed ({err}), retry in {delay} s")
+                time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one endpoint, e.g. the Orion context broker. After `failure_threshold`
+    consecutive failures, the circuit opens and no further requests are allowed. After `reset_timeout`,
+    one trial request is allowed (half-open). The circuit closes again if the trial succeeds.
+
+    Args:
+        failure_threshold: number of consecutive failures that opens the circuit
+        reset_timeout: time in seconds after which a trial request is allowed
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """
+        Check whether a request is allowed in the current state
+        """
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return self.state == self.CLOSED
+
+    def record_success(self):
+        """
+        Close the circuit after a successful request
+        """
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """
+        Count a failed request and open the circuit if the threshold is reached
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.error(f"Circuit opened after {self.failures} failures")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+_shared_breakers: Dict[str, CircuitBreaker] = {}
+_shared_breakers_lock = threading.Lock()
+
+
+def shared_circuit_breaker(url: str) -> CircuitBreaker:
+    """
+    The circuit breaker of an endpoint, which is shared by all controllers of the process, e.g. in a
+    ControllerHost, so that an outage of the endpoint opens the circuit of all controllers after
+    CIRCUIT_FAILURE_THRESHOLD failures in total instead of per controller
+
+    Args:
+        url: the url of the endpoint, e.g. the url of the Orion context broker
+    """
+    url = url.rstrip("/")
+    with _shared_breakers_lock:
+        if url not in _shared_breakers:
+            _shared_breakers[url] = CircuitBreaker(
+                failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5)),
+                reset_timeout=float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30)))
+        return _shared_breakers[url]
+
+
+class Backoff:
+    """
+    Exponentially increasing delays, e.g. for polling an inactive controller.
+
+    Args:
+        initial: the first delay in seconds
+        maximum: the maximal delay in seconds
+        factor: the factor by which the delay increases
+    """
+    def __init__(self, initial: float, maximum: float = 60, factor: float = 2):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.delay = None
+
+    def next_delay(self) -> float:
+        """
+        Return the next delay
+        """
+        self.delay = self.initial if self.delay is None else min(self.delay * self.factor, self.maximum)
+        return self.delay
+
+    def reset(self):
+        """
+        Start again with the initial delay
+        """
+        self.delay = None
+
+
+def resilient(endpoint: Union[str, Callable[[object], str]]):
+    """
+    Decorator for the I/O methods of Controller4Fiware. The decorated method is retried on transient
+    errors according to the retry policy of the controller. If it still fails, or if the circuit breaker
+    of the endpoint is open, the controller is deactivated for the current cycle instead of raising
+    the error, and the decorated method returns None. Other errors are raised as before, and open the
+    circuit again if they are raised by the trial request of a half-open circuit.
+
+    Args:
+        endpoint: name of the endpoint, which selects the circuit breaker of the controller, or a function
+            that returns the name for the controller, e.g. depending on its transport
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            name = endpoint(self) if callable(endpoint) else endpoint
+            breaker = self.circuit_breakers[name]
+            if not breaker.allow_request():
+                self.active = False
+                logging.debug(f"Circuit of {name} is open, {method.__name__} is skipped")
+                return None
+            trial = breaker.state == CircuitBreaker.HALF_OPEN
+            try:
+                # give up the retries if another controller has opened the shared circuit meanwhile
+                result = self.retry_policy.call(method, self, *args,
+                                                abort=lambda: breaker.state == CircuitBreaker.OPEN, **kwargs)
+            except Exception as err:
+                if not isinstance(err, requests.exceptions.RequestException) or not is_transient(err):
+                    if trial:
+                        # open the circuit again, otherwise no further trial request would be allowed
+                        breaker.record_failure()
+                    raise
+                breaker.record_failure()
+                self.active = False
+                logging.error(f"{method.__name__} failed: {err}")
+                return None
+            breaker.record_success()
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,96 @@
+"""
+Preallocated ring buffer of time-stamped samples based on NumPy.
+"""
+from typing import Tuple
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Ring buffer with a fixed capacity, which keeps the latest samples and their time stamps.
+    Every sample is written twice, at its position and one capacity later, so that the samples
+    in chronological order are always a contiguous slice of the storage. Reading the buffer
+    therefore returns views without copying.
+
+    Args:
+        capacity: maximal number of samples
+        shape: shape of a single sample, e.g. () for scalars
+        dtype: data type of the samples
+    """
+    def __init__(self, capacity: int, shape: Tuple[int, ...] = (), dtype=np.float64):
+        assert capacity > 0, "The capacity of the ring buffer must be positive"
+        self.capacity = capacity
+        self._times = np.full(2 * capacity, np.nan)
+        self._values = np.full((2 * capacity,) + tuple(shape), np.nan, dtype=dtype)
+        self._end = 0  # position of the next sample
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, time: float, value):
+        """
+        Append one sample
+        """
+        self._times[self._end] = self._times[self._end + self.capacity] = time
+        self._values[self._end] = self._values[self._end + self.capacity] = value
+        self._end = (self._end + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def extend(self, times, values):
+        """
+        Append several samples in chronological order. Only the last samples are kept if there
+        are more samples than the capacity.
+        """
+        times = np.asarray(times, dtype=np.float64)[-self.capacity:]
+        values = np.asarray(values, dtype=self._values.dtype)[-self.capacity:]
+        if not len(times):
+            return
+        positions = (self._end + np.arange(len(times))) % self.capacity
+        self._times[positions] = self._times[positions + self.capacity] = times
+        self._values[positions] = self._values[positions + self.capacity] = values
+        self._end = (self._end + len(times)) % self.capacity
+        self.size = min(self.size + len(times), self.capacity)
+
+    def clear(self):
+        self._end = 0
+        self.size = 0
+
+    def _window(self) -> slice:
+        start = (self._end - self.size) % self.capacity
+        return slice(start, start + self.size)
+
+    @property
+    def times(self) -> np.ndarray:
+        """
+        The time stamps in chronological order (read-only view)
+        """
+        view = self._times[self._window()]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        The samples in chronological order (read-only view)
+        """
+        view = self._values[self._window()]
+        view.flags.writeable = False
+        return view
+
+    @property
+    def last_time(self) -> float:
+        """
+        The time stamp of the latest sample, None if the buffer is empty
+        """
+        if not self.size:
+            return None
+        return float(self._times[(self._end - 1) % self.capacity])
+
+    def since(self, time: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The time stamps and samples from the given time on (views)
+        """
+        times = self.times
+        start = int(np.searchsorted(times, time, side="left"))
+        return times[start:], self.values[start:]
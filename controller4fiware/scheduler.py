@@ -0,0 +1,141 @@
+"""
+Fixed-rate scheduler for the control cycles.
+"""
+import time
+from typing import Callable, List
+
+
+class CycleScheduler:
+    """
+    CycleScheduler holds the sampling time of a control loop with fixed-rate deadlines on a monotonic
+    clock, so that neither the jitter of single cycles nor jumps of the wall clock accumulate as drift.
+    Between two cycles, the scheduler sleeps once until the next deadline.
+
+    If a cycle takes longer than the sampling time (overrun), the overrun policy decides when the next
+    cycle starts:
+      - "skip": the missed deadlines are skipped, the next cycle starts at the next deadline
+      - "catch_up": the missed cycles are executed immediately one after another
+      - "immediate": the next cycle starts immediately and the deadlines are shifted
+
+    Args:
+        period: the sampling time in seconds
+        overrun_policy: one of "skip", "catch_up", "immediate"
+        clock: monotonic clock returning seconds
+        sleep: function to sleep for the given seconds
+    """
+    SKIP = "skip"
+    CATCH_UP = "catch_up"
+    IMMEDIATE = "immediate"
+
+    def __init__(self,
+                 period: float,
+                 overrun_policy: str = SKIP,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep):
+        assert overrun_policy in (self.SKIP, self.CATCH_UP, self.IMMEDIATE), \
+            f"Unknown overrun policy {overrun_policy}"
+        self.period = period
+        self.overrun_policy = overrun_policy
+        self.clock = clock
+        self.sleep = sleep
+        self.deadline = None  # start time of the next cycle
+
+        # statistics
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped_cycles = 0
+        self.last_jitter = 0.0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def start(self, start_time: float = None):
+        """
+        Set the start time of the first cycle.
+
+        Args:
+            start_time: start time on the clock of the scheduler, now if not given
+        """
+        self.deadline = self.clock() if start_time is None else start_time
+
+    def next_delay(self) -> float:
+        """
+        Advance to the deadline of the next cycle and return the time to wait for it. The overrun
+        counter is increased, if the deadline has already passed.
+
+        Returns:
+            the time in seconds until the next cycle starts
+        """
+        if self.deadline is None:
+            self.start()
+        now = self.clock()
+        self.deadline += self.period
+        self.cycles += 1
+        if now <= self.deadline:
+            return self.deadline - now
+        self.overruns += 1
+        if self.overrun_policy == self.SKIP:
+            missed = int((now - self.deadline) // self.period) + 1
+            self.skipped_cycles += missed
+            self.deadline += missed * self.period
+            return self.deadline - now
+        if self.overrun_policy == self.IMMEDIATE:
+            self.deadline = now
+        return 0.0
+
+    def mark_wakeup(self):
+        """
+        Record the jitter between the deadline and the actual start of the cycle
+        """
+        jitter = max(0.0, self.clock() - self.deadline)
+        self.last_jitter = jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+        self.total_jitter += jitter
+
+    def wait(self) -> bool:
+        """
+        Sleep until the next cycle starts.
+
+        Returns:
+            True if the last cycle overran its sampling time
+        """
+        overruns = self.overruns
+        delay = self.next_delay()
+        if delay > 0:
+            self.sleep(delay)
+        self.mark_wakeup()
+        return self.overruns > overruns
+
+    @property
+    def mean_jitter(self) -> float:
+        """
+        The mean jitter of all cycles in seconds
+        """
+        return self.total_jitter / self.cycles if self.cycles else 0.0
+
+
+class VirtualClock:
+    """
+    Clock for simulations, which advances only when sleeping. It replaces the clock and the sleep
+    function of a CycleScheduler and the clock of the pid instances, so that the control cycles run
+    as fast as possible, but with the timing of real time. Every advance of the clock is passed to the
+    listeners, e.g. to step a simulation model to the new time.
+
+    Args:
+        start: the initial time in seconds
+    """
+    def __init__(self, start: float = 0.0):
+        self.now = float(start)
+        self.listeners: List[Callable[[float], None]] = []
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        """
+        Advance the clock by the given seconds and notify the listeners
+        """
+        if seconds <= 0:
+            return
+        self.now += seconds
+        for listener in self.listeners:
+            listener(self.now)
@@ -0,0 +1,179 @@
+"""
+External inputs of the controllers from the time-series database QuantumLeap, e.g. the history of
+a measurement or a weather forecast. The data are cached locally and fetched incrementally.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from typing import List, Tuple
+import numpy as np
+import requests
+from filip.clients.ngsi_v2 import QuantumLeapClient
+from controller4fiware.ring_buffer import RingBuffer
+
+
+def to_timestamp(date: datetime) -> float:
+    """
+    Convert a date of QuantumLeap to seconds since epoch, dates without time zone are in UTC
+    """
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def to_iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat(timespec="milliseconds")
+
+
+class QuantumLeapInput:
+    """
+    Base class of the external inputs from QuantumLeap
+
+    Args:
+        name: name under which the input is available in the controller
+        entity_id: id of the entity
+        entity_type: type of the entity
+        attr_name: name of the attribute
+        refresh_time: fetch new data at most once per refresh time in seconds, 0 means in every cycle
+    """
+    def __init__(self, name: str, entity_id: str, entity_type: str, attr_name: str, refresh_time: float = 0):
+        self.name = name
+        self.entity_id = entity_id
+        self.entity_type = entity_type
+        self.attr_name = attr_name
+        self.refresh_time = refresh_time
+        self.config = None  # the configuration in external_input.json, see create_external_input()
+        self._fetch_time = None
+
+    def _query(self, client: QuantumLeapClient, from_time: float, last_n: int) -> Tuple[List[float], list]:
+        """
+        Query the samples from the given time on. No samples (404) is not an error.
+        """
+        try:
+            series = client.get_entity_attr_values_by_id(entity_id=self.entity_id,
+                                                         attr_name=self.attr_name,
+                                                         entity_type=self.entity_type,
+                                                         from_date=to_iso(from_time),
+                                                         last_n=last_n)
+        except requests.exceptions.HTTPError as err:
+            if err.response is not None and err.response.status_code == 404:
+                return [], []
+            raise
+        return [to_timestamp(date) for date in series.index], series.attributes[0].values
+
+    def update(self, client: QuantumLeapClient, now: float = None) -> bool:
+        """
+        Fetch the new data if the refresh time is up
+
+        Returns:
+            True if new data were fetched
+        """
+        now = time.time() if now is None else now
+        if self._fetch_time is not None and now - self._fetch_time < self.refresh_time:
+            return False
+        fetched = self.fetch(client, now)
+        # only after a successful fetch, so that a failed fetch is retried in the next cycle
+        self._fetch_time = now
+        return fetched
+
+    def fetch(self, client: QuantumLeapClient, now: float) -> bool:
+        raise NotImplementedError
+
+
+class HistoryInput(QuantumLeapInput):
+    """
+    Windowed history of a numeric attribute, e.g. the room temperature of the last 24 hours. The
+    samples are kept in a ring buffer, and only the samples after the latest cached one are fetched.
+
+    Args:
+        window: length of the history in seconds
+        capacity: maximal number of cached samples
+        **kwargs: arguments of QuantumLeapInput
+    """
+    def __init__(self, window: float = 24 * 3600, capacity: int = 1440, **kwargs):
+        super().__init__(**kwargs)
+        self.window = window
+        self.buffer = RingBuffer(capacity=capacity)
+        self._now = None
+
+    def fetch(self, client: QuantumLeapClient, now: float) -> bool:
+        self._now = now
+        last_time = self.buffer.last_time
+        from_time = now - self.window if last_time is None else max(last_time + 0.001, now - self.window)
+        times, values = self._query(client, from_time=from_time, last_n=self.buffer.capacity)
+        if last_time is not None:
+            # fromDate is inclusive and has a resolution of milliseconds
+            new = [i for i, t in enumerate(times) if t > last_time]
+            times, values = [times[i] for i in new], [values[i] for i in new]
+        if not times:
+            return False
+        self.buffer.extend(times, [np.nan if value is None else value for value in values])
+        logging.debug(f"{len(times)} new samples of {self.name}")
+        return True
+
+    @property
+    def times(self) -> np.ndarray:
+        """
+        The time stamps (seconds since epoch) within the window (view)
+        """
+        return self._windowed()[0]
+
+    @property
+    def values(self) -> np.ndarray:
+        """
+        The samples within the window (view)
+        """
+        return self._windowed()[1]
+
+    def _windowed(self) -> Tuple[np.ndarray, np.ndarray]:
+        now = time.time() if self._now is None else self._now
+        return self.buffer.since(now - self.window)
+
+
+class ForecastInput(QuantumLeapInput):
+    """
+    Forecast stored as array attribute, e.g. the temperature forecast of a weather station. Only
+    the latest forecast is kept, and it is only downloaded if a newer one exists.
+
+    Args:
+        **kwargs: arguments of QuantumLeapInput
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.time = None  # time stamp of the forecast
+        self.values = None  # the forecast as numpy array
+
+    def fetch(self, client: QuantumLeapClient, now: float) -> bool:
+        from_time = 0 if self.time is None else self.time + 0.001
+        times, values = self._query(client, from_time=from_time, last_n=1)
+        if not times or (self.time is not None and times[-1] <= self.time):
+            return False
+        self.time = times[-1]
+        self.values = np.asarray(values[-1], dtype=np.float64)
+        logging.debug(f"New forecast of {self.name} from {to_iso(self.time)}")
+        return True
+
+
+def create_external_input(config: dict) -> QuantumLeapInput:
+    """
+    Create an external input from its configuration in external_input.json, e.g.
+
+        {"name": "roomTemperature", "kind": "history", "id": "urn:ngsi-ld:Room:001", "type": "Room",
+         "attr": "temperature", "window": 86400, "capacity": 1440, "refreshTime": 60}
+    """
+    kwargs = dict(name=config["name"],
+                  entity_id=config["id"],
+                  entity_type=config.get("type"),
+                  attr_name=config["attr"],
+                  refresh_time=float(config.get("refreshTime", 0)))
+    kind = config.get("kind", "history")
+    if kind == "history":
+        external_input = HistoryInput(window=float(config.get("window", 24 * 3600)),
+                                      capacity=int(config.get("capacity", 1440)),
+                                      **kwargs)
+    elif kind == "forecast":
+        external_input = ForecastInput(**kwargs)
+    else:
+        raise ValueError(f"Unknown kind of external input: {kind}")
+    external_input.config = config
+    return external_input
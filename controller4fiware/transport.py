@@ -0,0 +1,263 @@
+"""
+Transports for the inputs and commands of the controllers. Besides the default way through the Orion
+context broker, the devices can be accessed directly via MQTT with the device model of the IoT Agent.
+"""
+import json
+import logging
+import threading
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urlparse
+import paho.mqtt.client as mqtt
+from filip.clients.mqtt import IoTAMQTTClient
+from filip.models.ngsi_v2.context import ContextEntity
+from filip.models.ngsi_v2.iot import Device, ServiceGroup
+from controller4fiware.value_table import ValueTable
+
+ORION = "orion"
+MQTT = "mqtt"
+HYBRID = "hybrid"
+
+
+def convert_measurement(value, attr_type: str):
+    """
+    Convert a measurement, which is received as text (e.g. with UltraLight), to the type of the device
+    attribute, like the IoT Agent does
+
+    Args:
+        value: the received value
+        attr_type: the type of the device attribute, e.g. "Number"
+
+    Raises:
+        ValueError if the value cannot be converted
+    """
+    if not isinstance(value, str):
+        return value
+    if attr_type in ("Number", "Float"):
+        return float(value)
+    if attr_type == "Integer":
+        return int(value)
+    if attr_type == "Boolean":
+        if value.lower() not in ("true", "false", "1", "0"):
+            raise ValueError(f"{value} is not a boolean")
+        return value.lower() in ("true", "1")
+    return value
+
+
+class MqttTransport:
+    """
+    Direct MQTT path between controller and devices, which bypasses the Orion context broker and the
+    IoT Agent. The measurements of the devices are subscribed and cached, and the commands are published
+    on the command topics of the devices, just like the IoT Agent does. Only the protocols IoTA-JSON and
+    UltraLight are supported.
+
+    Args:
+        devices: the device configurations as registered in the IoT Agent (e.g. devices.json)
+        service_groups: the service groups as registered in the IoT Agent (e.g. fiware_groups.json)
+        mqtt_url: url of the MQTT broker, e.g. mqtt://localhost:1883
+        username: MQTT user name
+        password: MQTT password
+    """
+    def __init__(self,
+                 devices: List[Device],
+                 service_groups: List[ServiceGroup],
+                 mqtt_url: str,
+                 username: str = None,
+                 password: str = None):
+        self.devices = {(device.entity_name, device.entity_type): device for device in devices}
+        # types of the device attributes, (device_id, object_id) -> type
+        self.attr_types: Dict[Tuple[str, str], str] = {(device.device_id, attr.object_id or attr.name): attr.type
+                                                        for device in devices for attr in device.attributes}
+        self.client = IoTAMQTTClient(protocol=mqtt.MQTTv5, devices=devices, service_groups=service_groups)
+        if username:
+            self.client.username_pw_set(username=username, password=password)
+        self.client.on_message = self._on_message
+        self.mqtt_url = urlparse(mqtt_url)
+        # latest measurements, (device_id, object_id) -> value
+        self.values: Dict[Tuple[str, str], object] = {}
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """
+        Connect to the MQTT broker, subscribe the measurements of all devices and start the network loop
+        """
+        self.client.connect(host=self.mqtt_url.hostname, port=self.mqtt_url.port or 1883, keepalive=60)
+        for device in self.devices.values():
+            self.client.subscribe(topic=f"{self._prefix(device)}/{self._apikey(device)}/{device.device_id}/attrs/#")
+            self.client.subscribe(topic=f"{self._prefix(device)}/{self._apikey(device)}/{device.device_id}/attrs")
+        self.client.loop_start()
+
+    def close(self):
+        """
+        Stop the network loop and disconnect
+        """
+        self.client.loop_stop()
+        self.client.disconnect()
+
+    def _apikey(self, device: Device) -> str:
+        """
+        The apikey of a device, which is given by the device or by its service group. Like in the IoT Agent,
+        the service group is matched by the resource of the protocol of the device and by its entity type,
+        a group with the entity type of the device is preferred over a group without entity type.
+        """
+        if device.apikey:
+            return device.apikey
+        resource = "/iot/d" if "UltraLight" in device.protocol else "/iot/json"
+        groups = [group for group in self.client.service_groups.values()
+                  if group.resource == resource and group.entity_type in (None, device.entity_type)]
+        groups.sort(key=lambda group: group.entity_type is None)
+        if not groups:
+            raise KeyError(f"No service group with resource {resource} for device {device.device_id} "
+                           f"with type {device.entity_type}")
+        return groups[0].apikey
+
+    @staticmethod
+    def _prefix(device: Device) -> str:
+        return "/ul" if "UltraLight" in device.protocol else "/json"
+
+    def _on_message(self, client, userdata, msg):
+        """
+        Cache the values of an incoming measurement
+        """
+        topic = msg.topic.strip("/").split("/")
+        device_id = topic[2]
+        payload = msg.payload.decode("utf-8")
+        try:
+            if len(topic) == 5:  # single measurement
+                values = {topic[4]: json.loads(payload) if topic[0] == "json" else payload}
+            elif topic[0] == "json":
+                values = json.loads(payload)
+            else:
+                items = payload.split("|")
+                values = dict(zip(items[::2], items[1::2]))
+            values = {object_id: convert_measurement(value, self.attr_types.get((device_id, object_id)))
+                      for object_id, value in values.items()}
+        except ValueError:
+            logging.warning(f"Invalid measurement on {msg.topic}: {payload}")
+            return
+        with self._lock:
+            for object_id, value in values.items():
+                self.values[(device_id, object_id)] = value
+
+    def _device(self, entity_id: str, entity_type: str) -> Device:
+        try:
+            return self.devices[(entity_id, entity_type)]
+        except KeyError:
+            raise KeyError(f"No device for entity {entity_id} with type {entity_type}")
+
+    @staticmethod
+    def _object_id(device: Device, attr_name: str) -> str:
+        for attr in device.attributes:
+            if attr.name == attr_name:
+                return attr.object_id or attr.name
+        return attr_name
+
+    def read_inputs(self, table: ValueTable) -> List[str]:
+        """
+        Update the values of the inputs with the latest measurements
+
+        Args:
+            table: the values of the input entities
+
+        Returns:
+            the names of the attributes, for which no measurement was received yet
+        """
+        missing = []
+        with self._lock:
+            for entity_id, entity_type, slots in table.entities:
+                device = self._device(entity_id, entity_type)
+                for slot in slots:
+                    attr_name = table.keys[slot][1]
+                    key = (device.device_id, self._object_id(device, attr_name))
+                    if key not in self.values:
+                        missing.append(f"{entity_id}.{attr_name}")
+                        continue
+                    table.values[slot] = self.values[key]
+        return missing
+
+    def send_commands(self, entities: List[ContextEntity]) -> bool:
+        """
+        Publish the commands on the command topics of the devices
+
+        Args:
+            entities: the command entities
+
+        Returns:
+            True, since the commands are sent immediately
+        """
+        for entity in entities:
+            device = self._device(entity.id, entity.type)
+            topic = f"/{self._apikey(device)}/{device.device_id}/cmd"
+            for _comm in entity.get_attributes():
+                if "UltraLight" in device.protocol:
+                    payload = f"{device.device_id}@{_comm.name}|{_comm.value}"
+                else:
+                    payload = json.dumps({_comm.name: _comm.value})
+                self.client.publish(topic=topic, payload=payload)
+        return True
+
+
+class HybridTransport(MqttTransport):
+    """
+    Hybrid transport, in which the inputs are received directly via MQTT, while the commands are sent
+    to the Orion context broker in a background thread. The control cycle does not wait for Orion, but
+    Orion still holds the complete state and forwards the commands to the devices.
+
+    Args:
+        send: function that sends a list of command entities to Orion, e.g. Controller4Fiware.update_entities
+        on_sent: function that is called with the sent commands as (entity id, attribute name, value)
+            after they have been sent successfully, e.g. to commit them to the command filter
+        **kwargs: arguments of MqttTransport
+    """
+    def __init__(self, send: Callable[[List[ContextEntity]], None],
+                 on_sent: Callable[[List[Tuple[str, str, object]]], None] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.send = send
+        self.on_sent = on_sent
+        # commands, which have not been sent yet, (entity id, entity type, attribute name) -> value
+        self._pending: Dict[Tuple[str, str, str], object] = {}
+        self._pending_lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self._send_loop, daemon=True)
+
+    def connect(self):
+        super().connect()
+        self._thread.start()
+
+    def send_commands(self, entities: List[ContextEntity]) -> bool:
+        """
+        Hand the commands over to the background thread. They are merged with the commands, which have
+        not been sent yet, so that a pending command is only replaced by a newer value of the same command.
+
+        Args:
+            entities: the command entities
+
+        Returns:
+            False, since the commands are sent later and reported to on_sent
+        """
+        with self._pending_lock:
+            for entity in entities:
+                for _comm in entity.get_attributes():
+                    self._pending[(entity.id, entity.type, _comm.name)] = _comm.value
+        self._event.set()
+        return False
+
+    def _send_loop(self):
+        while True:
+            self._event.wait()
+            self._event.clear()
+            with self._pending_lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                continue
+            commands: Dict[Tuple[str, str], dict] = {}
+            for (entity_id, entity_type, attr_name), value in pending.items():
+                commands.setdefault((entity_id, entity_type), {})[attr_name] = {"type": "command", "value": value}
+            try:
+                self.send([ContextEntity(id=entity_id, type=entity_type, **attrs)
+                           for (entity_id, entity_type), attrs in commands.items()])
+            except Exception as ex:
+                logging.error(f"Commands cannot be sent to Orion: {ex}")
+                continue
+            if self.on_sent is not None:
+                self.on_sent([(entity_id, attr_name, value)
+                              for (entity_id, _, attr_name), value in pending.items()])
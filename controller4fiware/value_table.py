@@ -0,0 +1,93 @@
+"""
+Compact table of the attribute values of entities, which is used in the control cycle instead of the
+pydantic entities.
+"""
+from typing import Dict, Iterable, List, Tuple
+from filip.models.ngsi_v2.context import ContextEntity
+
+
+class ValueTable:
+    """
+    The values of the attributes of several entities in one flat list. Each attribute has a fixed slot,
+    i.e. the index of its value, which is assigned when the table is compiled from the entities of the
+    configuration. The control cycle reads and writes plain values by slot or by entity id and attribute
+    name, e.g.
+
+        slot = controller.input_values.slot("urn:ngsi-ld:TemperatureSensor:001", "temperature")
+        temperature = controller.input_values.values[slot]
+
+    and the pydantic entities are only built at the I/O boundary, e.g. for a batch update, see
+    to_entities(). The values are neither validated nor converted, as the attributes of the entities in
+    the control cycle.
+
+    Args:
+        entities: the entities of the configuration, their values are the initial values
+    """
+    __slots__ = ("entities", "keys", "types", "values", "slots")
+
+    def __init__(self, entities: List[ContextEntity]):
+        self.entities: List[Tuple[str, str, range]] = []  # id, type and slots of each entity
+        self.keys: List[Tuple[str, str]] = []  # entity id and attribute name of each slot
+        self.types: List[str] = []  # attribute type of each slot
+        self.values: list = []
+        self.slots: Dict[Tuple[str, str], int] = {}
+        for entity in entities:
+            start = len(self.values)
+            for _attr in entity.get_attributes():
+                self.slots[(entity.id, _attr.name)] = len(self.values)
+                self.keys.append((entity.id, _attr.name))
+                self.types.append(_attr.type)
+                self.values.append(_attr.value)
+            self.entities.append((entity.id, entity.type, range(start, len(self.values))))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def slot(self, entity_id: str, attr_name: str) -> int:
+        """
+        The slot of an attribute
+
+        Raises:
+            KeyError if the attribute is not in the table
+        """
+        return self.slots[(entity_id, attr_name)]
+
+    def get(self, entity_id: str, attr_name: str):
+        return self.values[self.slots[(entity_id, attr_name)]]
+
+    def set(self, entity_id: str, attr_name: str, value):
+        self.values[self.slots[(entity_id, attr_name)]] = value
+
+    def fill(self, value):
+        """
+        Set all attributes to the same value, e.g. the control variable of a single-output controller
+        """
+        self.values[:] = [value] * len(self.values)
+
+    def copy_from(self, other: "ValueTable"):
+        """
+        Copy the values of the attributes, which exist in both tables, e.g. after a reload of the
+        configuration
+        """
+        for key, slot in self.slots.items():
+            other_slot = other.slots.get(key)
+            if other_slot is not None:
+                self.values[slot] = other.values[other_slot]
+
+    def to_entities(self, slots: Iterable[int] = None, attr_type: str = None) -> List[ContextEntity]:
+        """
+        Build the entities with the current values, e.g. for a batch update. Entities without any of the
+        selected attributes are omitted.
+
+        Args:
+            slots: the slots of the attributes, all attributes if not given
+            attr_type: the type of all attributes, e.g. "command", the configured types if not given
+        """
+        selected = None if slots is None else set(slots)
+        entities = []
+        for entity_id, entity_type, entity_slots in self.entities:
+            attrs = {self.keys[slot][1]: {"type": attr_type or self.types[slot], "value": self.values[slot]}
+                     for slot in entity_slots if selected is None or slot in selected}
+            if attrs:
+                entities.append(ContextEntity(id=entity_id, type=entity_type, **attrs))
+        return entities
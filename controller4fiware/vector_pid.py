@@ -0,0 +1,165 @@
+"""
+Vectorized PID engine, which updates many PID loops with one call.
+"""
+import time
+from typing import Callable
+import numpy as np
+
+
+class VectorPID:
+    """
+    N PID loops, whose gains, limits, setpoints and states are stored in numpy arrays. One call
+    updates all loops. The behavior of each loop is equivalent to simple_pid.PID with the same
+    settings: the integral is clamped to the output limits (anti-windup), the output is clamped,
+    the derivative is calculated on the measurement by default, and the proportional term can be
+    calculated on the measurement. Loops with a NaN measurement keep their last output.
+
+    Args:
+        n: number of loops
+        kp, ki, kd: gains, scalars or arrays of length n
+        setpoint: setpoints, scalar or array of length n
+        output_limits: (lower, upper) limits, scalars or arrays of length n, None means no limit
+        sample_time: minimal time between two updates of a loop in seconds, None means every call
+        proportional_on_measurement: whether to calculate the proportional term on the measurement
+        differential_on_measurement: whether to calculate the derivative term on the measurement
+        time_fn: the clock, time.monotonic by default
+    """
+    def __init__(self,
+                 n: int,
+                 kp=1.0, ki=0.0, kd=0.0,
+                 setpoint=0.0,
+                 output_limits=(None, None),
+                 sample_time: float = 0.01,
+                 proportional_on_measurement: bool = False,
+                 differential_on_measurement: bool = True,
+                 time_fn: Callable[[], float] = time.monotonic):
+        self.n = n
+        self.sample_time = sample_time
+        self.proportional_on_measurement = proportional_on_measurement
+        self.differential_on_measurement = differential_on_measurement
+        self.time_fn = time_fn
+        self.kp = np.zeros(n)
+        self.ki = np.zeros(n)
+        self.kd = np.zeros(n)
+        self.setpoint = np.zeros(n)
+        self.lower = np.full(n, -np.inf)
+        self.upper = np.full(n, np.inf)
+        self.reset()
+        self.tunings = (kp, ki, kd)
+        self.setpoint[:] = setpoint
+        self.output_limits = output_limits
+
+    def reset(self):
+        """
+        Reset the states of all loops, like simple_pid.PID.reset()
+        """
+        self.proportional = np.zeros(self.n)
+        self.integral = np.zeros(self.n)
+        self.derivative = np.zeros(self.n)
+        self.last_output = np.full(self.n, np.nan)  # NaN means no output yet
+        self.last_input = np.full(self.n, np.nan)
+        self.last_error = np.full(self.n, np.nan)
+        self.last_time = np.full(self.n, self.time_fn())
+
+    def select(self, indices) -> "VectorPID":
+        """
+        Create a PID engine with the given loops of this engine, e.g. after loops have been added or
+        removed. The settings and states of the selected loops are kept, so that they continue without
+        a bump, while new loops start with the default settings and a reset state.
+
+        Args:
+            indices: for each loop of the new engine, the index of the loop in this engine or -1 for a
+                new loop
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        kept = indices >= 0
+        selected = VectorPID(n=len(indices), sample_time=self.sample_time,
+                             proportional_on_measurement=self.proportional_on_measurement,
+                             differential_on_measurement=self.differential_on_measurement,
+                             time_fn=self.time_fn)
+        for name in ("kp", "ki", "kd", "setpoint", "lower", "upper", "proportional", "integral", "derivative",
+                     "last_output", "last_input", "last_error", "last_time"):
+            getattr(selected, name)[kept] = getattr(self, name)[indices[kept]]
+        return selected
+
+    @property
+    def tunings(self):
+        return self.kp, self.ki, self.kd
+
+    @tunings.setter
+    def tunings(self, tunings):
+        self.kp[:], self.ki[:], self.kd[:] = tunings
+
+    @property
+    def output_limits(self):
+        return self.lower, self.upper
+
+    @output_limits.setter
+    def output_limits(self, limits):
+        lower, upper = limits if limits is not None else (None, None)
+        lower = -np.inf if lower is None else lower
+        upper = np.inf if upper is None else upper
+        if np.any(np.asarray(upper) < np.asarray(lower)):
+            raise ValueError("lower limit must be less than upper limit")
+        self.lower[:] = lower
+        self.upper[:] = upper
+        self.integral = np.clip(self.integral, self.lower, self.upper)
+        self.last_output = np.clip(self.last_output, self.lower, self.upper)
+
+    def __call__(self, input_, dt: float = None) -> np.ndarray:
+        """
+        Update all loops with their measurements and return their outputs
+
+        Args:
+            input_: the measurements, array of length n
+            dt: the time step, the time since the last update of each loop is used if not given
+        """
+        input_ = np.asarray(input_, dtype=np.float64)
+        now = self.time_fn()
+        if dt is None:
+            dt = now - self.last_time
+            dt[dt == 0] = 1e-16
+        elif dt <= 0:
+            raise ValueError(f"dt has negative value {dt}, must be positive")
+        else:
+            dt = np.full(self.n, dt, dtype=np.float64)
+
+        update = ~np.isnan(input_)
+        if self.sample_time is not None:
+            update &= (dt >= self.sample_time) | np.isnan(self.last_output)
+        if not update.any():
+            return self.last_output.copy()
+        x, dt = input_[update], dt[update]
+
+        error = self.setpoint[update] - x
+        last_input = self.last_input[update]
+        last_error = self.last_error[update]
+        d_input = x - np.where(np.isnan(last_input), x, last_input)
+        d_error = error - np.where(np.isnan(last_error), error, last_error)
+
+        if self.proportional_on_measurement:
+            self.proportional[update] -= self.kp[update] * d_input
+        else:
+            self.proportional[update] = self.kp[update] * error
+
+        lower, upper = self.lower[update], self.upper[update]
+        self.integral[update] = np.clip(self.integral[update] + self.ki[update] * error * dt, lower, upper)
+
+        if self.differential_on_measurement:
+            self.derivative[update] = -self.kd[update] * d_input / dt
+        else:
+            self.derivative[update] = self.kd[update] * d_error / dt
+
+        output = self.proportional[update] + self.integral[update] + self.derivative[update]
+        self.last_output[update] = np.clip(output, lower, upper)
+        self.last_input[update] = x
+        self.last_error[update] = error
+        self.last_time[update] = now
+        return self.last_output.copy()
+
+    @property
+    def components(self):
+        """
+        The P-, I- and D-terms of the last update of all loops
+        """
+        return self.proportional, self.integral, self.derivative
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# PID4FIWARE is a script in PIDControl, not a module of the package
+sys.path.insert(0, os.path.join(ROOT, "PIDControl"))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+# no cache of the validated configs and the provisioning, so that every test requests the fake broker
+os.environ["CONFIG_CACHE"] = ""
+
+from controller4fiware.config import ConfigCache  # noqa: E402
+from controller4fiware.fake_orion import FakeOrion  # noqa: E402
+from controller4fiware.provisioning import EntityProvisioner  # noqa: E402
+from controller4fiware import resilience  # noqa: E402
+from PID4FIWARE import PID4Fiware  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def circuit_breakers():
+    """
+    Every test starts with closed circuits, since the circuit breakers are shared per endpoint
+    """
+    resilience._shared_breakers.clear()
+
+
+@pytest.fixture
+def config_path() -> str:
+    """
+    The example configuration of the PID controller
+    """
+    return os.path.join(ROOT, "config", "pid")
+
+
+@pytest.fixture
+def orion(config_path, monkeypatch):
+    """
+    Fake context broker with the input and command entities of the configuration, which is used in
+    memory by the sessions of orion.session() or over HTTP after orion.start()
+    """
+    orion = FakeOrion()
+    for name in ("input", "command"):
+        with open(os.path.join(config_path, f"{name}.json"), "r") as f:
+            orion.add_entities(json.load(f))
+    monkeypatch.setenv("CB_URL", orion.url)
+    yield orion
+    if orion.thread.is_alive():
+        orion.stop()
+    else:
+        orion.server.server_close()
+
+
+@pytest.fixture
+def create_controller(orion, config_path, monkeypatch):
+    """
+    Factory of controllers, which use the fake context broker in memory. The controller entity is
+    provisioned, the configuration of the example PID controller is used if no path is given, and the
+    keyword arguments in upper case are set as environment variables, e.g.
+
+        controller = create_controller(RETRY_TOTAL="0")
+    """
+    def create(controller_class=PID4Fiware, path: str = None, token_manager=None, **env):
+        monkeypatch.setenv("RETRY_BACKOFF", "0")
+        for key, value in env.items():
+            monkeypatch.setenv(key, value)
+        controller = controller_class(config_path=path or config_path, session=orion.session(),
+                                      token_manager=token_manager)
+        EntityProvisioner(client=controller.ORION_CB, cache=ConfigCache(directory="")).provision(
+            entities=[controller.controller_entity_with_values()])
+        return controller
+    return create
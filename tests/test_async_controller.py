@@ -0,0 +1,37 @@
+"""
+Concurrent reads of the asyncio controller
+"""
+import asyncio
+import time
+import pytest
+import requests
+from PID4FIWARE import AsyncPID4Fiware
+
+
+@pytest.fixture
+def controller(create_controller, orion) -> AsyncPID4Fiware:
+    orion.set_value("urn:ngsi-ld:TemperatureSensor:001", "temperature", 18.0)
+    return create_controller(controller_class=AsyncPID4Fiware, RETRY_TOTAL="0")
+
+
+def test_read_variables_succeed(controller):
+    asyncio.run(controller.read_variables())
+    assert controller.active
+    assert controller.input_values.get("urn:ngsi-ld:TemperatureSensor:001", "temperature") == 18.0
+
+
+def test_failed_parameter_read_is_not_overwritten_by_later_input_read(controller, monkeypatch):
+    read_input_variable = controller.read_input_variable
+
+    def slow_read_input_variable():
+        # finishes after the failed parameter read
+        time.sleep(0.2)
+        return read_input_variable()
+
+    def get_entity(**kwargs):
+        raise requests.exceptions.ConnectionError("Orion is not reachable")
+
+    monkeypatch.setattr(controller, "read_input_variable", slow_read_input_variable)
+    monkeypatch.setattr(controller.ORION_CB, "get_entity", get_entity)
+    asyncio.run(controller.read_variables())
+    assert not controller.active
@@ -0,0 +1,77 @@
+"""
+Deadband, minimum resend interval and heartbeat of the commands
+"""
+from filip.models.ngsi_v2.context import ContextEntity
+from controller4fiware.command_filter import CommandFilter
+
+HEATER = "urn:ngsi-ld:Heater:001"
+
+
+def create_filter(**metadata) -> CommandFilter:
+    return CommandFilter(command_entities=[ContextEntity(id=HEATER, type="Heater", heaterPower={
+        "type": "command", "value": "",
+        "metadata": {name: {"type": "Number", "value": value} for name, value in metadata.items()}})])
+
+
+def send(command_filter: CommandFilter, value, now: float) -> bool:
+    due = command_filter.is_due(HEATER, "heaterPower", value, now)
+    if due:
+        command_filter.commit([(HEATER, "heaterPower", value)], now=now)
+    return due
+
+
+def test_every_command_is_sent_without_policy():
+    command_filter = create_filter()
+    assert [send(command_filter, 100.0, now) for now in range(3)] == [True, True, True]
+
+
+def test_deadband():
+    command_filter = create_filter(deadband=10)
+    assert send(command_filter, 100.0, 0)
+    assert not send(command_filter, 105.0, 1)
+    assert not send(command_filter, 90.0, 2)
+    assert send(command_filter, 111.0, 3)
+    # the deadband refers to the last sent value
+    assert not send(command_filter, 105.0, 4)
+
+
+def test_non_numeric_command_is_sent_if_changed():
+    command_filter = create_filter(deadband=10)
+    assert send(command_filter, "on", 0)
+    assert not send(command_filter, "on", 1)
+    assert send(command_filter, "off", 2)
+
+
+def test_minimum_resend_interval():
+    command_filter = create_filter(minResendInterval=5)
+    assert send(command_filter, 100.0, 0)
+    assert not send(command_filter, 200.0, 1)
+    assert not send(command_filter, 200.0, 4.9)
+    assert send(command_filter, 200.0, 5)
+    # an unchanged command is not sent again
+    assert not send(command_filter, 200.0, 20)
+
+
+def test_heartbeat_sends_unchanged_command():
+    command_filter = create_filter(deadband=10, heartbeatInterval=30)
+    assert send(command_filter, 100.0, 0)
+    assert not send(command_filter, 100.0, 29)
+    assert send(command_filter, 100.0, 30)
+    assert not send(command_filter, 100.0, 31)
+
+
+def test_uncommitted_command_is_due_again():
+    command_filter = create_filter(deadband=10)
+    assert send(command_filter, 100.0, 0)
+    # e.g. the transmission of the changed command has failed
+    assert command_filter.is_due(HEATER, "heaterPower", 150.0, 1)
+    assert command_filter.is_due(HEATER, "heaterPower", 150.0, 2)
+
+
+def test_environment_defaults(monkeypatch):
+    monkeypatch.setenv("COMMAND_DEADBAND", "10")
+    monkeypatch.setenv("COMMAND_MIN_INTERVAL", "5")
+    command_filter = create_filter(deadband=1)
+    policy = command_filter.policies[(HEATER, "heaterPower")]
+    # the metadata of the command override the defaults
+    assert (policy.deadband, policy.min_interval, policy.heartbeat) == (1, 5, 0)
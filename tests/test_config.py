@@ -0,0 +1,56 @@
+"""
+Validation and cache of the configuration
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PID4FIWARE = os.path.join(ROOT, "PIDControl", "PID4FIWARE.py")
+
+
+def check_config(config_path: str, cache_path: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, PID4FIWARE, "--check-config", config_path],
+                          env=dict(os.environ, CONFIG_CACHE=cache_path, PYTHONPATH=ROOT),
+                          capture_output=True, text=True)
+
+
+def test_invalid_config_is_not_cached(config_path, tmp_path):
+    path = str(tmp_path / "config")
+    shutil.copytree(config_path, path)
+    with open(os.path.join(path, "external_input.json"), "w") as f:
+        json.dump([{"name": "roomTemperature", "kind": "bogus", "id": "urn:ngsi-ld:Room:001",
+                    "type": "Room", "attr": "temperature"}], f)
+    for _ in range(2):
+        result = check_config(path, str(tmp_path / "cache"))
+        assert result.returncode == 1
+        assert "not valid" in result.stdout
+    os.remove(os.path.join(path, "external_input.json"))
+    for _ in range(2):
+        result = check_config(path, str(tmp_path / "cache"))
+        assert result.returncode == 0, result.stdout
+
+
+def test_failed_reload_is_repeated(create_controller, orion, config_path, tmp_path):
+    path = str(tmp_path / "config")
+    shutil.copytree(config_path, path)
+    controller = create_controller(path=path, CONFIG_RELOAD="true", CONFIG_RELOAD_INTERVAL="0")
+    with open(os.path.join(path, "controller.json"), "r") as f:
+        controller_dict = json.load(f)
+    controller_dict["id"] = "urn:ngsi-ld:PIDController:002"
+    controller_dict["kff"] = {"type": "Number", "value": 0.5, "metadata": {}}
+    with open(os.path.join(path, "controller.json"), "w") as f:
+        json.dump(controller_dict, f)
+    # the new controller entity cannot be created, the current config is kept
+    orion.fail_status = 503
+    assert not controller.reload_config()
+    assert controller.controller_entity.id == "urn:ngsi-ld:PIDController:001"
+    # the reload is repeated, although the files have not changed again
+    orion.fail_status = None
+    assert controller.reload_config()
+    assert controller.controller_entity.id == "urn:ngsi-ld:PIDController:002"
+    assert controller.parameter("kff") == 0.5
+    assert orion.get_value("urn:ngsi-ld:PIDController:002", "kff") == 0.5
+    assert not controller.reload_config()
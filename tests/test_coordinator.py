@@ -0,0 +1,33 @@
+"""
+Sharding of the controllers across worker processes
+"""
+from controller4fiware.coordinator import assign_shards
+
+KEYS = [f"/config/pid_{i:03d}" for i in range(200)]
+
+
+def shard_of(assignment) -> dict:
+    return {KEYS[i]: shard for shard, indices in enumerate(assignment) for i in indices}
+
+
+def test_assignment_is_stable():
+    assignment = assign_shards(KEYS, 4)
+    assert assignment == assign_shards(KEYS, 4)
+    assert sorted(i for indices in assignment for i in indices) == list(range(len(KEYS)))
+    # the keys are spread over all shards
+    assert all(len(indices) > len(KEYS) / 8 for indices in assignment)
+    # the shard of a key does not depend on the other keys
+    assert shard_of(assign_shards(KEYS[:50], 4)) == {key: shard for key, shard in shard_of(assignment).items()
+                                                     if key in KEYS[:50]}
+
+
+def test_added_shard_only_takes_over_keys():
+    before, after = shard_of(assign_shards(KEYS, 4)), shard_of(assign_shards(KEYS, 5))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(after[key] == 4 for key in moved)
+
+
+def test_removed_shard_only_hands_over_its_keys():
+    before, after = shard_of(assign_shards(KEYS, 5)), shard_of(assign_shards(KEYS, 4))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved and all(before[key] == 4 for key in moved)
@@ -0,0 +1,59 @@
+"""
+Event-driven mode with notifications of the fake context broker
+"""
+import socket
+import time
+from types import SimpleNamespace
+import pytest
+
+SENSOR = "urn:ngsi-ld:TemperatureSensor:001"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def controller(create_controller, orion):
+    port = free_port()
+    controller = create_controller(EVENT_MODE="true", NOTIFICATION_PORT=str(port),
+                                   NOTIFICATION_URL=f"http://127.0.0.1:{port}/notify", MAX_CYCLE_INTERVAL="1")
+    controller.subscribe_notifications()
+    yield controller
+    controller.unsubscribe_notifications()
+
+
+def test_notification_triggers_cycle(controller, orion):
+    orion.set_value(SENSOR, "temperature", 17.5)
+    assert controller.wait_for_notification(last_cycle_time=time.time())
+    assert controller.input_values.get(SENSOR, "temperature") == 17.5
+
+
+def test_unchanged_value_is_not_notified(controller, orion):
+    orion.set_value(SENSOR, "temperature", 17.5)
+    assert controller.wait_for_notification(last_cycle_time=time.time())
+    orion.set_value(SENSOR, "temperature", 17.5)
+    start = time.time()
+    assert not controller.wait_for_notification(last_cycle_time=start)
+    assert time.time() - start >= 0.9  # MAX_CYCLE_INTERVAL
+
+
+def test_parameter_notification(controller, orion):
+    orion.set_value(controller.controller_entity.id, "setpoint", 23.0)
+    assert controller.wait_for_notification(last_cycle_time=time.time())
+    assert controller.parameter("setpoint") == 23.0
+
+
+def test_only_leader_subscribes(controller, orion):
+    leader = False
+    controller.lease = SimpleNamespace(is_leader=lambda: leader)
+    assert not controller.check_leadership()
+    assert controller.subscription_id is None and controller.notification_receiver is None
+    assert orion.subscriptions == {}
+    leader = True
+    assert controller.check_leadership()
+    orion.set_value(SENSOR, "temperature", 16.5)
+    assert controller.wait_for_notification(last_cycle_time=time.time())
+    assert controller.input_values.get(SENSOR, "temperature") == 16.5
@@ -0,0 +1,39 @@
+"""
+Heartbeat of the controller host
+"""
+import threading
+import time
+from controller4fiware.host import ControllerHost
+from PID4FIWARE import PID4Fiware
+
+
+class BlockingController(PID4Fiware):
+    """
+    Controller whose control step blocks until it is released
+    """
+    release = threading.Event()
+
+    def control_step(self):
+        self.release.wait()
+
+
+def test_heartbeat_stops_while_steps_are_stuck(orion, config_path):
+    orion.start()
+    beats = []
+    host = ControllerHost(controller_class=BlockingController, config_paths=[config_path],
+                          sampling_times=[0.1], heartbeat=lambda: beats.append(time.monotonic()),
+                          heartbeat_interval=0.05)
+    thread = threading.Thread(target=host.run, daemon=True)
+    thread.start()
+    try:
+        time.sleep(0.5)
+        # only the dispatch of the first step, which is stuck
+        assert len(beats) == 1
+        BlockingController.release.set()
+        time.sleep(0.5)
+        assert len(beats) > 5
+        assert time.monotonic() - beats[-1] < 0.2
+    finally:
+        BlockingController.release.set()
+        host.stop()
+        thread.join()
@@ -0,0 +1,79 @@
+"""
+Leader election of redundant controller instances with a lease
+"""
+import pytest
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.context import ContextEntity
+from controller4fiware.lease import ControllerLease, FileLeaseStore, OrionLeaseStore
+from controller4fiware.scheduler import VirtualClock
+
+
+@pytest.fixture
+def clock() -> VirtualClock:
+    return VirtualClock(start=1000.0)
+
+
+@pytest.fixture
+def store(tmp_path) -> FileLeaseStore:
+    return FileLeaseStore(path=str(tmp_path / "controller.lease"))
+
+
+def create_lease(store, clock: VirtualClock, holder: str) -> ControllerLease:
+    return ControllerLease(store=store, holder=holder, duration=15, renew_interval=5, poll_interval=5,
+                           clock=clock.time)
+
+
+def test_free_lease_is_acquired_once(store, clock):
+    first, second = create_lease(store, clock, "a"), create_lease(store, clock, "b")
+    assert first.is_leader()
+    assert not second.is_leader()
+    assert store.read() == ("a", 1015.0)
+
+
+def test_leader_renews_the_lease(store, clock):
+    leader, standby = create_lease(store, clock, "a"), create_lease(store, clock, "b")
+    assert leader.is_leader()
+    assert not standby.is_leader()
+    for _ in range(10):
+        clock.sleep(5)
+        assert leader.is_leader()
+        assert not standby.is_leader()
+    assert store.read() == ("a", clock.time() + 15)
+
+
+def test_expired_lease_is_taken_over(store, clock):
+    leader, standby = create_lease(store, clock, "a"), create_lease(store, clock, "b")
+    assert leader.is_leader()
+    assert not standby.is_leader()
+    # the leader stops renewing, e.g. because it hangs
+    clock.sleep(14)
+    assert not standby.is_leader()
+    # the next poll after the expiration
+    clock.sleep(5)
+    assert standby.is_leader()
+    # the former leader steps down at its next renewal
+    assert not leader.is_leader()
+
+
+def test_released_lease_is_taken_over_at_next_poll(store, clock):
+    leader, standby = create_lease(store, clock, "a"), create_lease(store, clock, "b")
+    assert leader.is_leader()
+    assert not standby.is_leader()
+    leader.release()
+    assert not standby.is_leader()  # within the poll interval
+    clock.sleep(5)
+    assert standby.is_leader()
+
+
+def test_lease_in_controller_entity(orion, clock):
+    client = ContextBrokerClient(url=orion.url, session=orion.session())
+    entity = ContextEntity(id="urn:ngsi-ld:PIDController:001", type="PIDController",
+                           kp={"type": "Number", "value": 1.0})
+    client.post_entity(entity=entity)
+    leader = create_lease(OrionLeaseStore(client=client, entity=entity, settle_time=0), clock, "a")
+    standby = create_lease(OrionLeaseStore(client=client, entity=entity, settle_time=0), clock, "b")
+    assert leader.is_leader()
+    assert not standby.is_leader()
+    assert orion.get_value(entity.id, "leaseHolder") == "a"
+    clock.sleep(15)
+    assert standby.is_leader()
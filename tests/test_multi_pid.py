@@ -0,0 +1,43 @@
+"""
+Many PID loops in one controller
+"""
+import json
+import os
+import shutil
+from PID4FIWARE import MultiPID4Fiware
+
+
+def test_loop_without_measurement_sends_no_command(create_controller, orion, config_path):
+    orion.add_entities([
+        {"id": "urn:ngsi-ld:TemperatureSensor:002", "type": "TemperatureSensor",
+         "temperature": {"type": "Number", "value": None}},
+        {"id": "urn:ngsi-ld:Heater:002", "type": "Heater", "heaterPower": {"type": "command", "value": ""}}])
+    orion.set_value("urn:ngsi-ld:TemperatureSensor:001", "temperature", 18.0)
+    controller = create_controller(controller_class=MultiPID4Fiware,
+                                   path=os.path.join(os.path.dirname(config_path), "multi_pid"))
+    controller.control_step()
+    assert controller.active
+    assert isinstance(orion.get_value("urn:ngsi-ld:Heater:001", "heaterPower"), float)
+    # the second loop has no measurement yet
+    assert controller.command_values.get("urn:ngsi-ld:Heater:002", "heaterPower") is None
+    assert orion.get_value("urn:ngsi-ld:Heater:002", "heaterPower") == ""
+
+
+def test_loops_are_applied_only_after_valid_reload(create_controller, config_path, tmp_path):
+    path = str(tmp_path / "multi_pid")
+    shutil.copytree(os.path.join(os.path.dirname(config_path), "multi_pid"), path)
+    controller = create_controller(controller_class=MultiPID4Fiware, path=path, CONFIG_RELOAD="true",
+                                   CONFIG_RELOAD_INTERVAL="0")
+    with open(os.path.join(path, "loops.json"), "r") as f:
+        loops = json.load(f)
+    with open(os.path.join(path, "loops.json"), "w") as f:
+        json.dump(loops[:1], f)
+    with open(os.path.join(path, "external_input.json"), "w") as f:
+        json.dump([{"name": "roomTemperature", "kind": "bogus", "id": "urn:ngsi-ld:Room:001",
+                    "attr": "temperature"}], f)
+    assert not controller.reload_config()
+    assert len(controller.loops) == 2
+    os.remove(os.path.join(path, "external_input.json"))
+    assert controller.reload_config()
+    assert len(controller.loops) == 1
+    assert controller.pid.n == 1
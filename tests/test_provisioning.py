@@ -0,0 +1,50 @@
+"""
+Provisioning of the controller entities
+"""
+import pytest
+from filip.clients.ngsi_v2 import ContextBrokerClient
+from filip.models.ngsi_v2.context import ContextEntity
+from controller4fiware.config import ConfigCache
+from controller4fiware.provisioning import EntityProvisioner
+
+CONTROLLER = "urn:ngsi-ld:PIDController:001"
+
+
+def controller_entity(**attrs) -> ContextEntity:
+    attrs = attrs or {"kp": {"type": "Number", "value": 1.0}}
+    return ContextEntity(id=CONTROLLER, type="PIDController", **attrs)
+
+
+@pytest.fixture
+def client(orion) -> ContextBrokerClient:
+    return ContextBrokerClient(url=orion.url, session=orion.session())
+
+
+def test_provisioning_is_idempotent(client, orion):
+    provisioner = EntityProvisioner(client=client, cache=ConfigCache(directory=""))
+    assert [entity.id for entity in provisioner.provision([controller_entity()])] == [CONTROLLER]
+    orion.set_value(CONTROLLER, "kp", 2.0)
+    # the existing entity keeps its value
+    assert provisioner.provision([controller_entity()]) == []
+    assert orion.get_value(CONTROLLER, "kp") == 2.0
+
+
+def test_existing_entity_with_different_schema_is_rejected(client):
+    provisioner = EntityProvisioner(client=client, cache=ConfigCache(directory=""))
+    provisioner.provision([controller_entity()])
+    with pytest.raises(NameError):
+        provisioner.provision([controller_entity(kp={"type": "Number", "value": 1.0},
+                                                 ki={"type": "Number", "value": 0.1})])
+
+
+def test_cached_provisioning_is_invalidated_after_deletion(client, orion, tmp_path):
+    provisioner = EntityProvisioner(client=client, cache=ConfigCache(directory=str(tmp_path)))
+    provisioner.provision([controller_entity()])
+    orion.reset_requests()
+    # a cached provisioning does not request the context broker
+    assert provisioner.provision([controller_entity()]) == []
+    assert orion.reset_requests() == 0
+    del orion.entities[CONTROLLER]
+    provisioner.invalidate([controller_entity()])
+    assert [entity.id for entity in provisioner.provision([controller_entity()])] == [CONTROLLER]
+    assert orion.get_value(CONTROLLER, "kp") == 1.0
@@ -0,0 +1,96 @@
+"""
+Retries and circuit breakers of the I/O of the controllers
+"""
+import pytest
+import requests
+from controller4fiware.resilience import CircuitBreaker
+from PID4FIWARE import PID4Fiware
+
+
+def test_failed_parameter_read_is_retried_and_opens_circuit(create_controller, orion):
+    controller = create_controller(PARAMETER_REFRESH_TIME="60", RETRY_TOTAL="2",
+                                   CIRCUIT_FAILURE_THRESHOLD="1")
+    orion.fail_status = 503
+    orion.reset_requests()
+    assert controller.read_controller_parameter() is None
+    assert orion.reset_requests() == 3  # first request and two retries
+    assert not controller.active
+    assert controller.circuit_breakers["orion"].state == CircuitBreaker.OPEN
+
+
+def test_parameters_are_read_after_failure_within_refresh_time(create_controller, orion):
+    controller = create_controller(PARAMETER_REFRESH_TIME="60", RETRY_TOTAL="0")
+    orion.fail_status = 503
+    controller.read_controller_parameter()
+    orion.fail_status = None
+    orion.set_value(controller.controller_entity.id, "kp", 1234)
+    assert controller.read_controller_parameter()
+    assert controller.parameter("kp") == 1234
+    # within the refresh time, the parameters are not read again
+    orion.reset_requests()
+    assert controller.read_controller_parameter()
+    assert orion.reset_requests() == 0
+
+
+def test_circuit_is_shared_by_controllers_of_the_same_endpoint(create_controller, orion):
+    controller = create_controller(RETRY_TOTAL="1", CIRCUIT_FAILURE_THRESHOLD="2")
+    others = [create_controller() for _ in range(4)]
+    assert all(other.circuit_breakers["orion"] is controller.circuit_breakers["orion"] for other in others)
+    orion.fail_status = 503
+    orion.reset_requests()
+    for other in [controller] + others:
+        other.read_controller_parameter()
+    # the circuit opens after two failed reads with one retry each, the other controllers skip the request
+    assert orion.reset_requests() == 4
+    assert controller.circuit_breakers["orion"].state == CircuitBreaker.OPEN
+
+
+def test_non_transient_error_of_half_open_trial_opens_circuit(create_controller, orion):
+    controller = create_controller(RETRY_TOTAL="0", CIRCUIT_FAILURE_THRESHOLD="1", CIRCUIT_RESET_TIMEOUT="0")
+    breaker = controller.circuit_breakers["orion"]
+    orion.fail_status = 503
+    controller.read_controller_parameter()
+    assert breaker.state == CircuitBreaker.OPEN
+    # the trial request fails with a client error, which is raised
+    orion.fail_status = 400
+    with pytest.raises(requests.exceptions.HTTPError):
+        controller.read_controller_parameter()
+    assert breaker.state == CircuitBreaker.OPEN
+    # a further trial is allowed after the reset timeout
+    orion.fail_status = None
+    assert controller.read_controller_parameter()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_deleted_controller_entity_is_created_again(create_controller, orion):
+    controller = create_controller()
+    orion.set_value(controller.controller_entity.id, "kp", 1234)
+    assert controller.read_controller_parameter()
+    del orion.entities[controller.controller_entity.id]
+    assert controller.read_controller_parameter() is False
+    assert not controller.active
+    # the new entity is created with the current parameters, which are read in the next cycle
+    assert orion.get_value(controller.controller_entity.id, "kp") == 1234
+    assert controller.read_controller_parameter()
+    assert controller.parameter("kp") == 1234
+
+
+class LegacyController(PID4Fiware):
+    """
+    Controller that writes the commands to the entities instead of the value table
+    """
+    def control_algorithm(self):
+        for entity in self.command_entities:
+            attrs = entity.get_attributes()
+            for _attr in attrs:
+                _attr.value = 20
+            entity.update_attribute(attrs)
+
+
+def test_control_algorithm_writing_entities_fails(create_controller):
+    controller = create_controller(controller_class=LegacyController)
+    # the entities of the configuration are cleared, their values are kept in the value tables
+    assert controller.controller_entity.kp.value is None
+    assert controller.parameter("kp") is not None
+    with pytest.raises(RuntimeError):
+        controller.control_algorithm()
@@ -0,0 +1,64 @@
+"""
+Fixed-rate scheduling of the control cycles
+"""
+from typing import List, Tuple
+import pytest
+from controller4fiware.scheduler import CycleScheduler, VirtualClock
+
+
+def run_cycles(overrun_policy: str, durations: List[float]) -> Tuple[CycleScheduler, List[float]]:
+    """
+    Run cycles of the given durations on a virtual clock
+
+    Returns:
+        the scheduler and the start times of the cycles
+    """
+    clock = VirtualClock()
+    scheduler = CycleScheduler(period=1.0, overrun_policy=overrun_policy, clock=clock.time, sleep=clock.sleep)
+    scheduler.start()
+    starts = []
+    for duration in durations:
+        starts.append(clock.time())
+        clock.sleep(duration)
+        scheduler.wait()
+    starts.append(clock.time())
+    return scheduler, starts
+
+
+def test_cycles_without_overrun_keep_the_deadlines():
+    scheduler, starts = run_cycles(CycleScheduler.SKIP, [0.2, 0.5, 0.9])
+    assert starts == [0.0, 1.0, 2.0, 3.0]
+    assert scheduler.overruns == 0
+    assert scheduler.max_jitter == 0.0
+
+
+def test_skip_policy_starts_at_the_next_deadline():
+    scheduler, starts = run_cycles(CycleScheduler.SKIP, [2.5, 0.2, 0.2])
+    assert starts == pytest.approx([0.0, 3.0, 4.0, 5.0])
+    assert scheduler.overruns == 1
+    assert scheduler.skipped_cycles == 2
+
+
+def test_catch_up_policy_executes_the_missed_cycles():
+    scheduler, starts = run_cycles(CycleScheduler.CATCH_UP, [2.5, 0.2, 0.2, 0.2])
+    # the cycles of the deadlines 1 and 2 start immediately, then the deadlines are met again
+    assert starts == pytest.approx([0.0, 2.5, 2.7, 3.0, 4.0])
+    assert scheduler.overruns == 2
+    assert scheduler.skipped_cycles == 0
+
+
+def test_immediate_policy_shifts_the_deadlines():
+    scheduler, starts = run_cycles(CycleScheduler.IMMEDIATE, [2.5, 0.2, 0.2])
+    assert starts == pytest.approx([0.0, 2.5, 3.5, 4.5])
+    assert scheduler.overruns == 1
+
+
+def test_wait_reports_overrun():
+    clock = VirtualClock()
+    scheduler = CycleScheduler(period=1.0, clock=clock.time, sleep=clock.sleep)
+    scheduler.start()
+    clock.sleep(0.5)
+    assert not scheduler.wait()
+    clock.sleep(1.5)
+    assert scheduler.wait()
+    assert scheduler.cycles == 2
@@ -0,0 +1,12 @@
+"""
+Token handling in security mode
+"""
+from types import SimpleNamespace
+
+
+def test_token_is_applied_to_all_clients(create_controller):
+    token_manager = SimpleNamespace(start=lambda: None, kcp=None, token=("token", 300))
+    controller = create_controller(token_manager=token_manager, SECURITY_MODE="true")
+    controller.update_token()
+    assert controller.ORION_CB.headers["Authorization"] == "Bearer token"
+    assert controller.QL_CB.headers["Authorization"] == "Bearer token"
@@ -0,0 +1,28 @@
+"""
+External inputs from QuantumLeap
+"""
+import requests
+from controller4fiware.timeseries import HistoryInput
+
+
+def test_failed_fetch_is_retried(create_controller, monkeypatch):
+    controller = create_controller(RETRY_TOTAL="1")
+    controller.external_inputs = {"roomTemperature": HistoryInput(
+        name="roomTemperature", entity_id="urn:ngsi-ld:Room:001", entity_type="Room",
+        attr_name="temperature", refresh_time=600)}
+    calls = []
+
+    def get_entity_attr_values_by_id(**kwargs):
+        calls.append(kwargs)
+        response = requests.Response()
+        response.status_code = 503
+        raise requests.exceptions.HTTPError("Service Unavailable", response=response)
+
+    monkeypatch.setattr(controller.QL_CB, "get_entity_attr_values_by_id", get_entity_attr_values_by_id)
+    assert controller.read_external_input() is None
+    assert len(calls) == 2  # first request and one retry
+    assert controller.circuit_breakers["quantumleap"].failures == 1
+    assert not controller.active
+    # the fetch is repeated in the next cycle, although the refresh time is not up
+    controller.read_external_input()
+    assert len(calls) == 4
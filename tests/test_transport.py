@@ -0,0 +1,117 @@
+"""
+Direct MQTT transport between controller and devices
+"""
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+from filip.models.ngsi_v2.context import ContextEntity
+from filip.models.ngsi_v2.iot import Device, DeviceAttribute, ServiceGroup
+from controller4fiware.resilience import CircuitBreaker
+from controller4fiware.transport import HybridTransport, MqttTransport
+from controller4fiware.value_table import ValueTable
+
+
+def create_transport() -> MqttTransport:
+    devices = [Device(device_id="sensor:001", entity_name="urn:ngsi-ld:TemperatureSensor:001",
+                      entity_type="TemperatureSensor", protocol="PDI-IoTA-UltraLight", transport="MQTT",
+                      attributes=[DeviceAttribute(name="temperature", type="Number", object_id="t"),
+                                  DeviceAttribute(name="heating", type="Boolean", object_id="h")]),
+               Device(device_id="sensor:002", entity_name="urn:ngsi-ld:TemperatureSensor:002",
+                      entity_type="TemperatureSensor", protocol="IoTA-JSON", transport="MQTT")]
+    groups = [ServiceGroup(resource="/iot/json", apikey="json-all"),
+              ServiceGroup(resource="/iot/d", apikey="ul-other", entity_type="Heater"),
+              ServiceGroup(resource="/iot/d", apikey="ul-all"),
+              ServiceGroup(resource="/iot/d", apikey="ul-sensors", entity_type="TemperatureSensor")]
+    return MqttTransport(devices=devices, service_groups=groups, mqtt_url="mqtt://localhost:1883")
+
+
+def heater(entity_id: str, power: float) -> ContextEntity:
+    return ContextEntity(id=entity_id, type="Heater", heaterPower={"type": "command", "value": power})
+
+
+def message(topic: str, payload: str):
+    return SimpleNamespace(topic=topic, payload=payload.encode("utf-8"))
+
+
+def test_ultralight_measurements_are_converted():
+    transport = create_transport()
+    transport._on_message(None, None, message("/ul/ul-sensors/sensor:001/attrs", "t|21.5|h|true"))
+    table = ValueTable([ContextEntity(id="urn:ngsi-ld:TemperatureSensor:001", type="TemperatureSensor",
+                                      temperature={"type": "Number", "value": None})])
+    assert transport.read_inputs(table=table) == []
+    assert table.values == [21.5]
+    assert transport.values[("sensor:001", "h")] is True
+
+
+def test_invalid_ultralight_measurement_is_ignored():
+    transport = create_transport()
+    transport._on_message(None, None, message("/ul/ul-sensors/sensor:001/attrs/t", "warm"))
+    assert ("sensor:001", "t") not in transport.values
+
+
+def test_apikey_of_service_group_is_matched():
+    transport = create_transport()
+    devices = {device.device_id: device for device in transport.devices.values()}
+    assert transport._apikey(devices["sensor:001"]) == "ul-sensors"
+    assert transport._apikey(devices["sensor:002"]) == "json-all"
+    transport.client.service_groups.pop("json-all")
+    with pytest.raises(KeyError):
+        transport._apikey(devices["sensor:002"])
+
+
+def test_hybrid_transport_merges_pending_commands_and_reports_sent_commands():
+    started, release = threading.Event(), threading.Event()
+    sent_batches, reported = [], []
+
+    def send(entities):
+        sent_batches.append({(entity.id, _comm.name): _comm.value
+                             for entity in entities for _comm in entity.get_attributes()})
+        started.set()
+        release.wait(timeout=5)
+
+    transport = HybridTransport(send=send, on_sent=reported.append, devices=[], service_groups=[],
+                                mqtt_url="mqtt://localhost:1883")
+    transport._thread.start()
+    transport.send_commands([heater("urn:ngsi-ld:Heater:000", 1.0)])
+    assert started.wait(timeout=5)
+    # both commands are handed over while the first batch is still being sent
+    transport.send_commands([heater("urn:ngsi-ld:Heater:001", 10.0)])
+    transport.send_commands([heater("urn:ngsi-ld:Heater:002", 20.0), heater("urn:ngsi-ld:Heater:001", 11.0)])
+    release.set()
+    deadline = time.time() + 5
+    while len(reported) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sent_batches[1] == {("urn:ngsi-ld:Heater:001", "heaterPower"): 11.0,
+                               ("urn:ngsi-ld:Heater:002", "heaterPower"): 20.0}
+    assert sorted(reported[1]) == [("urn:ngsi-ld:Heater:001", "heaterPower", 11.0),
+                                   ("urn:ngsi-ld:Heater:002", "heaterPower", 20.0)]
+
+
+def test_hybrid_transport_does_not_report_failed_commands():
+    reported = []
+
+    def send(entities):
+        raise ConnectionError("Orion is not reachable")
+
+    transport = HybridTransport(send=send, on_sent=reported.append, devices=[], service_groups=[],
+                                mqtt_url="mqtt://localhost:1883")
+    transport._thread.start()
+    transport.send_commands([heater("urn:ngsi-ld:Heater:001", 10.0)])
+    time.sleep(0.2)
+    assert reported == []
+
+
+def test_mqtt_transport_is_independent_of_orion_circuit(create_controller):
+    controller = create_controller()
+    sent = []
+    controller.transport = SimpleNamespace(read_inputs=lambda table: [],
+                                           send_commands=lambda entities: sent.append(entities) or True)
+    controller.circuit_breakers["mqtt"] = CircuitBreaker()
+    # e.g. opened by other controllers of the same Orion
+    controller.circuit_breakers["orion"].state = CircuitBreaker.OPEN
+    controller.circuit_breakers["orion"].opened_at = time.monotonic()
+    assert controller.read_input_variable()
+    controller.command_values.fill(1.0)
+    controller.send_commands()
+    assert len(sent) == 1
@@ -0,0 +1,85 @@
+"""
+Equivalence of VectorPID with simple_pid.PID
+"""
+import numpy as np
+import pytest
+from simple_pid import PID
+from controller4fiware.vector_pid import VectorPID
+
+N = 20
+STEPS = 300
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def create_loops(rng, proportional_on_measurement, differential_on_measurement, clock):
+    kp, ki, kd = rng.uniform(0.5, 5, N), rng.uniform(0, 1, N), rng.uniform(0, 0.5, N)
+    setpoint = rng.uniform(18, 24, N)
+    limits = (rng.uniform(-20, 0, N), rng.uniform(50, 100, N))
+    options = dict(proportional_on_measurement=proportional_on_measurement,
+                   differential_on_measurement=differential_on_measurement)
+    loops = [PID(kp[i], ki[i], kd[i], setpoint=setpoint[i], output_limits=(limits[0][i], limits[1][i]),
+                 time_fn=clock, **options) for i in range(N)]
+    vector = VectorPID(n=N, kp=kp, ki=ki, kd=kd, setpoint=setpoint, output_limits=limits, time_fn=clock,
+                       **options)
+    return loops, vector
+
+
+@pytest.mark.parametrize("proportional_on_measurement", [False, True])
+@pytest.mark.parametrize("differential_on_measurement", [False, True])
+@pytest.mark.parametrize("fixed_dt", [False, True])
+def test_equivalent_to_simple_pid(proportional_on_measurement, differential_on_measurement, fixed_dt):
+    rng = np.random.default_rng(0)
+    clock = Clock()
+    loops, vector = create_loops(rng, proportional_on_measurement, differential_on_measurement, clock)
+    for step in range(STEPS):
+        clock.now += rng.uniform(0.5, 2)
+        if step == 100:
+            # change of the limits, which also clamps the integral
+            lower, upper = rng.uniform(-5, 5, N), rng.uniform(10, 30, N)
+            vector.output_limits = (lower, upper)
+            for i, loop in enumerate(loops):
+                loop.output_limits = (lower[i], upper[i])
+        if step == 200:
+            kp, ki, kd, setpoint = rng.uniform(0.5, 5, N), rng.uniform(0, 1, N), rng.uniform(0, 0.5, N), \
+                rng.uniform(18, 24, N)
+            vector.tunings = (kp, ki, kd)
+            vector.setpoint[:] = setpoint
+            for i, loop in enumerate(loops):
+                loop.tunings = (kp[i], ki[i], kd[i])
+                loop.setpoint = setpoint[i]
+        measurement = rng.uniform(10, 30, N)
+        # missing measurements, the loops keep their last output
+        measurement[rng.random(N) < 0.1] = np.nan
+        dt = 1.0 if fixed_dt else None
+        expected = np.full(N, np.nan)
+        for i, loop in enumerate(loops):
+            if not np.isnan(measurement[i]):
+                expected[i] = loop(measurement[i], dt=dt)
+            elif loop._last_output is not None:
+                # the last output is clamped to changed limits
+                expected[i] = loop._last_output
+        np.testing.assert_allclose(vector(measurement, dt=dt), expected, rtol=1e-12, atol=1e-9)
+
+
+def test_nan_measurement_keeps_last_output():
+    vector = VectorPID(n=2, kp=1, ki=0.1, setpoint=20, output_limits=(0, 100), time_fn=Clock())
+    first = vector([15.0, 25.0], dt=1)
+    second = vector([np.nan, 24.0], dt=1)
+    assert second[0] == first[0]
+    assert vector.last_input[0] == 15.0
+
+
+def test_select_keeps_the_state_of_the_loops():
+    vector = VectorPID(n=3, kp=[1, 2, 3], ki=0.5, setpoint=20, time_fn=Clock())
+    vector([10.0, 15.0, 18.0], dt=1)
+    selected = vector.select([2, -1, 0])
+    assert selected.kp.tolist() == [3, 1, 1]  # the new loop has the default gain
+    assert selected.integral[0] == vector.integral[2]
+    assert selected.integral[1] == 0 and np.isnan(selected.last_output[1])